@@ -0,0 +1,586 @@
+"""
+CardVault benchmarks
+Run against a local stack, e.g. with the ML service started as ML_BACKEND=fake:
+
+    python bench.py scan-throughput --api http://localhost:8000 --scans 200 --concurrency 16
+
+In-process benchmarks build a throwaway SQLite database instead:
+
+    python bench.py search --sizes 10000 100000
+    python bench.py prices --rows 1000000
+    python bench.py catalog --cards 100000
+    python bench.py matches --users 10000 --cards 1000
+    python bench.py match-scoring --candidates 1000 10000 100000 1000000
+    python bench.py trades --holdings 100 1000 10000
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def summarize(label: str, seconds: list):
+    if not seconds:
+        print(f"{label}: no samples")
+        return
+    print(
+        f"{label}: n={len(seconds)} mean={statistics.mean(seconds) * 1000:.1f}ms "
+        f"p50={percentile(seconds, 0.5) * 1000:.1f}ms p95={percentile(seconds, 0.95) * 1000:.1f}ms "
+        f"max={max(seconds) * 1000:.1f}ms"
+    )
+
+
+def random_jpeg(width: int = 800, height: int = 600) -> bytes:
+    """Noise image, so every upload is distinct and misses the scan and perceptual-hash caches."""
+    from PIL import Image
+    img = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
+
+
+async def bench_scan_throughput(args):
+    """Upload scans concurrently and poll each one to completion through the public API."""
+    import httpx
+
+    async with httpx.AsyncClient(base_url=args.api, timeout=120.0) as client:
+        suffix = uuid.uuid4().hex[:8]
+        credentials = {"email": f"bench-{suffix}@example.com", "password": "bench-password", "username": f"bench-{suffix}"}
+        await client.post("/api/v1/auth/register", json=credentials)
+        login = await client.post("/api/v1/auth/login", json={"email": credentials["email"], "password": credentials["password"]})
+        headers = {"Authorization": f"Bearer {login.json()['data']['access_token']}"}
+        await client.post("/api/v1/subscription/upgrade", json={"tier": "premium"}, headers=headers)
+
+        images = [random_jpeg() for _ in range(args.scans)]
+        semaphore = asyncio.Semaphore(args.concurrency)
+        upload_latencies = []
+        end_to_end = []
+        statuses = {}
+
+        async def run_one(image_bytes: bytes):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(
+                    "/api/v1/scans/upload",
+                    files={"image": ("bench.jpg", image_bytes, "image/jpeg")},
+                    data={"scan_type": args.scan_type},
+                    headers=headers
+                )
+                upload_latencies.append(time.perf_counter() - started)
+            scan_id = response.json()["data"]["scan_id"]
+            while True:
+                poll = await client.get(f"/api/v1/scans/{scan_id}", headers=headers)
+                status = poll.json()["data"]["status"]
+                if status in ("completed", "failed"):
+                    break
+                await asyncio.sleep(args.poll_interval)
+            end_to_end.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_one(image) for image in images))
+        elapsed = time.perf_counter() - started
+
+    print(f"{args.scans} scans ({args.scan_type}) with concurrency {args.concurrency} in {elapsed:.2f}s")
+    print(f"throughput: {args.scans / elapsed:.2f} scans/s, statuses: {statuses}")
+    summarize("upload request", upload_latencies)
+    summarize("upload to completed", end_to_end)
+
+
+def load_backend(database_name: str):
+    """Import the API module against a fresh SQLite database in a temp directory."""
+    workdir = tempfile.mkdtemp(prefix="cardvault-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, database_name)}"
+    os.environ.setdefault("BLOB_GC_INTERVAL_SECONDS", "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import main as backend
+    return backend
+
+
+def random_card_name(rng: random.Random) -> str:
+    """Pronounceable made-up names ("Vorakin Tessel"), varied enough that trigrams aren't all shared."""
+    def syllable():
+        return rng.choice("bcdfghklmnprstvwz") + rng.choice("aeiouy") + rng.choice(["", "", "n", "r", "s", "l", "k"])
+    words = ["".join(syllable() for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 3))]
+    return " ".join(word.capitalize() for word in words)
+
+
+def typo(rng: random.Random, word: str) -> str:
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def bench_search(args):
+    """Inventory search latency: the old LIKE scan vs the search index, per collection size."""
+    backend = load_backend("search.db")
+    rng = random.Random(args.seed)
+    db = backend.SessionLocal()
+    print(f"FTS index available: {backend.inventory_fts_available}")
+
+    for size in args.sizes:
+        user = backend.User(email=f"{size}@bench.local", username=f"bench-{size}", password_hash="x")
+        db.add(user)
+        db.commit()
+        names = [random_card_name(rng) for _ in range(size)]
+        db.bulk_insert_mappings(backend.InventoryEntry, [
+            {
+                "id": str(uuid.uuid4()), "user_id": user.id, "card_name": name,
+                "set_code": f"{rng.choice(['BS', 'JU', 'SV', 'OP'])}{rng.randint(1, 9)}",
+                "quantity": 1, "condition": "Near Mint", "scanned_at": backend.datetime.utcnow()
+            }
+            for name in names
+        ])
+        db.commit()
+
+        sample = max((rng.choice(names) for _ in range(20)), key=len).split()[0]
+        queries = {
+            "prefix": sample[:5],
+            "substring": sample[2:6],
+            "typo": typo(rng, sample),
+            "no match": "Qxzvq",
+            "set code": "SV2",
+        }
+
+        print(f"\n{size} entries for one user")
+        for label, term in queries.items():
+            base = db.query(backend.InventoryEntry).filter(backend.InventoryEntry.user_id == user.id)
+            runs = {
+                "LIKE": lambda: base.filter(
+                    backend.InventoryEntry.card_name.contains(term) | backend.InventoryEntry.set_code.contains(term)
+                ).order_by(backend.InventoryEntry.scanned_at.desc()).limit(args.limit).all(),
+                "index": lambda: backend.inventory_search_filter(base, term).order_by(
+                    backend.InventoryEntry.scanned_at.desc()
+                ).limit(args.limit).all(),
+                "ranked": lambda: backend.search_inventory_ranked(db, user.id, term, args.limit),
+            }
+            for name, run in runs.items():
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    found = run()
+                    timings.append(time.perf_counter() - started)
+                summarize(f"  {label:<9} {term!r:<11} {name:<6} ({len(found):>3} hits)", timings)
+    db.close()
+
+
+def bench_prices(args):
+    """Price feed ingest throughput (upsert + propagation to holdings) and cached price lookups."""
+    backend = load_backend("prices.db")
+    rng = random.Random(args.seed)
+    conditions = ["", "Near Mint", "Lightly Played", "Moderately Played"]
+
+    feed_path = os.path.abspath("feed.csv")
+    keys = []
+    started = time.perf_counter()
+    with open(feed_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "set_code", "condition", "price"])
+        for _ in range(args.rows):
+            key = (random_card_name(rng), f"{rng.choice(['BS', 'JU', 'SV', 'OP'])}{rng.randint(1, 9)}", rng.choice(conditions))
+            keys.append(key)
+            writer.writerow([*key, f"{rng.uniform(0.1, 500):.2f}"])
+    print(f"Wrote {args.rows} feed rows in {time.perf_counter() - started:.1f}s ({os.path.getsize(feed_path) / 1e6:.0f} MB)")
+
+    # Holdings for a spread of users, all of them priced by the feed
+    db = backend.SessionLocal()
+    users = [backend.User(email=f"{i}@bench.local", username=f"bench-{i}", password_hash="x") for i in range(args.users)]
+    db.add_all(users)
+    db.commit()
+    holdings = {}
+    for name, set_code, condition in rng.sample(keys, min(args.holdings, len(keys))):
+        user = rng.choice(users)
+        holding_key = (user.id, backend.normalize_card_key(name), set_code, condition or "Near Mint")
+        holdings[holding_key] = {
+            "id": str(uuid.uuid4()), "user_id": user.id, "card_key": holding_key[1], "card_name": name,
+            "set_code": set_code, "condition": holding_key[3], "quantity": rng.randint(1, 4), "current_value": 0.0
+        }
+    db.bulk_insert_mappings(backend.InventoryEntry, list(holdings.values()))
+    db.commit()
+    backend.reconcile_user_summaries(db)
+    print(f"{len(holdings)} holdings across {args.users} users")
+
+    for label in ("first load", "unchanged reload"):
+        stats = backend.ingest_price_feed(db, feed_path)
+        print(
+            f"{label}: {stats['upserted']} rows upserted in {stats['ingest_seconds']:.1f}s "
+            f"({stats['upserted'] / stats['ingest_seconds']:,.0f} rows/s); "
+            f"{stats['propagated']['holdings']} holdings / {stats['propagated']['users']} users repriced "
+            f"in {stats['propagated']['seconds']:.2f}s; total {stats['total_seconds']:.1f}s"
+        )
+
+    samples = [rng.choice(keys) for _ in range(args.lookups)]
+    for label in ("cold", "warm"):
+        timings = []
+        for name, set_code, condition in samples:
+            lookup_started = time.perf_counter()
+            backend.lookup_price(db, backend.normalize_card_key(name), set_code, condition or "Near Mint")
+            timings.append(time.perf_counter() - lookup_started)
+        summarize(f"lookup_price ({label} cache)", timings)
+    print(f"drift after ingest: {backend.reconcile_user_summaries(db, repair=False)}")
+    db.close()
+
+
+def bench_catalog(args):
+    """Catalog load and resolver build time, and per-lookup resolution latency by kind of input."""
+    backend = load_backend("catalog.db")
+    rng = random.Random(args.seed)
+
+    catalog_path = os.path.abspath("catalog.csv")
+    names = []
+    with open(catalog_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "set_code", "number", "domain"])
+        for number in range(args.cards):
+            name = random_card_name(rng)
+            names.append(name)
+            writer.writerow([name, f"{rng.choice(['BS', 'JU', 'SV', 'OP'])}{rng.randint(1, 9)}", number, "pokemon"])
+
+    db = backend.SessionLocal()
+    stats = backend.load_catalog_file(db, catalog_path)
+    print(f"Loaded {stats['loaded']} catalog rows in {stats['seconds']:.1f}s")
+    started = time.perf_counter()
+    backend.refresh_catalog_resolver(db)
+    resolver = backend.catalog_resolver
+    print(f"Built resolver over {resolver.stats()['names']} names in {time.perf_counter() - started:.1f}s")
+
+    samples = [rng.choice(names) for _ in range(args.lookups)]
+    inputs = {
+        "exact": samples,
+        "case/spacing": [f"  {name.upper()} " for name in samples],
+        "typo": [typo(rng, name) if len(name) > 4 else name for name in samples],
+        "unknown": [f"Qx{random_card_name(rng)}zq" for _ in samples],
+    }
+    for label, queries in inputs.items():
+        timings, resolved = [], 0
+        for query in queries:
+            lookup_started = time.perf_counter()
+            match = resolver.resolve(query)
+            timings.append(time.perf_counter() - lookup_started)
+            resolved += match is not None
+        summarize(f"  resolve {label:<13} ({resolved}/{len(queries)} resolved)", timings)
+
+    for length in (1, 2, 3, 5, 8):
+        timings, completed = [], 0
+        for name in samples:
+            word = rng.choice(name.split())
+            lookup_started = time.perf_counter()
+            suggestions = resolver.suggest(word[:length], limit=10)
+            timings.append(time.perf_counter() - lookup_started)
+            completed += bool(suggestions)
+        summarize(f"  suggest {length} chars      ({completed}/{len(samples)} completed)", timings)
+
+    # Cards added after startup are picked up by the periodic refresh without a full rebuild
+    extra_path = os.path.abspath("catalog-extra.csv")
+    with open(extra_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "set_code", "number", "domain"])
+        for number in range(args.cards, args.cards + 1000):
+            writer.writerow([random_card_name(rng), "NEW1", number, "pokemon"])
+    backend.load_catalog_file(db, extra_path)
+    started = time.perf_counter()
+    added = backend.refresh_catalog_resolver(db)
+    print(f"Refreshed resolver with {added} new rows in {(time.perf_counter() - started) * 1000:.0f}ms")
+    db.close()
+
+
+def legacy_matches(backend, db, user) -> list:
+    """The per-want scan get_matches ran before the match index, for comparison."""
+    matches = []
+    for want in db.query(backend.Want).filter(backend.Want.user_id == user.id).all():
+        q = db.query(backend.InventoryEntry, backend.User).join(backend.User, backend.InventoryEntry.user_id == backend.User.id)
+        q = q.filter(backend.User.id != user.id, backend.User.marketplace_enabled == True)  # noqa: E712
+        if want.catalog_id:
+            q = q.filter(backend.InventoryEntry.catalog_id == want.catalog_id)
+        else:
+            if want.card_key:
+                q = q.filter(backend.InventoryEntry.card_key == want.card_key)
+            else:
+                q = q.filter(backend.InventoryEntry.card_name.ilike(f"%{want.card_name}%"))
+            if want.set_code:
+                q = q.filter(backend.InventoryEntry.set_code == want.set_code)
+        matches += q.limit(10).all()
+    return matches
+
+
+def bench_matches(args):
+    """Marketplace match index: full rebuild and check, per-change upkeep, and reads vs the old per-want scan."""
+    backend = load_backend("matches.db")
+    rng = random.Random(args.seed)
+    db = backend.SessionLocal()
+    pool = [(name, backend.normalize_card_key(name), f"{rng.choice(['BS', 'JU', 'SV', 'OP'])}{rng.randint(1, 9)}")
+            for name in {random_card_name(rng) for _ in range(args.pool)}]
+
+    started = time.perf_counter()
+    users = [{
+        "id": str(uuid.uuid4()), "email": f"{i}@bench.local", "username": f"bench-{i}", "password_hash": "x",
+        "marketplace_enabled": rng.random() < args.enabled
+    } for i in range(args.users)]
+    db.bulk_insert_mappings(backend.User, users)
+    now = backend.datetime.utcnow()
+    for user in users:
+        db.bulk_insert_mappings(backend.InventoryEntry, [{
+            "id": str(uuid.uuid4()), "user_id": user["id"], "card_name": name, "card_key": card_key, "set_code": set_code,
+            "condition": "Near Mint", "quantity": 1, "current_value": 1.0, "scanned_at": now
+        } for name, card_key, set_code in rng.sample(pool, min(args.cards, len(pool)))])
+        db.bulk_insert_mappings(backend.Want, [{
+            "id": str(uuid.uuid4()), "user_id": user["id"], "card_name": name, "card_key": card_key, "created_at": now
+        } for name, card_key, _ in rng.sample(pool, args.wants)])
+    db.commit()
+    print(f"{args.users} users x {args.cards} holdings, {args.wants} wants each, in {time.perf_counter() - started:.0f}s")
+
+    stats = backend.rebuild_marketplace_matches(db)
+    print(f"Rebuilt index: {stats['matches']} matches in {stats['seconds']:.1f}s")
+    started = time.perf_counter()
+    print(f"Checked index: {backend.check_marketplace_matches(db)} in {time.perf_counter() - started:.1f}s")
+
+    sample = [db.get(backend.User, user["id"]) for user in rng.sample(users, min(args.reads, len(users)))]
+    for label, read in [
+        ("per-want scan", lambda user: legacy_matches(backend, db, user)),
+        ("match index", lambda user: asyncio.run(backend.get_matches(current_user=user, db=db))["data"]["items"]),
+    ]:
+        timings, found = [], 0
+        for user in sample:
+            read_started = time.perf_counter()
+            found += len(read(user))
+            timings.append(time.perf_counter() - read_started)
+        summarize(f"  read {label:<14} ({found / len(sample):.0f} matches/user)", timings)
+
+    # Upkeep per change, each in its own transaction like the endpoints
+    timings = {"want created": [], "scan saved (10 cards)": [], "marketplace on": [], "marketplace off": []}
+    for user in sample[:20]:
+        name, card_key, _ = rng.choice(pool)
+        want = backend.Want(user_id=user.id, card_name=name, card_key=card_key)
+        db.add(want)
+        db.flush()
+        started = time.perf_counter()
+        backend.sync_marketplace_matches(db, want_ids=[want.id])
+        timings["want created"].append(time.perf_counter() - started)
+        db.commit()
+
+        entries = [{
+            "id": str(uuid.uuid4()), "user_id": user.id, "card_name": name, "card_key": card_key, "set_code": "NEW",
+            "condition": "Near Mint", "quantity": 1, "scanned_at": now
+        } for name, card_key, _ in rng.sample(pool, 10)]
+        db.bulk_insert_mappings(backend.InventoryEntry, entries)
+        started = time.perf_counter()
+        backend.sync_marketplace_matches(db, entry_ids=[entry["id"] for entry in entries])
+        timings["scan saved (10 cards)"].append(time.perf_counter() - started)
+        db.commit()
+
+        enabled = bool(user.marketplace_enabled)
+        for label in (["marketplace off", "marketplace on"] if enabled else ["marketplace on", "marketplace off"]):
+            user.marketplace_enabled = label == "marketplace on"
+            db.flush()
+            started = time.perf_counter()
+            if user.marketplace_enabled:
+                backend.sync_marketplace_matches(db, owner_id=user.id)
+            else:
+                backend.remove_marketplace_matches(db, owner_id=user.id)
+            timings[label].append(time.perf_counter() - started)
+            db.commit()
+    for label, values in timings.items():
+        summarize(f"  sync {label:<22}", values)
+    db.close()
+
+
+def score_candidates_per_row(backend, candidates: dict, per_want: int) -> list:
+    """The same scoring as score_marketplace_candidates, one candidate at a time, for comparison."""
+    weights = backend.MARKETPLACE_SCORE_WEIGHTS
+    total = sum(weights.values())
+    best = {}
+    for i in range(len(candidates["want"])):
+        value, max_price = candidates["value"][i], candidates["max_price"][i]
+        if candidates["condition_rank"][i] < candidates["min_condition_rank"][i] or 0 < value > max_price:
+            continue
+        price = (max_price - value) / max_price if max_price > 0 and value > 0 else 0.0
+        score = 100 * (
+            weights["card"] * (0 < candidates["want_catalog_id"][i] == candidates["catalog_id"][i]) +
+            weights["set"] * ("" != candidates["want_set_code"][i] == candidates["set_code"][i]) +
+            weights["name"] * backend._name_similarity(candidates["want_key"][i], candidates["card_key"][i]) +
+            weights["condition"] * max(candidates["condition_rank"][i], 0) / (len(backend.CARD_CONDITIONS) - 1) +
+            weights["price"] * min(max(price, 0.0), 1.0)
+        ) / total
+        best.setdefault(candidates["want"][i], []).append((score, i))
+    return [i for scored in best.values() for _, i in sorted(scored, reverse=True)[:per_want]]
+
+
+def bench_match_scoring(args):
+    """Marketplace match scoring throughput: candidates scored per second, vectorized vs one at a time."""
+    import numpy as np
+    backend = load_backend("scoring.db")
+    rng = random.Random(args.seed)
+    sets = [f"{prefix}{n}" for prefix in ["BS", "JU", "SV", "OP"] for n in range(1, 10)]
+    names = [backend.normalize_card_key(random_card_name(rng)) for _ in range(200)]
+
+    for size in args.candidates:
+        wants = max(1, size // args.candidates_per_want)
+        want_names = [rng.choice(names) for _ in range(wants)]
+        want_sets = [rng.choice(sets + [""] * 9) for _ in range(wants)]
+        want_ids = [rng.randrange(wants) for _ in range(size)]
+        # Mostly same-name holdings (card_key matches), some from the name-contains fallback
+        card_keys = [want_names[w] if rng.random() < 0.9 else f"{rng.choice(names)} {want_names[w]}" for w in want_ids]
+        candidates = {
+            "want": np.array(want_ids),
+            "want_catalog_id": np.array([w % 3 and w + 1 for w in want_ids]),
+            "catalog_id": np.array([w + 1 if rng.random() < 0.5 else 0 for w in want_ids]),
+            "want_set_code": np.array([want_sets[w] for w in want_ids], dtype=str),
+            "set_code": np.array([rng.choice(sets) for _ in range(size)], dtype=str),
+            "want_key": np.array([want_names[w] for w in want_ids], dtype=str),
+            "card_key": np.array(card_keys, dtype=str),
+            "condition_rank": np.array([rng.randrange(5) for _ in range(size)]),
+            "min_condition_rank": np.array([rng.choice([-1, -1, 2, 3]) for _ in range(size)]),
+            "value": np.array([rng.uniform(0.5, 400) if rng.random() < 0.95 else float("nan") for _ in range(size)]),
+            "max_price": np.array([rng.choice([float("nan"), 50.0, 200.0]) for _ in range(size)]),
+        }
+        print(f"\n{size} candidates across {wants} wants")
+        runs = [("vectorized", lambda: backend.score_marketplace_candidates(candidates, args.per_want)[0])]
+        if size <= args.per_row_max:
+            runs.append(("per row", lambda: score_candidates_per_row(backend, candidates, args.per_want)))
+        for label, run in runs:
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                kept = run()
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            print(f"  {label:<10} {best * 1000:8.1f}ms  {best / size * 1e9:7.0f}ns/candidate  "
+                  f"{size / best:12,.0f} candidates/s  ({len(kept)} kept)")
+
+
+def bench_trades(args):
+    """Trade suggestions: solver time by items per side, and the endpoint by inventory size."""
+    backend = load_backend("trades.db")
+    rng = random.Random(args.seed)
+
+    print("Solver alone (no time budget)")
+    for items in args.items:
+        timings, found = [], 0
+        for _ in range(args.repeat):
+            give = [round(rng.lognormvariate(2, 1.5), 2) for _ in range(items)]
+            receive = [round(rng.lognormvariate(2, 1.5), 2) for _ in range(items)]
+            started = time.perf_counter()
+            result = backend.solve_balanced_trade(give, receive)
+            timings.append(time.perf_counter() - started)
+            found += result["trade"] is not None
+        summarize(f"  {items:>2} items/side, {2 ** items:>9,} subsets/side ({found}/{args.repeat} balanced)", timings)
+
+    db = backend.SessionLocal()
+    now = backend.datetime.utcnow()
+    for size in args.holdings:
+        pair = [backend.User(email=f"{size}-{i}@bench.local", username=f"bench-{size}-{i}", password_hash="x",
+                             marketplace_enabled=True) for i in range(2)]
+        db.add_all(pair)
+        db.flush()
+        holdings = {}
+        for user in pair:
+            names = {random_card_name(rng) for _ in range(size)}
+            holdings[user.id] = list(names)
+            db.bulk_insert_mappings(backend.InventoryEntry, [{
+                "id": str(uuid.uuid4()), "user_id": user.id, "card_name": name,
+                "card_key": backend.normalize_card_key(name), "set_code": "BS", "condition": "Near Mint",
+                "quantity": 1, "current_value": round(rng.lognormvariate(2, 1.5), 2), "scanned_at": now
+            } for name in names])
+        # Each side wants a share of the other's holdings
+        for user, other in (pair, pair[::-1]):
+            db.bulk_insert_mappings(backend.Want, [{
+                "id": str(uuid.uuid4()), "user_id": user.id, "card_name": name,
+                "card_key": backend.normalize_card_key(name), "created_at": now
+            } for name in rng.sample(holdings[other.id], max(1, int(size * args.wanted)))])
+        db.commit()
+        backend.sync_marketplace_matches(db, owner_id=pair[0].id, notify=False)
+        backend.sync_marketplace_matches(db, owner_id=pair[1].id, notify=False)
+        db.commit()
+
+        timings, result = [], None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            result = asyncio.run(backend.suggest_trades(with_user_id=pair[1].id, current_user=pair[0], db=db))["data"]
+            timings.append(time.perf_counter() - started)
+        trade = result["trades"][0] if result["trades"] else None
+        detail = (f"{len(trade['give'])} for {len(trade['receive'])} cards, "
+                  f"{trade['give_value']:.2f} vs {trade['receive_value']:.2f}") if trade else "no balanced trade"
+        summarize(f"  {size:>6} holdings/user, {int(size * args.wanted)} wanted each way ({detail})", timings)
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CardVault benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan-throughput", help="end-to-end scan pipeline throughput")
+    scan_parser.add_argument("--api", default="http://localhost:8000")
+    scan_parser.add_argument("--scans", type=int, default=100)
+    scan_parser.add_argument("--concurrency", type=int, default=16)
+    scan_parser.add_argument("--scan-type", default="single", choices=["single", "multi"])
+    scan_parser.add_argument("--poll-interval", type=float, default=0.25)
+    scan_parser.set_defaults(handler=lambda args: asyncio.run(bench_scan_throughput(args)))
+
+    search_parser = subparsers.add_parser("search", help="inventory search latency by collection size")
+    search_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    search_parser.add_argument("--limit", type=int, default=50)
+    search_parser.add_argument("--repeat", type=int, default=20)
+    search_parser.add_argument("--seed", type=int, default=7)
+    search_parser.set_defaults(handler=bench_search)
+
+    prices_parser = subparsers.add_parser("prices", help="price feed ingest throughput and cached lookups")
+    prices_parser.add_argument("--rows", type=int, default=1000000)
+    prices_parser.add_argument("--holdings", type=int, default=100000)
+    prices_parser.add_argument("--users", type=int, default=1000)
+    prices_parser.add_argument("--lookups", type=int, default=2000)
+    prices_parser.add_argument("--seed", type=int, default=7)
+    prices_parser.set_defaults(handler=bench_prices)
+
+    catalog_parser = subparsers.add_parser("catalog", help="catalog load and name resolution latency")
+    catalog_parser.add_argument("--cards", type=int, default=100000)
+    catalog_parser.add_argument("--lookups", type=int, default=2000)
+    catalog_parser.add_argument("--seed", type=int, default=7)
+    catalog_parser.set_defaults(handler=bench_catalog)
+
+    matches_parser = subparsers.add_parser("matches", help="marketplace match index upkeep and reads")
+    matches_parser.add_argument("--users", type=int, default=10000)
+    matches_parser.add_argument("--cards", type=int, default=1000, help="holdings per user")
+    matches_parser.add_argument("--wants", type=int, default=10, help="wants per user")
+    matches_parser.add_argument("--pool", type=int, default=50000, help="distinct cards to draw from")
+    matches_parser.add_argument("--enabled", type=float, default=0.5, help="share of users in the marketplace")
+    matches_parser.add_argument("--reads", type=int, default=50)
+    matches_parser.add_argument("--seed", type=int, default=7)
+    matches_parser.set_defaults(handler=bench_matches)
+
+    scoring_parser = subparsers.add_parser("match-scoring", help="marketplace match scoring throughput")
+    scoring_parser.add_argument("--candidates", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    scoring_parser.add_argument("--candidates-per-want", type=int, default=50)
+    scoring_parser.add_argument("--per-want", type=int, default=10)
+    scoring_parser.add_argument("--per-row-max", type=int, default=100000, help="largest size also scored one row at a time")
+    scoring_parser.add_argument("--repeat", type=int, default=5)
+    scoring_parser.add_argument("--seed", type=int, default=7)
+    scoring_parser.set_defaults(handler=bench_match_scoring)
+
+    trades_parser = subparsers.add_parser("trades", help="trade suggestion solve time by inventory size")
+    trades_parser.add_argument("--holdings", type=int, nargs="+", default=[100, 1000, 10000], help="holdings per user")
+    trades_parser.add_argument("--wanted", type=float, default=0.2, help="share of the other user's holdings wanted")
+    trades_parser.add_argument("--items", type=int, nargs="+", default=[8, 12, 16, 20], help="solver items per side")
+    trades_parser.add_argument("--repeat", type=int, default=10)
+    trades_parser.add_argument("--seed", type=int, default=7)
+    trades_parser.set_defaults(handler=bench_trades)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,44 @@
 CardVault Backend API Server
 FastAPI-based REST API for MVP
 """
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, String, Integer, Float, Boolean, DateTime, ForeignKey, Text
+from fastapi.responses import FileResponse
+from sqlalchemy import create_engine, Column, String, Integer, Float, Boolean, Date, DateTime, ForeignKey, Text, Index, case
+from sqlalchemy import column, func, insert, literal, or_, select, text, tuple_
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy.orm import aliased, sessionmaker, Session, relationship
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import asyncio
+import base64
+import bisect
+import copy
+import csv
+import hashlib
+import heapq
+import io
+import math
+import mimetypes
+import random
+import shutil
+import threading
+import time
+import unicodedata
 import jwt
 import bcrypt
 import uuid
 import os
 import json
-import re
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import httpx
+import numpy as np
 
 app = FastAPI(title="CardVault API", version="1.0.0")
 
@@ -45,6 +65,108 @@ security = HTTPBearer()
 
 # ML Service URL
 ML_SERVICE_URL = os.getenv("ML_SERVICE_URL", "http://cube-challenge-ml-service-1:8001")
+ML_REQUEST_TIMEOUT_SECONDS = float(os.getenv("ML_REQUEST_TIMEOUT_SECONDS", "60"))
+ML_MAX_CONNECTIONS = int(os.getenv("ML_MAX_CONNECTIONS", "20"))
+ML_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("ML_MAX_KEEPALIVE_CONNECTIONS", "10"))
+ML_RETRY_ATTEMPTS = int(os.getenv("ML_RETRY_ATTEMPTS", "3"))
+ML_RETRY_BASE_SECONDS = float(os.getenv("ML_RETRY_BASE_SECONDS", "0.5"))
+ML_HEDGE_DELAY_SECONDS = float(os.getenv("ML_HEDGE_DELAY_SECONDS", "0"))  # 0 disables hedged requests
+ML_BREAKER_FAILURE_THRESHOLD = int(os.getenv("ML_BREAKER_FAILURE_THRESHOLD", "5"))
+ML_BREAKER_RESET_SECONDS = float(os.getenv("ML_BREAKER_RESET_SECONDS", "30"))
+
+# Scan job queue
+SCAN_WORKER_CONCURRENCY = int(os.getenv("SCAN_WORKER_CONCURRENCY", "4"))  # 0 disables workers in this process
+SCAN_JOB_MAX_ATTEMPTS = int(os.getenv("SCAN_JOB_MAX_ATTEMPTS", "3"))
+SCAN_JOB_RETRY_BASE_SECONDS = float(os.getenv("SCAN_JOB_RETRY_BASE_SECONDS", "2"))
+SCAN_JOB_POLL_SECONDS = float(os.getenv("SCAN_JOB_POLL_SECONDS", "1"))
+SCAN_JOB_LEASE_SECONDS = float(os.getenv("SCAN_JOB_LEASE_SECONDS", "120"))  # Renewed every quarter lease while the ML call runs
+
+# Scan result cache (keyed by image SHA-256, scan type and model version)
+ML_MODEL_VERSION = os.getenv("ML_MODEL_VERSION", "gemini-2.0-flash")  # Until the ML service reports its own
+SCAN_CACHE_MAX_ENTRIES = int(os.getenv("SCAN_CACHE_MAX_ENTRIES", "1000"))
+SCAN_CACHE_TTL_SECONDS = float(os.getenv("SCAN_CACHE_TTL_SECONDS", "86400"))
+
+# Upload ingestion
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(256 * 1024)))
+BULK_UPLOAD_MAX_IMAGES = int(os.getenv("BULK_UPLOAD_MAX_IMAGES", "100"))
+
+# Card cropping
+CROP_WORKERS = int(os.getenv("CROP_WORKERS", "4"))
+CROP_JPEG_QUALITY = int(os.getenv("CROP_JPEG_QUALITY", "90"))
+THUMBNAIL_SIZES = {"small": 160, "medium": 480}  # Longest side in pixels
+THUMBNAIL_WEBP_QUALITY = int(os.getenv("THUMBNAIL_WEBP_QUALITY", "80"))
+THUMBNAIL_JPEG_QUALITY = int(os.getenv("THUMBNAIL_JPEG_QUALITY", "80"))
+THUMBNAIL_BACKFILL_PER_REQUEST = int(os.getenv("THUMBNAIL_BACKFILL_PER_REQUEST", "50"))
+RENDITION_VERSION = 1  # Bump when sizes or encoder settings change; old keys are left in place
+
+# Inventory listing
+INVENTORY_DEFAULT_PAGE_SIZE = int(os.getenv("INVENTORY_DEFAULT_PAGE_SIZE", "100"))
+INVENTORY_MAX_PAGE_SIZE = int(os.getenv("INVENTORY_MAX_PAGE_SIZE", "200"))
+INVENTORY_COUNT_TTL_SECONDS = float(os.getenv("INVENTORY_COUNT_TTL_SECONDS", "30"))
+INVENTORY_COUNT_CACHE_ENTRIES = int(os.getenv("INVENTORY_COUNT_CACHE_ENTRIES", "10000"))
+INVENTORY_SEARCH_MIN_SIMILARITY = float(os.getenv("INVENTORY_SEARCH_MIN_SIMILARITY", "0.3"))
+INVENTORY_SEARCH_FUZZY_CANDIDATES = int(os.getenv("INVENTORY_SEARCH_FUZZY_CANDIDATES", "500"))
+
+# Blob storage
+BLOB_STORE = os.getenv("BLOB_STORE", "local")  # "local" (uploads/ directory) or "s3"
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", str(24 * 3600)))
+BLOB_GC_INTERVAL_SECONDS = float(os.getenv("BLOB_GC_INTERVAL_SECONDS", "3600"))  # 0 disables GC in this process
+S3_BUCKET = os.getenv("S3_BUCKET", "cardvault")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. http://minio:9000 for a local stand-in
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL")  # Public-read base URL (bucket or CDN); defaults to <endpoint>/<bucket>
+
+# Dashboard summaries
+RECENT_SCAN_DAYS = int(os.getenv("RECENT_SCAN_DAYS", "7"))
+SCAN_DAY_RETENTION_DAYS = int(os.getenv("SCAN_DAY_RETENTION_DAYS", "30"))
+SUMMARY_RECONCILE_INTERVAL_SECONDS = float(os.getenv("SUMMARY_RECONCILE_INTERVAL_SECONDS", str(6 * 3600)))  # 0 disables
+
+# Portfolio history
+PORTFOLIO_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("PORTFOLIO_SNAPSHOT_INTERVAL_SECONDS", "900"))  # 0 disables
+PORTFOLIO_RAW_RETENTION_HOURS = int(os.getenv("PORTFOLIO_RAW_RETENTION_HOURS", "48"))
+PORTFOLIO_HOURLY_RETENTION_DAYS = int(os.getenv("PORTFOLIO_HOURLY_RETENTION_DAYS", "90"))
+PORTFOLIO_DAILY_RETENTION_DAYS = int(os.getenv("PORTFOLIO_DAILY_RETENTION_DAYS", "730"))
+PORTFOLIO_HISTORY_RANGES = {  # range -> (span, resolution served)
+    "24h": (timedelta(hours=24), "raw"),
+    "7d": (timedelta(days=7), "hour"),
+    "30d": (timedelta(days=30), "hour"),
+    "90d": (timedelta(days=90), "day"),
+    "1y": (timedelta(days=365), "day"),
+}
+
+# Pricing
+PRICE_INGEST_BATCH_SIZE = int(os.getenv("PRICE_INGEST_BATCH_SIZE", "5000"))
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "50000"))
+PRICE_CACHE_TTL_SECONDS = float(os.getenv("PRICE_CACHE_TTL_SECONDS", "3600"))
+PRICE_REFRESH_INTERVAL_SECONDS = float(os.getenv("PRICE_REFRESH_INTERVAL_SECONDS", "30"))  # 0 disables
+
+# Card catalog
+CATALOG_LOAD_BATCH_SIZE = int(os.getenv("CATALOG_LOAD_BATCH_SIZE", "5000"))
+CATALOG_MATCH_MIN_SIMILARITY = float(os.getenv("CATALOG_MATCH_MIN_SIMILARITY", "0.5"))  # fuzzy hits whose set and number agree
+CATALOG_FUZZY_MIN_SIMILARITY = float(os.getenv("CATALOG_FUZZY_MIN_SIMILARITY", "0.75"))  # fuzzy hits on the name alone
+CATALOG_REFRESH_INTERVAL_SECONDS = float(os.getenv("CATALOG_REFRESH_INTERVAL_SECONDS", "60"))  # 0 disables
+CATALOG_SUGGEST_MAX_LIMIT = int(os.getenv("CATALOG_SUGGEST_MAX_LIMIT", "25"))
+CATALOG_SUGGEST_SHORT_PREFIX = int(os.getenv("CATALOG_SUGGEST_SHORT_PREFIX", "3"))  # ranked lists built up front for prefixes up to this long
+CATALOG_SUGGEST_SCAN_LIMIT = int(os.getenv("CATALOG_SUGGEST_SCAN_LIMIT", "1000"))  # longer prefixes matching more entries keep a ranked list too
+
+# Marketplace
+MARKETPLACE_MATCHES_DEFAULT_PAGE_SIZE = int(os.getenv("MARKETPLACE_MATCHES_DEFAULT_PAGE_SIZE", "50"))
+MARKETPLACE_MATCHES_MAX_PAGE_SIZE = int(os.getenv("MARKETPLACE_MATCHES_MAX_PAGE_SIZE", "200"))
+MARKETPLACE_MATCH_NOTIFY_LIMIT = int(os.getenv("MARKETPLACE_MATCH_NOTIFY_LIMIT", "5"))  # per user, per change
+MARKETPLACE_MATCHES_PER_WANT = int(os.getenv("MARKETPLACE_MATCHES_PER_WANT", "10"))
+MARKETPLACE_RESCORE_BATCH_SIZE = int(os.getenv("MARKETPLACE_RESCORE_BATCH_SIZE", "5000"))
+MARKETPLACE_SCORE_WEIGHTS = {  # docs/marketplace-algorithm.md; there are no seller ratings to weigh yet
+    "card": float(os.getenv("MARKETPLACE_WEIGHT_CARD", "100")),  # Same printing (catalog_id)
+    "set": float(os.getenv("MARKETPLACE_WEIGHT_SET", "50")),  # Same set as the want names
+    "name": float(os.getenv("MARKETPLACE_WEIGHT_NAME", "30")),  # Word Jaccard of the names
+    "condition": float(os.getenv("MARKETPLACE_WEIGHT_CONDITION", "20")),  # Better condition scores higher
+    "price": float(os.getenv("MARKETPLACE_WEIGHT_PRICE", "10")),  # Further under the want's max_price
+}
+MARKETPLACE_TRADE_BALANCE_TOLERANCE = float(os.getenv("MARKETPLACE_TRADE_BALANCE_TOLERANCE", "0.15"))
+MARKETPLACE_TRADE_MAX_ITEMS = int(os.getenv("MARKETPLACE_TRADE_MAX_ITEMS", "16"))  # Per side; the solver enumerates 2^n subsets
+MARKETPLACE_TRADE_PARTNERS = int(os.getenv("MARKETPLACE_TRADE_PARTNERS", "10"))
+MARKETPLACE_TRADE_TIME_BUDGET_SECONDS = float(os.getenv("MARKETPLACE_TRADE_TIME_BUDGET_SECONDS", "0.5"))
 
 
 class Scan(Base):
@@ -57,6 +179,30 @@ class Scan(Base):
     results = Column(Text, nullable=True)  # JSON string
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class Blob(Base):
+    """Reference count of a stored blob (see BlobStore); rows at zero are garbage-collected."""
+    __tablename__ = "blobs"
+    key = Column(String, primary_key=True)
+    ref_count = Column(Integer, default=0)
+    zero_since = Column(DateTime, nullable=True, index=True)  # When ref_count last dropped to 0
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ScanJob(Base):
+    """Durable work item for the scan worker pool, one per uploaded scan."""
+    __tablename__ = "scan_jobs"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    scan_id = Column(String, ForeignKey("scans.id"), index=True)
+    status = Column(String, default="queued", index=True)  # "queued", "processing", "completed", "failed"
+    attempts = Column(Integer, default=0)
+    image_filename = Column(String, nullable=True)
+    image_content_type = Column(String, nullable=True)
+    image_sha256 = Column(String, nullable=True)
+    bypass_cache = Column(Boolean, default=False)
+    next_run_at = Column(DateTime, default=datetime.utcnow, index=True)
+    locked_at = Column(DateTime, nullable=True)  # Lease start while status == "processing"
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 # Database Models
 class User(Base):
     __tablename__ = "users"
@@ -77,77 +223,477 @@ class User(Base):
     
     inventory = relationship("InventoryEntry", back_populates="user")
 
+# Blob storage
+# Images and their derivatives live in a BlobStore under content-addressed keys such as
+# "<sha256>.jpg" or "cropped/<sha256>.jpg". The DB keeps "uploads/<key>" paths (the local layout),
+# and the blobs table counts references from Scan and InventoryEntry rows so unreferenced files
+# can be collected after BLOB_GC_GRACE_SECONDS.
+BLOB_PATH_PREFIX = "uploads/"
+
+
+class BlobStore(ABC):
+    """Storage backend interface. Keys are relative, "/"-separated paths."""
+
+    @abstractmethod
+    def put_bytes(self, key: str, data: bytes):
+        ...
+
+    @abstractmethod
+    def put_file(self, key: str, source_path: Path):
+        """Move a local temp file into the store (the source is consumed)."""
+
+    @abstractmethod
+    def get_bytes(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str):
+        ...
+
+    @abstractmethod
+    def list(self):
+        """Yield (key, last_modified_timestamp) for every stored blob."""
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        ...
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Filesystem path of the blob when the store is local, else None."""
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under a directory (served by the /uploads static mount)."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def put_bytes(self, key: str, data: bytes):
+        path = self._path(key)
+        if path.exists():
+            os.utime(path)  # Content is identical; refresh the mtime so GC treats it as new
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def put_file(self, key: str, source_path: Path):
+        path = self._path(key)
+        if path.exists():
+            source_path.unlink()
+            os.utime(path)
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source_path, path)
+
+    def get_bytes(self, key: str) -> bytes:
+        return self._path(key).read_bytes()
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def delete_prefix(self, prefix: str):
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+    def list(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                try:
+                    modified = path.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                yield path.relative_to(self.root).as_posix(), modified
+
+    def url(self, key: str) -> str:
+        return f"/uploads/{key}"
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self._path(key)
+
+
+class S3BlobStore(BlobStore):
+    """Blobs in an S3-compatible bucket (AWS S3, MinIO, ...). Requires boto3."""
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 public_url: Optional[str] = None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("BLOB_STORE=s3 requires boto3 (pip install boto3)")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.bucket = bucket
+        self.client_error = ClientError
+        if public_url:
+            self.public_url = public_url.rstrip("/")
+        elif endpoint_url:
+            self.public_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            self.public_url = f"https://{bucket}.s3.amazonaws.com"
+        try:
+            self.client.head_bucket(Bucket=bucket)
+        except ClientError:
+            self.client.create_bucket(Bucket=bucket)  # Convenience for local stand-ins
+
+    def put_bytes(self, key: str, data: bytes):
+        if self.exists(key):
+            return
+        content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+
+    def put_file(self, key: str, source_path: Path):
+        try:
+            if not self.exists(key):
+                content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+                self.client.upload_file(str(source_path), self.bucket, key, ExtraArgs={"ContentType": content_type})
+        finally:
+            source_path.unlink(missing_ok=True)
+
+    def get_bytes(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self.client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_prefix(self, prefix: str):
+        keys = [key for key, _ in self._list(prefix.rstrip("/") + "/")]
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": True}
+            )
+
+    def _list(self, prefix: str = ""):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"], obj["LastModified"].timestamp()
+
+    def list(self):
+        return self._list()
+
+    def url(self, key: str) -> str:
+        return f"{self.public_url}/{key}"
+
+
+def create_blob_store() -> BlobStore:
+    if BLOB_STORE == "s3":
+        return S3BlobStore(S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, S3_PUBLIC_URL)
+    if BLOB_STORE != "local":
+        raise ValueError(f"Unknown BLOB_STORE: {BLOB_STORE}")
+    return LocalBlobStore(Path("uploads"))
+
+
+blob_store = create_blob_store()
+
+
+def blob_key(stored_path: Optional[str]) -> Optional[str]:
+    """Map an image path as stored in the DB ("uploads/<key>") to its blob key."""
+    if not stored_path:
+        return None
+    path = stored_path.replace("\\", "/")
+    if BLOB_PATH_PREFIX in path:
+        return path.split(BLOB_PATH_PREFIX, 1)[1]
+    return Path(path).name
+
+
+def blob_path(key: str) -> str:
+    return f"{BLOB_PATH_PREFIX}{key}"
+
+
+def stored_image_url(stored_path: Optional[str]) -> Optional[str]:
+    """URL for an image path as stored in the DB, served by the blob store (absolute URLs pass through)."""
+    if not stored_path or stored_path.startswith("http"):
+        return stored_path
+    return blob_store.url(blob_key(stored_path))
+
+
+def rendition_blob_key(thumbnail_key: Optional[str]) -> Optional[str]:
+    """All renditions of one source are counted as a single blob, "renditions/<key>"."""
+    return f"renditions/{thumbnail_key}" if thumbnail_key else None
+
+
+# Image renditions
+# Small/medium WebP + JPEG copies of each crop, stored under a key derived from the source bytes.
+# A key's files never change, so they are served with strong ETags and immutable caching.
+RENDITION_FORMATS = {"webp": ("WEBP", "image/webp"), "jpg": ("JPEG", "image/jpeg")}
+
+
+def rendition_key(source_bytes: bytes) -> str:
+    return hashlib.sha256(f"v{RENDITION_VERSION}:".encode() + source_bytes).hexdigest()[:32]
+
+
+def write_renditions(img, key: str) -> str:
+    """Write every size/format for one source image (an RGB PIL image). Returns the key."""
+    from PIL import Image
+    if blob_store.exists(f"renditions/{key}/small.jpg"):  # Written last, so the key is complete
+        return key
+
+    # Largest first so each smaller size is resampled from the previous one
+    for size, max_dim in sorted(THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+        img = img.copy()
+        img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        for ext, (pil_format, _) in RENDITION_FORMATS.items():
+            buffer = io.BytesIO()
+            if pil_format == "WEBP":
+                img.save(buffer, pil_format, quality=THUMBNAIL_WEBP_QUALITY, method=4)
+            else:
+                img.save(buffer, pil_format, quality=THUMBNAIL_JPEG_QUALITY, progressive=True)
+            blob_store.put_bytes(f"renditions/{key}/{size}.{ext}", buffer.getvalue())
+    return key
+
+
+def create_renditions_from_file(image_path: str) -> Optional[str]:
+    """Backfill renditions for a stored image. Returns the key, or None if it can't be read."""
+    from PIL import Image, ImageOps
+    try:
+        source_bytes = blob_store.get_bytes(blob_key(image_path))
+        key = rendition_key(source_bytes)
+        if blob_store.exists(f"renditions/{key}/small.jpg"):
+            return key
+        img = Image.open(io.BytesIO(source_bytes))
+        img.draft("RGB", (max(THUMBNAIL_SIZES.values()),) * 2)  # JPEG: decode at reduced scale
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        return write_renditions(img, key)
+    except Exception as e:
+        print(f"Error creating renditions for {image_path}: {e}")
+        return None
+
+
+def rendition_urls(key: Optional[str]) -> Optional[dict]:
+    if not key:
+        return None
+    return {
+        size: {ext: f"/api/v1/images/{key}/{size}.{ext}" for ext in RENDITION_FORMATS}
+        for size in THUMBNAIL_SIZES
+    }
+
+
 # Image processing
-def crop_card_image(original_image_path: str, bounding_box: dict, card_id: str) -> Optional[str]:
+# Every box of a scan is cut from one decoded copy of the original; crops are encoded and
+# written in parallel (Pillow releases the GIL while encoding).
+crop_executor = ThreadPoolExecutor(max_workers=CROP_WORKERS, thread_name_prefix="crop")
+crop_totals = {"scans": 0, "crops": 0, "decode_ms": 0.0, "encode_ms": 0.0, "thumbnail_ms": 0.0}
+crop_totals_lock = threading.Lock()
+
+
+def _crop_pixel_box(bounding_box: dict, img_width: int, img_height: int) -> tuple:
+    """Convert a normalized (0.0 to 1.0) bounding box to pixel coordinates clamped to the image."""
+    x = bounding_box.get("x", 0.1)
+    y = bounding_box.get("y", 0.1)
+    width = bounding_box.get("width", 0.8)
+    height = bounding_box.get("height", 0.8)
+
+    left = max(0, min(int(x * img_width), img_width))
+    top = max(0, min(int(y * img_height), img_height))
+    right = max(left, min(int((x + width) * img_width), img_width))
+    bottom = max(top, min(int((y + height) * img_height), img_height))
+    return left, top, right, bottom
+
+
+def _save_crop(img, pixel_box: tuple) -> tuple[str, float, float, str]:
+    """
+    Encode and store one crop (content-addressed) plus its renditions.
+    Returns (stored path, encode_ms, thumbnail_ms, rendition key).
+    """
+    started = time.perf_counter()
+    cropped_img = img.crop(pixel_box)
+    buffer = io.BytesIO()
+    cropped_img.save(buffer, "JPEG", quality=CROP_JPEG_QUALITY)
+    data = buffer.getvalue()
+    key = f"cropped/{hashlib.sha256(data).hexdigest()}.jpg"
+    blob_store.put_bytes(key, data)
+    encoded = time.perf_counter()
+    thumbnail_key = write_renditions(cropped_img, rendition_key(data))
+    return blob_path(key), (encoded - started) * 1000, (time.perf_counter() - encoded) * 1000, thumbnail_key
+
+
+def crop_card_images(original_image_path: str, boxes: dict) -> tuple[dict, dict]:
     """
-    Crop a card from the original scan image based on bounding box coordinates.
-    Bounding box is in normalized coordinates (0.0 to 1.0).
-    Returns the path to the cropped image, or None if cropping fails.
+    Crop several cards from the original scan image, decoding it only once.
+    boxes maps card_id -> normalized bounding box.
+    Returns ({card_id: {"path", "thumbnail_key"}}, timings); cards that fail to crop are left out.
     """
+    if not boxes:
+        return {}, {}
+
+    from PIL import Image
+    started = time.perf_counter()
     try:
-        from PIL import Image
-        # Open the original image
-        img = Image.open(original_image_path)
-        img_width, img_height = img.size
-        
-        # Extract bounding box coordinates (normalized 0.0-1.0)
-        x = bounding_box.get("x", 0.1)
-        y = bounding_box.get("y", 0.1)
-        width = bounding_box.get("width", 0.8)
-        height = bounding_box.get("height", 0.8)
-        
-        # Convert to pixel coordinates
-        left = int(x * img_width)
-        top = int(y * img_height)
-        right = int((x + width) * img_width)
-        bottom = int((y + height) * img_height)
-        
-        # Ensure coordinates are within image bounds
-        left = max(0, min(left, img_width))
-        top = max(0, min(top, img_height))
-        right = max(left, min(right, img_width))
-        bottom = max(top, min(bottom, img_height))
-        
-        # Crop the image
-        cropped_img = img.crop((left, top, right, bottom))
-        if cropped_img.mode in ("RGBA", "LA", "P"):
-            cropped_img = cropped_img.convert("RGB")
-        
-        # Create cropped images directory
-        cropped_dir = Path("uploads/cropped")
-        cropped_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Save cropped image
-        cropped_path = cropped_dir / f"{card_id}.jpg"
-        cropped_img.save(cropped_path, "JPEG", quality=95)
-        
-        return str(cropped_path)
+        img = Image.open(io.BytesIO(blob_store.get_bytes(blob_key(original_image_path))))
+        img.load()
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGB")
     except Exception as e:
-        print(f"Error cropping image: {e}")
-        return None
+        print(f"Error decoding image for cropping: {e}")
+        return {}, {}
+    decode_ms = (time.perf_counter() - started) * 1000
+
+    futures = {}
+    for card_id, bounding_box in boxes.items():
+        pixel_box = _crop_pixel_box(bounding_box, img.width, img.height)
+        futures[card_id] = crop_executor.submit(_save_crop, img, pixel_box)
+
+    cropped = {}
+    encode_ms = thumbnail_ms = 0.0
+    for card_id, future in futures.items():
+        try:
+            cropped_path, crop_ms, rendition_ms, key = future.result()
+            encode_ms += crop_ms
+            thumbnail_ms += rendition_ms
+            cropped[card_id] = {"path": cropped_path, "thumbnail_key": key}
+        except Exception as e:
+            print(f"Error cropping card {card_id}: {e}")
+
+    timings = {
+        "crops": len(cropped),
+        "decode_ms": round(decode_ms, 1),
+        "encode_ms": round(encode_ms, 1),  # Summed across workers
+        "thumbnail_ms": round(thumbnail_ms, 1),
+        "total_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+    with crop_totals_lock:
+        crop_totals["scans"] += 1
+        crop_totals["crops"] += len(cropped)
+        crop_totals["decode_ms"] += decode_ms
+        crop_totals["encode_ms"] += encode_ms
+        crop_totals["thumbnail_ms"] += thumbnail_ms
+    print(f"Cropped {len(cropped)}/{len(boxes)} card(s): {timings}")
+    return cropped, timings
+
+
+def crop_stats() -> dict:
+    with crop_totals_lock:
+        scans = crop_totals["scans"]
+        return {
+            "scans": scans,
+            "crops": crop_totals["crops"],
+            "avg_decode_ms": round(crop_totals["decode_ms"] / scans, 1) if scans else 0.0,
+            "avg_encode_ms_per_crop": round(crop_totals["encode_ms"] / crop_totals["crops"], 1) if crop_totals["crops"] else 0.0,
+            "avg_thumbnail_ms_per_crop": round(crop_totals["thumbnail_ms"] / crop_totals["crops"], 1) if crop_totals["crops"] else 0.0
+        }
 
 
 def attach_cropped_images_to_detected_cards(
     detected_cards: list,
     scan_image_path: Optional[str]
-) -> list:
+) -> tuple[list, dict]:
+    """Crop every detected card that has a box but no crop yet. Returns (detected_cards, crop timings)."""
     if not scan_image_path:
-        return detected_cards
+        return detected_cards, {}
 
+    boxes = {}
     for card in detected_cards:
         if card.get("crop_image_url"):
             continue
         bounding_box = card.get("bounding_box")
         if not bounding_box:
             continue
-        card_id = card.get("id") or str(uuid.uuid4())
         if not card.get("id"):
-            card["id"] = card_id
-        cropped_path = crop_card_image(scan_image_path, bounding_box, card_id)
-        if cropped_path:
-            card["crop_image_url"] = cropped_path
+            card["id"] = str(uuid.uuid4())
+        boxes[card["id"]] = bounding_box
+
+    cropped, timings = crop_card_images(scan_image_path, boxes)
+    for card in detected_cards:
+        if card.get("id") in cropped:
+            card["crop_image_url"] = cropped[card["id"]]["path"]
+            card["thumbnail_key"] = cropped[card["id"]]["thumbnail_key"]
+            card["thumbnails"] = rendition_urls(card["thumbnail_key"])
+
+    return detected_cards, timings
+
+_ASCII_PUNCTUATION_TO_SPACE = {i: " " for i in range(128) if not chr(i).isalnum()}
+
+
+def normalize_card_key(card_name: Optional[str]) -> str:
+    """Holdings key for a card name: case, accents, punctuation and spacing don't split copies."""
+    card_name = card_name or ""
+    if card_name.isascii():
+        # Fast path (most names, and every row of a bulk price feed goes through here)
+        return " ".join(card_name.lower().translate(_ASCII_PUNCTUATION_TO_SPACE).split())
+    decomposed = unicodedata.normalize("NFKD", card_name)
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in folded).split())
+
+
+def normalize_set_code(set_code: Optional[str]) -> str:
+    return (set_code or "").strip().upper()
+
+
+CARD_CONDITIONS = ["Damaged", "Heavily Played", "Moderately Played", "Lightly Played", "Near Mint"]  # Worst to best
+CONDITION_RANKS = {condition: rank for rank, condition in enumerate(CARD_CONDITIONS)}
+_CONDITION_ALIASES = {
+    **{condition.lower(): condition for condition in CARD_CONDITIONS},
+    "dmg": "Damaged", "hp": "Heavily Played", "mp": "Moderately Played", "lp": "Lightly Played", "nm": "Near Mint",
+}
+
+
+def normalize_condition(condition: Optional[str]) -> Optional[str]:
+    """Canonical condition name for a name or abbreviation ("nm", "Lightly played"), or None if unknown."""
+    return _CONDITION_ALIASES.get(" ".join((condition or "").lower().split()))
+
+
+def card_condition(card_data: dict) -> tuple[str, Optional[float], dict]:
+    """Map the model's condition metrics to (condition, condition_grade, condition_details)."""
+    condition = "Near Mint"  # Default
+    condition_grade = None
+    condition_details = {}
+
+    if "condition" in card_data and isinstance(card_data["condition"], dict):
+        # Try to determine condition from condition metrics
+        estimated_grade = card_data["condition"].get("estimated_grade", 0.0)
+        condition_details = {
+            "centering": card_data["condition"].get("centering", 0.0),
+            "corners": card_data["condition"].get("corners", 0.0),
+            "surface": card_data["condition"].get("surface", 0.0),
+            "estimated_grade": estimated_grade
+        }
+        if estimated_grade >= 9.0:
+            condition = "Near Mint"
+        elif estimated_grade >= 7.0:
+            condition = "Lightly Played"
+        elif estimated_grade >= 5.0:
+            condition = "Moderately Played"
+        elif estimated_grade >= 3.0:
+            condition = "Heavily Played"
+        else:
+            condition = "Damaged"
+        condition_grade = float(estimated_grade) if estimated_grade else None
+    return condition, condition_grade, condition_details
+
+
+def count_user_cards(db: Session, user_id: str) -> int:
+    """Cards owned by the user (sum of holding quantities), as counted against the tier limit."""
+    summary = db.get(UserSummary, user_id)
+    return summary.card_count if summary else 0
 
-    return detected_cards
 
 def save_detected_cards_to_inventory(
     detected_cards: list,
@@ -157,256 +703,2986 @@ def save_detected_cards_to_inventory(
 ) -> tuple[int, list]:
     """
     Helper function to save detected cards to inventory.
+    Copies of the same card (name, set, condition) are added to one holding row with a single
+    upsert per scan; each copy's scan provenance goes to inventory_copies.
     Returns (saved_count, inventory_entries)
     """
     # Check subscription limits
     tier_info = SUBSCRIPTION_TIERS.get(current_user.subscription_tier, SUBSCRIPTION_TIERS["free"])
-    current_card_count = db.query(InventoryEntry).filter(InventoryEntry.user_id == current_user.id).count()
-    
-    saved_count = 0
-    inventory_entries = []
-    
-    for card_data in detected_cards:
-        # Check limit before each save
-        if current_card_count + saved_count >= tier_info["max_cards"]:
-            print(f"Card limit reached. Stopping at {saved_count} cards saved.")
-            break
-        
-        # Extract card name and set code
+    current_card_count = count_user_cards(db, current_user.id)
+    remaining = max(tier_info["max_cards"] - current_card_count, 0)
+    if len(detected_cards) > remaining:
+        print(f"Card limit reached. Stopping at {remaining} cards saved.")
+        detected_cards = detected_cards[:remaining]
+    if not detected_cards:
+        return 0, []
+
+    # Reuse the scan-time crops; cards without one are cropped together
+    missing_crops = {
+        index: card_data["bounding_box"]
+        for index, card_data in enumerate(detected_cards)
+        if not card_data.get("crop_image_url") and scan.image_url and card_data.get("bounding_box")
+    }
+    cropped, _ = crop_card_images(scan.image_url, missing_crops) if missing_crops else ({}, {})
+
+    now = datetime.utcnow()
+    holdings = {}  # (card_key, set_code, condition) -> holding row values
+    copies = []  # (holding key, copy row values)
+    for index, card_data in enumerate(detected_cards):
         card_name = card_data.get("name", "")
-        set_code = card_data.get("set_code", "")
-        
-        # Extract condition information if available
-        condition = "Near Mint"  # Default
-        condition_grade = None
-        condition_details = {}
-        
-        if "condition" in card_data and isinstance(card_data["condition"], dict):
-            # Try to determine condition from condition metrics
-            estimated_grade = card_data["condition"].get("estimated_grade", 0.0)
-            condition_details = {
-                "centering": card_data["condition"].get("centering", 0.0),
-                "corners": card_data["condition"].get("corners", 0.0),
-                "surface": card_data["condition"].get("surface", 0.0),
-                "estimated_grade": estimated_grade
-            }
-            if estimated_grade >= 9.0:
-                condition = "Near Mint"
-            elif estimated_grade >= 7.0:
-                condition = "Lightly Played"
-            elif estimated_grade >= 5.0:
-                condition = "Moderately Played"
-            elif estimated_grade >= 3.0:
-                condition = "Heavily Played"
-            else:
-                condition = "Damaged"
-            condition_grade = float(estimated_grade) if estimated_grade else None
-        
-        # Create entry first to get ID for image filename
-        entry = InventoryEntry(
-            user_id=current_user.id,
-            card_name=card_name,
-            set_code=set_code,
-            quantity=1,
-            condition=condition,
-            condition_grade=condition_grade,
-            current_value=0.0,  # Default, will be updated later
-            scan_image_url=scan.image_url,
-            card_image_url=None,  # Will be set after cropping
-            metadata_json=None  # Will be set after creating entry
-        )
-        db.add(entry)
-        db.flush()  # Flush to get the entry ID
-        
-        # Crop card image from original scan using entry ID
-        card_image_url = None
-        bounding_box = card_data.get("bounding_box", {})
-        if scan.image_url and bounding_box:
-            cropped_path = crop_card_image(scan.image_url, bounding_box, entry.id)
-            if cropped_path:
-                card_image_url = cropped_path
-                entry.card_image_url = card_image_url
-        
+        set_code = normalize_set_code(card_data.get("set_code"))
+        card_key = normalize_card_key(card_name)
+        catalog_id = catalog_name = None
+        # Link the model's free text to the catalog, but keep the name it read: a wrong match then
+        # only costs a catalog_id, not the card's identity
+        match = catalog_resolver.resolve(card_name, set_code, card_data.get("card_number"))
+        if match:
+            catalog_id, catalog_name = match["catalog_id"], match["name"]
+            set_code = set_code or match["set_code"]
+        condition, condition_grade, condition_details = card_condition(card_data)
+        card_image_url = card_data.get("crop_image_url")
+        thumbnail_key = card_data.get("thumbnail_key")
+        if index in cropped:
+            card_image_url = cropped[index]["path"]
+            thumbnail_key = cropped[index]["thumbnail_key"]
+
         # Store additional metadata
-        metadata_json = {
+        metadata_json = json.dumps({
             "card_number": card_data.get("card_number"),
             "year": card_data.get("year"),
             "domain": card_data.get("domain", "other"),
             "confidence": card_data.get("confidence", 0.8),
-            "condition_details": condition_details
+            "condition_details": condition_details,
+            "catalog_name": catalog_name,
+            "catalog_score": match["score"] if match else None
+        })
+
+        key = (card_key, set_code, condition)
+        if key in holdings:
+            holdings[key]["quantity"] += 1
+        else:
+            # The first copy in the scan supplies the holding's name, images and metadata
+            holdings[key] = {
+                "id": str(uuid.uuid4()),
+                "user_id": current_user.id,
+                "card_key": key[0],
+                "catalog_id": catalog_id,
+                "card_name": card_name,
+                "set_code": set_code,
+                "condition": condition,
+                "quantity": 1,
+                "condition_grade": condition_grade,
+                "current_value": lookup_price(db, key[0], set_code, condition) or 0.0,
+                "scan_image_url": scan.image_url,
+                "card_image_url": card_image_url,
+                "thumbnail_key": thumbnail_key,
+                "metadata_json": metadata_json,
+                "scanned_at": now,
+                "created_at": now
+            }
+        copies.append((key, {
+            "id": str(uuid.uuid4()),
+            "scan_id": scan.id,
+            "detected_card_id": card_data.get("id"),
+            "condition_grade": condition_grade,
+            "card_image_url": card_image_url,
+            "thumbnail_key": thumbnail_key,
+            "metadata_json": metadata_json,
+            "scanned_at": now
+        }))
+
+    # One statement for the whole scan: new holdings are inserted, existing ones gain quantity
+    entries = InventoryEntry.__table__
+    stmt = dialect_insert(entries).values(list(holdings.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "card_key", "set_code", "condition"],
+        set_={
+            "quantity": entries.c.quantity + stmt.excluded.quantity,
+            "scanned_at": stmt.excluded.scanned_at,
+            "catalog_id": func.coalesce(entries.c.catalog_id, stmt.excluded.catalog_id)
         }
-        entry.metadata_json = json.dumps(metadata_json)
-        
-        inventory_entries.append(entry)
-        saved_count += 1
-    
+    ).returning(
+        entries.c.id, entries.c.card_key, entries.c.set_code, entries.c.condition,
+        entries.c.quantity, entries.c.current_value
+    )
+    saved = {(row.card_key, row.set_code, row.condition): row for row in db.execute(stmt)}
+
+    copy_rows = []
+    for key, copy_row in copies:
+        copy_row["entry_id"] = saved[key].id
+        copy_rows.append(copy_row)
+    db.execute(InventoryCopy.__table__.insert(), copy_rows)
+
+    # A holding that came back with exactly this scan's quantity was just inserted, so its images are new references
+    blob_keys = [key for _, copy_row in copies for key in copy_blob_keys(copy_row)]
+    for key, values in holdings.items():
+        if saved[key].quantity == values["quantity"]:
+            blob_keys += [blob_key(values["scan_image_url"]), blob_key(values["card_image_url"]),
+                          rendition_blob_key(values["thumbnail_key"])]
+    change_blob_refs(db, blob_keys, 1)
+    change_user_summary(
+        db, current_user.id,
+        cards=len(copies),
+        value=sum((saved[key].current_value or 0) * values["quantity"] for key, values in holdings.items())
+    )
+    if current_user.marketplace_enabled:
+        # New holdings, and existing ones that just gained a catalog_id, can match other users' wants
+        sync_marketplace_matches(db, entry_ids=[row.id for row in saved.values()])
     db.commit()
-    return saved_count, inventory_entries
+    invalidate_inventory_count(current_user.id)
 
+    inventory_entries = db.query(InventoryEntry).filter(
+        InventoryEntry.id.in_([row.id for row in saved.values()])
+    ).all()
+    return len(copies), inventory_entries
 
-def parse_multi_cards_from_raw_response(raw_response: str) -> list:
-    if not raw_response:
-        return []
 
-    try:
-        json_match = re.search(r'(\{.*\}|\[.*\])', raw_response, re.DOTALL)
-        if not json_match:
-            return []
+def compact_inventory_holdings(db: Session, batch_size: int = 500) -> dict:
+    """
+    One-time migration of rows saved before holdings existed (card_key IS NULL): each becomes a
+    copy of the holding for its (user, card, set, condition), duplicates are folded into it.
+    Safe to re-run; already-keyed rows are left alone.
+    """
+    stats = {"rows": 0, "merged": 0, "copies": 0}
+    holding_ids = {}  # (user_id, card_key, set_code, condition) -> holding id
+    while True:
+        legacy = db.query(InventoryEntry).filter(InventoryEntry.card_key.is_(None)).order_by(
+            InventoryEntry.created_at, InventoryEntry.id
+        ).limit(batch_size).all()
+        if not legacy:
+            break
+        keyed_ids = []
+        for entry in legacy:
+            stats["rows"] += 1
+            set_code = normalize_set_code(entry.set_code)
+            card_key = normalize_card_key(entry.card_name)
+            group = (entry.user_id, card_key, set_code, entry.condition)
+            if group not in holding_ids:
+                existing = db.query(InventoryEntry.id).filter(
+                    InventoryEntry.user_id == entry.user_id,
+                    InventoryEntry.card_key == card_key,
+                    InventoryEntry.set_code == set_code,
+                    InventoryEntry.condition == entry.condition
+                ).first()
+                holding_ids[group] = existing.id if existing else None
 
-        parsed_data = json.loads(json_match.group(1))
-        if isinstance(parsed_data, list):
-            container = parsed_data[0] if parsed_data else {}
-        elif isinstance(parsed_data, dict):
-            container = parsed_data
-        else:
-            return []
+            quantity = max(entry.quantity or 1, 1)
+            copy_rows = [{
+                "id": str(uuid.uuid4()),
+                "entry_id": holding_ids[group] or entry.id,
+                "scan_id": None,
+                "detected_card_id": None,
+                "condition_grade": entry.condition_grade,
+                "card_image_url": entry.card_image_url,
+                "thumbnail_key": entry.thumbnail_key,
+                "metadata_json": entry.metadata_json,
+                "scanned_at": entry.scanned_at
+            } for _ in range(quantity)]
+            db.execute(InventoryCopy.__table__.insert(), copy_rows)
+            change_blob_refs(db, [key for copy_row in copy_rows for key in copy_blob_keys(copy_row)], 1)
+            stats["copies"] += len(copy_rows)
 
-        cards_array = container.get("cards", [])
-        detected_cards = []
-        for index, card_obj in enumerate(cards_array):
-            card_identity = card_obj.get("cardIdentity", {})
-            bounding_box_data = card_obj.get("boundingBox", {})
-
-            name = (card_identity.get("name") or {}).get("value") or "Unknown Card"
-            set_code = (card_identity.get("set") or {}).get("value") or ""
-            card_number = (card_identity.get("cardNumber") or {}).get("value")
-            year = (card_identity.get("year") or {}).get("value")
-            domain = (card_identity.get("domain") or {}).get("value") or "other"
-
-            bbox_value = bounding_box_data.get("value") or [0.1 + (index * 0.3), 0.2, 0.25, 0.4]
-            if isinstance(bbox_value, list) and len(bbox_value) >= 4:
-                bbox = {
-                    "x": bbox_value[0],
-                    "y": bbox_value[1],
-                    "width": bbox_value[2],
-                    "height": bbox_value[3]
-                }
+            if holding_ids[group]:
+                holding = db.query(InventoryEntry.current_value).filter(InventoryEntry.id == holding_ids[group]).first()
+                holding_value = (holding.current_value if holding else entry.current_value) or 0
+                db.query(InventoryEntry).filter(InventoryEntry.id == holding_ids[group]).update(
+                    {InventoryEntry.quantity: InventoryEntry.quantity + quantity},
+                    synchronize_session=False
+                )
+                # The copies are now valued at the holding's price
+                change_user_summary(
+                    db, entry.user_id,
+                    cards=quantity - (entry.quantity or 0),
+                    value=holding_value * quantity - (entry.current_value or 0) * (entry.quantity or 0)
+                )
+                change_blob_refs(db, inventory_blob_keys(entry), -1)
+                remove_marketplace_matches(db, entry_ids=[entry.id])
+                db.delete(entry)
+                stats["merged"] += 1
             else:
-                bbox = {"x": 0.1 + (index * 0.3), "y": 0.2, "width": 0.25, "height": 0.4}
+                change_user_summary(
+                    db, entry.user_id,
+                    cards=quantity - (entry.quantity or 0),
+                    value=(entry.current_value or 0) * (quantity - (entry.quantity or 0))
+                )
+                entry.card_key = card_key
+                entry.set_code = set_code
+                entry.quantity = quantity
+                holding_ids[group] = entry.id
+                keyed_ids.append(entry.id)
+            invalidate_inventory_count(entry.user_id)
+        db.flush()
+        # Keyed holdings now match wants by card_key; these matches aren't news, so no notifications
+        sync_marketplace_matches(db, entry_ids=keyed_ids, notify=False)
+        db.commit()
+    return stats
 
-            detected_cards.append({
-                "id": str(uuid.uuid4()),
-                "name": name,
-                "set_code": set_code,
-                "card_number": card_number,
-                "year": year,
-                "domain": domain,
-                "confidence": 0.8,
-                "bounding_box": bbox
-            })
-
-        return detected_cards
-    except Exception as error:
-        print(f"Error parsing raw_response for multi cards: {error}")
-        return []
 
+# In-process caches
+class LRUTTLCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL and hit/miss counters.
+    Used for values that are expensive to recompute but safe to serve slightly stale.
+    """
 
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-# Subscription tier limits
-SUBSCRIPTION_TIERS = {
-    "free": {
-        "name": "Free",
-        "max_cards": 100,
-        "max_trend_insights": 3,
-        "price": 0,
-        "price_period": "month"
-    },
-    "pro": {
-        "name": "Pro",
-        "max_cards": 1000,
-        "max_trend_insights": 20,
-        "price": 9.99,
-        "price_period": "month"
-    },
-    "premium": {
-        "name": "Premium",
-        "max_cards": 10000,
-        "max_trend_insights": 100,
-        "price": 19.99,
-        "price_period": "month"
-    }
-}
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                self.evictions += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+scan_result_cache = LRUTTLCache(SCAN_CACHE_MAX_ENTRIES, SCAN_CACHE_TTL_SECONDS)
+inventory_count_cache = LRUTTLCache(INVENTORY_COUNT_CACHE_ENTRIES, INVENTORY_COUNT_TTL_SECONDS)
+
+
+ml_model_version = ML_MODEL_VERSION
+
+
+def scan_cache_key(image_sha256: str, scan_type: str) -> tuple:
+    return (image_sha256, scan_type, ml_model_version)
+
+
+def note_ml_model_version(version: Optional[str]):
+    """Track the model version the ML service reports; results cached under another version are dropped."""
+    global ml_model_version
+    if not version or version == ml_model_version:
+        return
+    print(f"ML model version changed: {ml_model_version} -> {version}; clearing the scan cache")
+    ml_model_version = version
+    scan_result_cache.clear()
+
+
+# Magic-byte signatures of the image formats the ML service can decode
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"GIF87a", "image/gif", ".gif"),
+    (b"GIF89a", "image/gif", ".gif"),
+)
+
+
+def sniff_image_type(head: bytes) -> Optional[tuple]:
+    """Return (mime_type, extension) for a supported image header, or None."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    for signature, mime_type, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type, extension
+    return None
+
+
+async def ingest_upload(image: UploadFile) -> tuple[str, str, int, str]:
+    """
+    Stream an upload to disk in UPLOAD_CHUNK_BYTES chunks, validating the type from its magic bytes,
+    enforcing UPLOAD_MAX_BYTES and hashing in the same pass. The image is stored as blob <sha256><ext>;
+    if an identical image is already stored the new copy is discarded.
+    Returns (stored path, sha256_hex, size_bytes, mime_type).
+    """
+    if image.content_type and not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=415, detail=f"Unsupported content type: {image.content_type}")
+
+    upload_dir = Path("uploads")
+    upload_dir.mkdir(exist_ok=True)
+    tmp_path = upload_dir / f".upload.{uuid.uuid4().hex}.tmp"
+    hasher = hashlib.sha256()
+    size = 0
+    image_type = None
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = await image.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if image_type is None:
+                    image_type = sniff_image_type(chunk[:16])
+                    if image_type is None:
+                        raise HTTPException(status_code=415, detail="Unsupported image format")
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Image exceeds the {UPLOAD_MAX_BYTES // (1024 * 1024)} MB upload limit"
+                    )
+                hasher.update(chunk)
+                f.write(chunk)
+        if image_type is None:
+            raise HTTPException(status_code=400, detail="Empty upload")
+
+        digest = hasher.hexdigest()
+        mime_type, extension = image_type
+        key = f"{digest}{extension}"
+        await asyncio.to_thread(blob_store.put_file, key, tmp_path)
+        return blob_path(key), digest, size, mime_type
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def results_from_cache(cached: dict) -> dict:
+    """Copy cached ML results with fresh card IDs so crops don't collide with the original scan."""
+    results = copy.deepcopy(cached)
+    for card in results.get("detected_cards", []):
+        card["id"] = str(uuid.uuid4())
+        for key in ("crop_image_url", "thumbnail_key", "thumbnails"):
+            card.pop(key, None)
+    results["cache_hit"] = True
+    return results
+
+
+# ML service client
+# One pooled keep-alive client for the application lifetime; predict calls are idempotent,
+# so transient failures are retried and slow calls can optionally be hedged.
+class MLServiceError(Exception):
+    """Raised when a predict call fails. `retryable` marks transient failures."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitBreaker:
+    """
+    Closed: calls flow. After `failure_threshold` consecutive failures it opens and rejects calls
+    for `reset_seconds`, then lets a single probe through (half-open) to decide whether to close.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow_request(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+            self.probe_in_flight = False
+        if self.state == "half_open":
+            if self.probe_in_flight:
+                self.rejected += 1
+                return False
+            self.probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                print(f"ML circuit breaker opened after {self.consecutive_failures} failure(s)")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected
+        }
+
+
+class LatencyTracker:
+    """Rolling window of call latencies plus outcome counters."""
+
+    def __init__(self, window: int = 500):
+        self.samples = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedged = 0
+
+    def record(self, seconds: float, ok: bool):
+        self.samples.append(seconds)
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1)
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99)
+        }
+
+
+ml_http_client: Optional[httpx.AsyncClient] = None
+ml_circuit_breaker = CircuitBreaker(ML_BREAKER_FAILURE_THRESHOLD, ML_BREAKER_RESET_SECONDS)
+ml_call_latency = LatencyTracker()
+
+
+def get_ml_client() -> httpx.AsyncClient:
+    global ml_http_client
+    if ml_http_client is None:
+        ml_http_client = httpx.AsyncClient(
+            base_url=ML_SERVICE_URL,
+            timeout=ML_REQUEST_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=ML_MAX_CONNECTIONS,
+                max_keepalive_connections=ML_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+    return ml_http_client
+
+
+@app.on_event("startup")
+async def fetch_ml_model_version():
+    try:
+        response = await get_ml_client().get("/health", timeout=5)
+        if response.status_code == 200:
+            note_ml_model_version(response.json().get("model_version"))
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Could not read the ML model version at startup: {e}")
+
+
+@app.on_event("shutdown")
+async def close_ml_client():
+    global ml_http_client
+    if ml_http_client is not None:
+        await ml_http_client.aclose()
+        ml_http_client = None
+
+
+async def _post_predict(content: bytes, filename: str, content_type: Optional[str], form: dict) -> httpx.Response:
+    started = time.monotonic()
+    try:
+        response = await get_ml_client().post(
+            "/predict",
+            files={"image": (filename, content, content_type)},
+            data=form
+        )
+    except httpx.HTTPError:
+        ml_call_latency.record(time.monotonic() - started, ok=False)
+        raise
+    ml_call_latency.record(time.monotonic() - started, ok=response.status_code == 200)
+    return response
+
+
+async def _post_predict_hedged(content: bytes, filename: str, content_type: Optional[str], form: dict) -> httpx.Response:
+    """Send the request; if it is still running after ML_HEDGE_DELAY_SECONDS, race a second copy."""
+    primary = asyncio.create_task(_post_predict(content, filename, content_type, form))
+    if ML_HEDGE_DELAY_SECONDS <= 0:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=ML_HEDGE_DELAY_SECONDS)
+    if done:
+        return primary.result()
+
+    ml_call_latency.hedged += 1
+    hedge = asyncio.create_task(_post_predict(content, filename, content_type, form))
+    pending = {primary, hedge}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response] = None, retry_after: Optional[float] = None) -> float:
+    """
+    Full-jitter exponential backoff, honouring a Retry-After header or a failed prediction's
+    retry_after_seconds when the service sends one.
+    """
+    if retry_after is None and response is not None:
+        header = response.headers.get("Retry-After")
+        if header and header.isdigit():
+            retry_after = float(header)
+    if retry_after is not None and retry_after >= 0:
+        return min(retry_after, ML_REQUEST_TIMEOUT_SECONDS)
+    return random.uniform(0, ML_RETRY_BASE_SECONDS * (2 ** attempt))
+
+
+async def call_ml_service(image_path: str, filename: str, content_type: Optional[str], scan_type: str,
+                          bypass_cache: bool = False) -> dict:
+    """
+    Send a stored scan image to the ML service and return the parsed JSON payload.
+    The file is read once and the same bytes are reused for retries and hedged requests.
+    bypass_cache also skips the ML service's perceptual-hash index, so the model is always called.
+    Raises MLServiceError on connection problems, timeouts, non-200 responses and failed
+    predictions (the service answers 200 with success: false when the model call fails).
+    """
+    content = await asyncio.to_thread(blob_store.get_bytes, blob_key(image_path))
+    form = {"scan_type": scan_type}
+    if bypass_cache:
+        form["bypass_cache"] = "true"
+
+    last_error = None
+    for attempt in range(ML_RETRY_ATTEMPTS):
+        if not ml_circuit_breaker.allow_request():
+            raise MLServiceError("ML service unavailable (circuit open)", retryable=False)
+        if attempt:
+            ml_call_latency.retries += 1
+
+        print(f"Calling ML service at: {ML_SERVICE_URL}/predict (attempt {attempt + 1})")
+        response = None
+        retry_after = None
+        try:
+            response = await _post_predict_hedged(content, filename, content_type, form)
+        except httpx.ConnectError as e:
+            print(f"!!! CONNECTION ERROR to ML service !!!")
+            print(f"ML_SERVICE_URL is set to: {ML_SERVICE_URL}")
+            last_error = MLServiceError(f"Connection error: {str(e)}")
+        except httpx.TimeoutException as e:
+            print(f"!!! TIMEOUT ERROR from ML service !!!")
+            last_error = MLServiceError(f"Timeout error: {str(e)}")
+
+        if response is not None:
+            print(f"ML service response status: {response.status_code}")
+            if response.status_code == 200:
+                results = response.json()
+                if results.get("success", True):
+                    ml_circuit_breaker.record_success()
+                    return results
+                last_error = MLServiceError(f"ML prediction failed: {results.get('error', 'unknown error')}")
+                retry_after = results.get("retry_after_seconds")
+                ml_call_latency.errors += 1
+            else:
+                # 429 and 5xx are worth retrying; other client errors will fail again
+                retryable = response.status_code == 429 or response.status_code >= 500
+                last_error = MLServiceError(
+                    f"ML service error: {response.status_code} - {response.text}",
+                    retryable=retryable
+                )
+                if not retryable:
+                    ml_circuit_breaker.record_success()
+                    raise last_error
+
+        ml_circuit_breaker.record_failure()
+        if attempt + 1 < ML_RETRY_ATTEMPTS:
+            await asyncio.sleep(_retry_delay(attempt, response, retry_after))
+
+    raise last_error
+
+
+def apply_ml_results_to_scan(scan: Scan, results: dict, current_user: User, db: Session) -> list:
+    """
+    Crop detected cards, store the results on the scan and auto-save the cards to inventory.
+    Returns the detected cards.
+    """
+    detected_cards = results.get("detected_cards", [])
+
+    detected_cards, crop_timings = attach_cropped_images_to_detected_cards(
+        detected_cards,
+        scan.image_url
+    )
+    results["detected_cards"] = detected_cards
+    results["total_cards"] = len(detected_cards)
+    if crop_timings:
+        results["cropping"] = crop_timings
+
+    print(f"Detected cards count: {len(detected_cards)}")
+
+    # Store results as JSON; the scan holds a reference to its crops for as long as it exists
+    scan.results = json.dumps(results)
+    scan.status = "completed"
+    change_blob_refs(db, scan_result_blob_keys(results), 1)
+
+    # Automatically save all detected cards to inventory
+    if detected_cards:
+        print(f"=== Auto-saving {len(detected_cards)} detected cards to inventory ===")
+        try:
+            saved_count, inventory_entries = save_detected_cards_to_inventory(
+                detected_cards, scan, current_user, db
+            )
+            print(f"Successfully saved {saved_count} card(s) to inventory")
+        except Exception as e:
+            print(f"Error auto-saving cards to inventory: {e}")
+            import traceback
+            print(traceback.format_exc())
+            # Don't fail the scan if auto-save fails
+            db.rollback()
+            scan = db.query(Scan).filter(Scan.id == scan.id).first()
+            scan.results = json.dumps(results)
+            scan.status = "completed"
+            change_blob_refs(db, scan_result_blob_keys(results), 1)
+
+    return detected_cards
+
+
+# Scan job queue
+# Uploads only enqueue a ScanJob; a bounded pool of asyncio workers claims jobs with a
+# compare-and-set UPDATE, so several API processes can share the same queue table.
+scan_job_wakeup: Optional[asyncio.Event] = None
+scan_worker_tasks: list = []
+
+
+def enqueue_scan_job(
+    scan: Scan,
+    filename: Optional[str],
+    content_type: Optional[str],
+    db: Session,
+    image_sha256: Optional[str] = None,
+    bypass_cache: bool = False
+) -> ScanJob:
+    """Add a queued job for the scan to the session. The caller commits."""
+    job = ScanJob(
+        scan_id=scan.id,
+        image_filename=filename,
+        image_content_type=content_type,
+        image_sha256=image_sha256,
+        bypass_cache=bypass_cache,
+        status="queued",
+        next_run_at=datetime.utcnow()
+    )
+    db.add(job)
+    return job
+
+
+def notify_scan_workers():
+    if scan_job_wakeup is not None:
+        scan_job_wakeup.set()
+
+
+def claim_next_scan_job() -> Optional[dict]:
+    """
+    Atomically move the oldest due job from queued to processing.
+    Returns a snapshot of the job, or None if nothing is due.
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        candidates = db.query(ScanJob.id).filter(
+            ScanJob.status == "queued",
+            ScanJob.next_run_at <= now
+        ).order_by(ScanJob.next_run_at.asc()).limit(5).all()
+
+        for (job_id,) in candidates:
+            claimed = db.query(ScanJob).filter(
+                ScanJob.id == job_id,
+                ScanJob.status == "queued"
+            ).update({
+                ScanJob.status: "processing",
+                ScanJob.locked_at: now,
+                ScanJob.attempts: ScanJob.attempts + 1
+            }, synchronize_session=False)
+            if not claimed:
+                # Another worker got there first
+                continue
+
+            job = db.query(ScanJob).filter(ScanJob.id == job_id).first()
+            scan = db.query(Scan).filter(Scan.id == job.scan_id).first()
+            if not scan:
+                job.status = "failed"
+                job.last_error = "Scan not found"
+                db.commit()
+                continue
+            scan.status = "processing"
+            db.commit()
+            return {
+                "job_id": job.id,
+                "scan_id": scan.id,
+                "attempt": job.attempts,
+                "image_path": scan.image_url,
+                "filename": job.image_filename or Path(scan.image_url).name,
+                "content_type": job.image_content_type,
+                "scan_type": scan.scan_type,
+                "image_sha256": job.image_sha256,
+                "bypass_cache": bool(job.bypass_cache),
+                "locked_at": now  # Lease token: finishing the job requires it to be unchanged
+            }
+        return None
+    finally:
+        db.close()
+
+
+def _holds_scan_job_lease(db: Session, job_id: str, locked_at: datetime, values: dict) -> bool:
+    """
+    Compare-and-set on the lease: apply `values` only if the job is still processing under the
+    lease this worker claimed (or last renewed). False means the lease expired and the job was
+    recovered, so another worker owns it now and this run's outcome must be dropped.
+    """
+    return bool(db.query(ScanJob).filter(
+        ScanJob.id == job_id,
+        ScanJob.status == "processing",
+        ScanJob.locked_at == locked_at
+    ).update(values, synchronize_session=False))
+
+
+def renew_scan_job_lease(job_id: str, locked_at: datetime) -> Optional[datetime]:
+    """Push the lease forward; returns the new lease token, or None if the lease was lost."""
+    db = SessionLocal()
+    try:
+        renewed_at = datetime.utcnow()
+        if not _holds_scan_job_lease(db, job_id, locked_at, {ScanJob.locked_at: renewed_at}):
+            return None
+        db.commit()
+        return renewed_at
+    finally:
+        db.close()
+
+
+def complete_scan_job(job_id: str, locked_at: datetime, results: dict) -> bool:
+    """Apply the results if this worker still holds the lease; returns False (results dropped) if not."""
+    db = SessionLocal()
+    try:
+        # Taking the job first means a run that lost its lease never crops or saves cards
+        done = {ScanJob.status: "completed", ScanJob.locked_at: None, ScanJob.last_error: None}
+        if not _holds_scan_job_lease(db, job_id, locked_at, done):
+            db.rollback()
+            return False
+        job = db.query(ScanJob).filter(ScanJob.id == job_id).first()
+        scan = db.query(Scan).filter(Scan.id == job.scan_id).first()
+        user = db.query(User).filter(User.id == scan.user_id).first()
+        apply_ml_results_to_scan(scan, results, user, db)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def fail_scan_job(job_id: str, locked_at: datetime, error: str, retryable: bool):
+    """Reschedule the job with exponential backoff, or mark it and its scan as failed."""
+    db = SessionLocal()
+    try:
+        if not _holds_scan_job_lease(db, job_id, locked_at, {ScanJob.locked_at: None}):
+            db.rollback()
+            print(f"Scan job {job_id} lost its lease; dropping this attempt's error: {error}")
+            return
+        job = db.query(ScanJob).filter(ScanJob.id == job_id).first()
+        scan = db.query(Scan).filter(Scan.id == job.scan_id).first()
+        job.last_error = error
+        if retryable and job.attempts < SCAN_JOB_MAX_ATTEMPTS:
+            delay = SCAN_JOB_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1))
+            delay *= random.uniform(0.5, 1.5)  # Jitter so retries don't arrive in lockstep
+            job.status = "queued"
+            job.next_run_at = datetime.utcnow() + timedelta(seconds=delay)
+            if scan:
+                scan.status = "pending"
+            print(f"Scan job {job_id} attempt {job.attempts} failed, retrying in {delay:.1f}s: {error}")
+        else:
+            job.status = "failed"
+            if scan:
+                scan.status = "failed"
+                scan.results = error
+            print(f"Scan job {job_id} failed after {job.attempts} attempt(s): {error}")
+        db.commit()
+    finally:
+        db.close()
+
+
+def recover_stale_scan_jobs() -> int:
+    """
+    Requeue jobs whose worker died mid-flight (status processing with an expired lease).
+    Returns the number of jobs recovered.
+    """
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=SCAN_JOB_LEASE_SECONDS)
+        stale_jobs = db.query(ScanJob).filter(
+            ScanJob.status == "processing",
+            ScanJob.locked_at < cutoff
+        ).all()
+        for job in stale_jobs:
+            if job.attempts < SCAN_JOB_MAX_ATTEMPTS:
+                job.status = "queued"
+                job.next_run_at = datetime.utcnow()
+                new_scan_status = "pending"
+            else:
+                job.status = "failed"
+                new_scan_status = "failed"
+            job.locked_at = None
+            job.last_error = "Worker lease expired"
+            scan = db.query(Scan).filter(Scan.id == job.scan_id).first()
+            if scan:
+                scan.status = new_scan_status
+                if new_scan_status == "failed":
+                    scan.results = job.last_error
+        db.commit()
+        if stale_jobs:
+            print(f"Recovered {len(stale_jobs)} stale scan job(s)")
+        return len(stale_jobs)
+    finally:
+        db.close()
+
+
+async def keep_scan_job_leased(job: dict, stop: asyncio.Event):
+    """Renew the job's lease every quarter lease until stopped, so a long ML call isn't recovered as stale."""
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=SCAN_JOB_LEASE_SECONDS / 4)
+            return
+        except asyncio.TimeoutError:
+            pass
+        try:
+            renewed_at = await asyncio.to_thread(renew_scan_job_lease, job["job_id"], job["locked_at"])
+        except Exception as e:
+            print(f"Could not renew the lease on scan job {job['job_id']}: {e}")
+            continue
+        if renewed_at is None:
+            print(f"Scan job {job['job_id']} lost its lease")
+            return
+        job["locked_at"] = renewed_at
+
+
+async def process_scan_job(job: dict):
+    cache_key = scan_cache_key(job["image_sha256"], job["scan_type"]) if job["image_sha256"] else None
+    cached = None
+    if cache_key and not job["bypass_cache"]:
+        cached = scan_result_cache.get(cache_key)
+
+    try:
+        if cached is not None:
+            print(f"Scan cache hit for {job['image_sha256'][:12]} ({job['scan_type']})")
+            results = results_from_cache(cached)
+        else:
+            stop_renewing = asyncio.Event()
+            renewer = asyncio.create_task(keep_scan_job_leased(job, stop_renewing))
+            try:
+                results = await call_ml_service(
+                    job["image_path"],
+                    job["filename"],
+                    job["content_type"],
+                    job["scan_type"],
+                    bypass_cache=job["bypass_cache"]
+                )
+            finally:
+                # Let an in-flight renewal finish so job["locked_at"] matches the stored lease
+                stop_renewing.set()
+                await renewer
+            # The ML service parses the model output; its raw text is debug-only and never stored
+            results.pop("raw_response", None)
+            note_ml_model_version(results.get("model_version"))
+            if cache_key:
+                cache_key = scan_cache_key(job["image_sha256"], job["scan_type"])
+            if cache_key and results.get("success", True) and results.get("detected_cards"):
+                scan_result_cache.set(cache_key, copy.deepcopy(results))
+    except MLServiceError as e:
+        await asyncio.to_thread(fail_scan_job, job["job_id"], job["locked_at"], str(e), e.retryable)
+        return
+    except Exception as e:
+        print(f"!!! UNEXPECTED ERROR in scan job {job['job_id']}: {type(e).__name__}: {e}")
+        await asyncio.to_thread(fail_scan_job, job["job_id"], job["locked_at"], str(e), True)
+        return
+
+    try:
+        if await asyncio.to_thread(complete_scan_job, job["job_id"], job["locked_at"], results):
+            print(f"Scan {job['scan_id']} completed (attempt {job['attempt']})")
+        else:
+            print(f"Scan job {job['job_id']} lost its lease; dropping attempt {job['attempt']}'s results")
+    except Exception as e:
+        import traceback
+        print(f"Error finishing scan job {job['job_id']}: {traceback.format_exc()}")
+        await asyncio.to_thread(fail_scan_job, job["job_id"], job["locked_at"], str(e), False)
+
+
+async def scan_worker(worker_id: int):
+    while True:
+        try:
+            job = await asyncio.to_thread(claim_next_scan_job)
+        except Exception as e:
+            print(f"Scan worker {worker_id} could not claim a job: {e}")
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(scan_job_wakeup.wait(), timeout=SCAN_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            scan_job_wakeup.clear()
+            continue
+
+        await process_scan_job(job)
+
+
+async def scan_job_reaper():
+    while True:
+        try:
+            await asyncio.to_thread(recover_stale_scan_jobs)
+        except Exception as e:
+            print(f"Error recovering stale scan jobs: {e}")
+        await asyncio.sleep(max(SCAN_JOB_LEASE_SECONDS / 2, 1))
+
+
+@app.on_event("startup")
+async def start_scan_workers():
+    global scan_job_wakeup
+    scan_job_wakeup = asyncio.Event()
+    if SCAN_WORKER_CONCURRENCY <= 0:
+        return
+    scan_worker_tasks.append(asyncio.create_task(scan_job_reaper()))
+    for worker_id in range(SCAN_WORKER_CONCURRENCY):
+        scan_worker_tasks.append(asyncio.create_task(scan_worker(worker_id)))
+    print(f"Started {SCAN_WORKER_CONCURRENCY} scan worker(s)")
+
+
+@app.on_event("shutdown")
+async def stop_scan_workers():
+    for task in scan_worker_tasks:
+        task.cancel()
+    await asyncio.gather(*scan_worker_tasks, return_exceptions=True)
+    scan_worker_tasks.clear()
+
+
+# Blob reference counting
+blob_gc_tasks: list = []
+
+
+def dialect_insert(table):
+    """INSERT supporting on_conflict_do_update for the configured database."""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def change_blob_refs(db: Session, keys: list, delta: int):
+    """Add delta to the reference count of each blob key, in the caller's transaction."""
+    now = datetime.utcnow()
+    ref_count = Blob.__table__.c.ref_count
+    for key in keys:
+        if not key:
+            continue
+        stmt = dialect_insert(Blob.__table__).values(
+            key=key,
+            ref_count=max(delta, 0),
+            zero_since=None if delta > 0 else now,
+            created_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={
+                "ref_count": ref_count + delta,
+                "zero_since": case((ref_count + delta <= 0, now), else_=None)
+            }
+        )
+        db.execute(stmt)
+
+
+def inventory_blob_keys(entry: "InventoryEntry") -> list:
+    return [
+        blob_key(entry.scan_image_url),
+        blob_key(entry.card_image_url),
+        rendition_blob_key(entry.thumbnail_key)
+    ]
+
+
+def scan_result_blob_keys(results) -> list:
+    """Crops and renditions referenced by a scan's results (a dict or the stored JSON), which scan review still shows."""
+    if isinstance(results, str):
+        try:
+            results = json.loads(results)
+        except ValueError:
+            return []  # An error message, not results
+    if not isinstance(results, dict):
+        return []
+    keys = []
+    for card in results.get("detected_cards") or []:
+        keys.append(blob_key(card.get("crop_image_url")))
+        keys.append(rendition_blob_key(card.get("thumbnail_key")))
+    return [key for key in keys if key]
+
+
+def copy_blob_keys(copy_row) -> list:
+    """Keys referenced by an inventory_copies row (a mapping or an InventoryCopy)."""
+    if isinstance(copy_row, dict):
+        return [blob_key(copy_row["card_image_url"]), rendition_blob_key(copy_row["thumbnail_key"])]
+    return [blob_key(copy_row.card_image_url), rendition_blob_key(copy_row.thumbnail_key)]
+
+
+def rebuild_blob_refs(db: Session) -> int:
+    """Recount every reference from Scan, InventoryEntry and InventoryCopy rows. Returns the number of referenced blobs."""
+    counts = {}
+    for image_url, results in db.query(Scan.image_url, Scan.results):
+        for key in [blob_key(image_url)] + scan_result_blob_keys(results):
+            if key:
+                counts[key] = counts.get(key, 0) + 1
+    for entry in db.query(InventoryEntry):
+        for key in inventory_blob_keys(entry):
+            if key:
+                counts[key] = counts.get(key, 0) + 1
+    for copy_row in db.query(InventoryCopy):
+        for key in copy_blob_keys(copy_row):
+            if key:
+                counts[key] = counts.get(key, 0) + 1
+
+    now = datetime.utcnow()
+    db.query(Blob).delete(synchronize_session=False)
+    db.bulk_insert_mappings(Blob, [
+        {"key": key, "ref_count": count, "zero_since": None, "created_at": now}
+        for key, count in counts.items()
+    ])
+    db.commit()
+    return len(counts)
+
+
+def _gc_blob_key(stored_key: str) -> str:
+    """Blob key a stored file is counted under (rendition files share their set's key)."""
+    if stored_key.startswith("renditions/"):
+        return "/".join(stored_key.split("/", 2)[:2])
+    return stored_key
+
+
+def _delete_blob(key: str):
+    if key.startswith("renditions/"):
+        blob_store.delete_prefix(key)
+    else:
+        blob_store.delete(key)
+
+
+def collect_garbage_blobs() -> dict:
+    """
+    Delete blobs nobody has referenced for BLOB_GC_GRACE_SECONDS: blobs whose last reference was
+    removed, and stored files that were never referenced at all (scans past the card limit,
+    failed saves, interrupted uploads). Crops in a scan's results count as references of the scan.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=BLOB_GC_GRACE_SECONDS)
+    cutoff_ts = time.time() - BLOB_GC_GRACE_SECONDS
+    released = orphaned = 0
+
+    db = SessionLocal()
+    try:
+        keys = [key for (key,) in db.query(Blob.key).filter(Blob.ref_count <= 0, Blob.zero_since < cutoff)]
+        for key in keys:
+            # Compare-and-set so a blob re-referenced since the query survives
+            removed = db.query(Blob).filter(Blob.key == key, Blob.ref_count <= 0).delete(synchronize_session=False)
+            db.commit()
+            if removed:
+                _delete_blob(key)
+                released += 1
+
+        candidates = set()
+        for stored_key, modified in blob_store.list():
+            if modified < cutoff_ts:
+                candidates.add(_gc_blob_key(stored_key))
+        candidates = sorted(candidates)
+        for i in range(0, len(candidates), 500):
+            batch = candidates[i:i + 500]
+            referenced = {key for (key,) in db.query(Blob.key).filter(Blob.key.in_(batch))}
+            for key in batch:
+                if key not in referenced:
+                    _delete_blob(key)
+                    orphaned += 1
+    finally:
+        db.close()
+
+    return {"released": released, "orphaned": orphaned}
+
+
+async def blob_gc_loop():
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL_SECONDS)
+        try:
+            result = await asyncio.to_thread(collect_garbage_blobs)
+            if result["released"] or result["orphaned"]:
+                print(f"Blob GC removed {result['released']} released and {result['orphaned']} orphaned blob(s)")
+        except Exception as e:
+            print(f"Error collecting unreferenced blobs: {e}")
+
+
+@app.on_event("startup")
+async def start_blob_gc():
+    db = SessionLocal()
+    try:
+        # Databases from before reference counting: count existing references once
+        if db.query(Blob).first() is None and (db.query(Scan).first() or db.query(InventoryEntry).first()):
+            print(f"Counted references for {rebuild_blob_refs(db)} existing blob(s)")
+    finally:
+        db.close()
+    if BLOB_GC_INTERVAL_SECONDS > 0:
+        blob_gc_tasks.append(asyncio.create_task(blob_gc_loop()))
+
+
+@app.on_event("shutdown")
+async def stop_blob_gc():
+    for task in blob_gc_tasks:
+        task.cancel()
+    await asyncio.gather(*blob_gc_tasks, return_exceptions=True)
+    blob_gc_tasks.clear()
+
+
+# Subscription tier limits
+SUBSCRIPTION_TIERS = {
+    "free": {
+        "name": "Free",
+        "max_cards": 100,
+        "max_trend_insights": 3,
+        "price": 0,
+        "price_period": "month"
+    },
+    "pro": {
+        "name": "Pro",
+        "max_cards": 1000,
+        "max_trend_insights": 20,
+        "price": 9.99,
+        "price_period": "month"
+    },
+    "premium": {
+        "name": "Premium",
+        "max_cards": 10000,
+        "max_trend_insights": 100,
+        "price": 19.99,
+        "price_period": "month"
+    }
+}
+
+class InventoryEntry(Base):
+    """A holding: every copy a user owns of one card in one set and condition."""
+    __tablename__ = "inventory_entries"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id"))
+    card_key = Column(String, nullable=True)  # normalize_card_key(card_name); NULL until compacted
+    catalog_id = Column(Integer, ForeignKey("catalog_cards.id"), nullable=True, index=True)
+    card_name = Column(String)
+    set_code = Column(String)
+    quantity = Column(Integer, default=1)
+    condition = Column(String)
+    condition_grade = Column(Float, nullable=True)
+    current_value = Column(Float, nullable=True)
+    scan_image_url = Column(String, nullable=True)
+    card_image_url = Column(String, nullable=True)  # Cropped card image
+    thumbnail_key = Column(String, nullable=True)  # Rendition key, see rendition_urls()
+    metadata_json = Column(Text, nullable=True)  # JSON string for additional card data
+    scanned_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    user = relationship("User", back_populates="inventory")
+
+    __table_args__ = (
+        # Keyset pagination for the two inventory sort modes
+        Index("ix_inventory_user_scanned", "user_id", "scanned_at", "id"),
+        Index("ix_inventory_user_value", "user_id", "current_value", "id"),
+        # Upsert target for save_detected_cards_to_inventory (NULL card_keys never conflict)
+        Index("ux_inventory_holding", "user_id", "card_key", "set_code", "condition", unique=True),
+        Index("ix_inventory_card_key", "card_key", "set_code"),
+    )
+
+
+class InventoryCopy(Base):
+    """Provenance of one physical copy in a holding: the scan it came from and its own crop."""
+    __tablename__ = "inventory_copies"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    entry_id = Column(String, ForeignKey("inventory_entries.id"), index=True)
+    scan_id = Column(String, nullable=True)
+    detected_card_id = Column(String, nullable=True)
+    condition_grade = Column(Float, nullable=True)
+    card_image_url = Column(String, nullable=True)
+    thumbnail_key = Column(String, nullable=True)
+    metadata_json = Column(Text, nullable=True)
+    scanned_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Marketplace Wants
+class Want(Base):
+    __tablename__ = "wants"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id"))
+    card_name = Column(String, index=True)
+    set_code = Column(String, index=True, nullable=True)
+    card_key = Column(String, nullable=True, index=True)  # Canonical name when the catalog resolved it
+    catalog_id = Column(Integer, ForeignKey("catalog_cards.id"), nullable=True, index=True)
+    min_condition = Column(String, nullable=True)
+    max_price = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Want/have match index, kept in step with wants, holdings and marketplace_enabled (see sync_marketplace_matches)
+class MarketplaceMatch(Base):
+    __tablename__ = "marketplace_matches"
+    id = Column(Integer, primary_key=True, autoincrement=True)  # Insertion order; breaks score ties
+    want_id = Column(String, ForeignKey("wants.id"))
+    entry_id = Column(String, ForeignKey("inventory_entries.id"), index=True)
+    user_id = Column(String, ForeignKey("users.id"))  # Who wants the card
+    owner_id = Column(String, ForeignKey("users.id"), index=True)  # Who has it
+    score = Column(Float, nullable=True)  # 0-100, see score_marketplace_candidates
+    eligible = Column(Boolean, nullable=True)  # Within the want's min_condition and max_price; NULL until scored
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ux_marketplace_match", "want_id", "entry_id", unique=True),
+        Index("ix_marketplace_matches_user", "user_id", "id"),
+        Index("ix_marketplace_matches_user_score", "user_id", "score", "id"),  # The listing's keyset
+        Index("ix_marketplace_matches_want_score", "want_id", "score", "id"),  # Best matches per want
+    )
+
+# Canonical card catalog: one row per printing (name, set, number)
+class CatalogCard(Base):
+    __tablename__ = "catalog_cards"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String)
+    card_key = Column(String, index=True)  # normalize_card_key(name)
+    set_code = Column(String, default="")
+    number = Column(String, default="")
+    domain = Column(String, nullable=True)  # "pokemon" | "mtg" | "sports" | ...
+    year = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ux_catalog_printing", "card_key", "set_code", "number", unique=True),
+    )
+
+# Notifications
+class Notification(Base):
+    __tablename__ = "notifications"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id"))
+    type = Column(String)  # "marketplace_match" | "trend"
+    title = Column(String)
+    message = Column(Text)
+    read = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Dashboard summaries, kept in step with inventory, notifications and scans (see change_user_summary)
+class UserSummary(Base):
+    __tablename__ = "user_summaries"
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    card_count = Column(Integer, default=0)  # Sum of holding quantities
+    total_value = Column(Float, default=0.0)  # Sum of current_value * quantity
+    unread_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class UserScanDay(Base):
+    """Scans uploaded per user per UTC day; recent_scans sums the last RECENT_SCAN_DAYS buckets."""
+    __tablename__ = "user_scan_days"
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    scan_count = Column(Integer, default=0)
+
+# Portfolio value history. Points are written when a value may have changed, so a series is a step
+# function: the value at time t is the latest point at or before t.
+class PortfolioSnapshot(Base):
+    __tablename__ = "portfolio_snapshots"
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    resolution = Column(String, primary_key=True)  # "raw" | "hour" | "day" (hour/day hold the bucket's closing value)
+    bucket_start = Column(DateTime, primary_key=True)
+    total_value = Column(Float)
+    card_count = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_portfolio_resolution_bucket", "resolution", "bucket_start"),
+    )
+
+# Market prices per card (normalized name), set and condition; condition "" prices any condition
+class CardPrice(Base):
+    __tablename__ = "card_prices"
+    card_key = Column(String, primary_key=True)
+    set_code = Column(String, primary_key=True)
+    condition = Column(String, primary_key=True)
+    price = Column(Float)
+    currency = Column(String, default="USD")
+    source = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)  # Last time the price changed
+
+class HoldingValuePoint(Base):
+    """A holding's unit value and quantity whenever its price changes."""
+    __tablename__ = "holding_value_points"
+    entry_id = Column(String, ForeignKey("inventory_entries.id"), primary_key=True)
+    recorded_at = Column(DateTime, primary_key=True, index=True)
+    unit_value = Column(Float)
+    quantity = Column(Integer)
+
+# Create tables
+Base.metadata.create_all(bind=engine)
+
+def _ensure_sqlite_columns():
+    """
+    MVP convenience: if you're using an existing sqlite db, add newly introduced columns.
+    This avoids forcing a full migration framework for a 1-day MVP.
+    """
+    if not SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+        return
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(users)")
+        cols = {row[1] for row in cur.fetchall()}
+        if "notification_in_app" not in cols:
+            cur.execute("ALTER TABLE users ADD COLUMN notification_in_app BOOLEAN DEFAULT 1")
+        if "city" not in cols:
+            cur.execute("ALTER TABLE users ADD COLUMN city VARCHAR")
+        if "state_province" not in cols:
+            cur.execute("ALTER TABLE users ADD COLUMN state_province VARCHAR")
+        if "country" not in cols:
+            cur.execute("ALTER TABLE users ADD COLUMN country VARCHAR")
+        if "subscription_tier" not in cols:
+            cur.execute("ALTER TABLE users ADD COLUMN subscription_tier VARCHAR DEFAULT 'free'")
+        
+        # Check inventory_entries columns
+        cur.execute("PRAGMA table_info(inventory_entries)")
+        inv_cols = {row[1] for row in cur.fetchall()}
+        if "card_image_url" not in inv_cols:
+            cur.execute("ALTER TABLE inventory_entries ADD COLUMN card_image_url VARCHAR")
+        if "metadata_json" not in inv_cols:
+            cur.execute("ALTER TABLE inventory_entries ADD COLUMN metadata_json TEXT")
+        if "thumbnail_key" not in inv_cols:
+            cur.execute("ALTER TABLE inventory_entries ADD COLUMN thumbnail_key VARCHAR")
+        if "card_key" not in inv_cols:
+            cur.execute("ALTER TABLE inventory_entries ADD COLUMN card_key VARCHAR")
+        if "catalog_id" not in inv_cols:
+            cur.execute("ALTER TABLE inventory_entries ADD COLUMN catalog_id INTEGER")
+
+        # Check wants columns
+        cur.execute("PRAGMA table_info(wants)")
+        want_cols = {row[1] for row in cur.fetchall()}
+        if "card_key" not in want_cols:
+            cur.execute("ALTER TABLE wants ADD COLUMN card_key VARCHAR")
+        if "catalog_id" not in want_cols:
+            cur.execute("ALTER TABLE wants ADD COLUMN catalog_id INTEGER")
+
+        # Check scan_jobs columns
+        cur.execute("PRAGMA table_info(scan_jobs)")
+        job_cols = {row[1] for row in cur.fetchall()}
+        if "image_sha256" not in job_cols:
+            cur.execute("ALTER TABLE scan_jobs ADD COLUMN image_sha256 VARCHAR")
+        if "bypass_cache" not in job_cols:
+            cur.execute("ALTER TABLE scan_jobs ADD COLUMN bypass_cache BOOLEAN DEFAULT 0")
+
+        # Check marketplace_matches columns (ensure_marketplace_matches scores existing rows)
+        cur.execute("PRAGMA table_info(marketplace_matches)")
+        match_cols = {row[1] for row in cur.fetchall()}
+        if "score" not in match_cols:
+            cur.execute("ALTER TABLE marketplace_matches ADD COLUMN score FLOAT")
+        if "eligible" not in match_cols:
+            cur.execute("ALTER TABLE marketplace_matches ADD COLUMN eligible BOOLEAN")
+        
+        conn.commit()
+    finally:
+        conn.close()
+
+_ensure_sqlite_columns()
+
+def _ensure_indexes():
+    """create_all only builds indexes for new tables; add indexes introduced later to existing ones."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+_ensure_indexes()
+
+# Inventory search index
+# SQLite: an FTS5 trigram index over card_name/set_code, kept in sync by triggers. Each entry gets a
+# stable integer key in inventory_fts_keys (an INTEGER PRIMARY KEY, which VACUUM never renumbers, unlike
+# the implicit rowid of inventory_entries), and the index stores the entry id to join on. Trigrams give
+# substring and prefix matches from the index, and overlapping trigrams give typo-tolerant ranking.
+# PostgreSQL: pg_trgm GIN indexes, which also serve ILIKE '%term%'.
+# Terms shorter than a trigram fall back to LIKE.
+inventory_fts_available = False
+
+
+def _ensure_inventory_search_index():
+    global inventory_fts_available
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_inventory_card_name_trgm "
+                "ON inventory_entries USING gin (card_name gin_trgm_ops)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_inventory_set_code_trgm "
+                "ON inventory_entries USING gin (set_code gin_trgm_ops)"
+            ))
+        inventory_fts_available = True
+        return
+    if not SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+        return
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT sql FROM sqlite_master WHERE name = 'inventory_fts'")
+        existing = cur.fetchone()
+        if existing and "entry_id" not in existing[0]:
+            # Index from before inventory_fts_keys, keyed on the entries' rowid: rebuild it
+            cur.executescript("""
+                DROP TRIGGER IF EXISTS inventory_fts_insert;
+                DROP TRIGGER IF EXISTS inventory_fts_delete;
+                DROP TRIGGER IF EXISTS inventory_fts_update;
+                DROP TABLE inventory_fts;
+            """)
+            existing = None
+        try:
+            cur.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS inventory_fts USING fts5("
+                "entry_id UNINDEXED, card_name, set_code, tokenize='trigram')"
+            )
+        except Exception as e:
+            print(f"FTS5 trigram search unavailable, using LIKE: {e}")
+            return
+        cur.executescript("""
+            CREATE TABLE IF NOT EXISTS inventory_fts_keys (
+                id INTEGER PRIMARY KEY,
+                entry_id VARCHAR NOT NULL UNIQUE
+            );
+            CREATE TRIGGER IF NOT EXISTS inventory_fts_insert AFTER INSERT ON inventory_entries BEGIN
+                INSERT INTO inventory_fts_keys(entry_id) VALUES (new.id);
+                INSERT INTO inventory_fts(rowid, entry_id, card_name, set_code)
+                VALUES ((SELECT id FROM inventory_fts_keys WHERE entry_id = new.id), new.id, new.card_name, new.set_code);
+            END;
+            CREATE TRIGGER IF NOT EXISTS inventory_fts_delete AFTER DELETE ON inventory_entries BEGIN
+                DELETE FROM inventory_fts WHERE rowid = (SELECT id FROM inventory_fts_keys WHERE entry_id = old.id);
+                DELETE FROM inventory_fts_keys WHERE entry_id = old.id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS inventory_fts_update AFTER UPDATE OF card_name, set_code ON inventory_entries BEGIN
+                UPDATE inventory_fts SET card_name = new.card_name, set_code = new.set_code
+                WHERE rowid = (SELECT id FROM inventory_fts_keys WHERE entry_id = new.id);
+            END;
+        """)
+        if not existing:
+            cur.executescript("""
+                DELETE FROM inventory_fts_keys;
+                INSERT INTO inventory_fts_keys(entry_id) SELECT id FROM inventory_entries;
+                INSERT INTO inventory_fts(rowid, entry_id, card_name, set_code)
+                SELECT k.id, e.id, e.card_name, e.set_code
+                FROM inventory_fts_keys k JOIN inventory_entries e ON e.id = k.entry_id;
+            """)
+        conn.commit()
+        inventory_fts_available = True
+    finally:
+        conn.close()
+
+_ensure_inventory_search_index()
+
+
+def _trigrams(value: str) -> set:
+    value = f" {value.lower().strip()} "
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def trigram_similarity(a: str, b: str) -> float:
+    a_grams, b_grams = _trigrams(a), _trigrams(b)
+    if not a_grams or not b_grams:
+        return 0.0
+    return len(a_grams & b_grams) / len(a_grams | b_grams)
+
+
+def search_similarity(term: str, value: str) -> float:
+    """Best trigram similarity of the term against the whole value or any single word of it."""
+    return max([trigram_similarity(term, value)] + [trigram_similarity(term, word) for word in value.split()])
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def inventory_search_filter(query, search: str):
+    """Restrict an InventoryEntry query to rows whose name or set contains the search term."""
+    term = search.strip()
+    if not inventory_fts_available or len(term) < 3:
+        return query.filter(
+            (InventoryEntry.card_name.contains(term)) |
+            (InventoryEntry.set_code.contains(term))
+        )
+    if engine.dialect.name == "postgresql":
+        return query.filter(
+            InventoryEntry.card_name.ilike(f"%{term}%") | InventoryEntry.set_code.ilike(f"%{term}%")
+        )
+    matches = text("SELECT entry_id FROM inventory_fts WHERE inventory_fts MATCH :phrase").bindparams(
+        phrase=_fts_phrase(term)
+    ).columns(column("entry_id"))
+    return query.filter(InventoryEntry.id.in_(matches))
+
+
+def search_inventory_ranked(db: Session, user_id: str, search: str, limit: int, offset: int = 0) -> list:
+    """
+    Rank a user's entries against the search term: exact-prefix names first, then substring matches by
+    bm25 (or trigram similarity on PostgreSQL), then near misses (typos) down to
+    INVENTORY_SEARCH_MIN_SIMILARITY (pg_trgm.similarity_threshold on PostgreSQL). Returns up to limit entries after skipping offset.
+    """
+    term = search.strip()
+    wanted = offset + limit
+    base = db.query(InventoryEntry).filter(InventoryEntry.user_id == user_id)
+    prefix_first = case((InventoryEntry.card_name.ilike(f"{term}%"), 0), else_=1)
+
+    if not inventory_fts_available or len(term) < 3:
+        return inventory_search_filter(base, term).order_by(
+            prefix_first, InventoryEntry.card_name, InventoryEntry.id
+        ).offset(offset).limit(limit).all()
+
+    if engine.dialect.name == "postgresql":
+        similarity = func.greatest(
+            func.similarity(InventoryEntry.card_name, term),
+            func.similarity(InventoryEntry.set_code, term)
+        )
+        return base.filter(
+            InventoryEntry.card_name.ilike(f"%{term}%") | InventoryEntry.set_code.ilike(f"%{term}%") |
+            InventoryEntry.card_name.op("%")(term)  # pg_trgm similarity above pg_trgm.similarity_threshold
+        ).order_by(prefix_first, similarity.desc(), InventoryEntry.id).offset(offset).limit(limit).all()
+
+    ranked_sql = text("""
+        SELECT e.id FROM inventory_fts JOIN inventory_entries e ON e.id = inventory_fts.entry_id
+        WHERE inventory_fts MATCH :match AND e.user_id = :user_id
+        ORDER BY e.card_name LIKE :prefix DESC, bm25(inventory_fts), e.id
+        LIMIT :limit
+    """)
+    params = {"user_id": user_id, "prefix": f"{term}%"}
+    ids = [row[0] for row in db.execute(ranked_sql, {**params, "match": _fts_phrase(term), "limit": wanted})]
+
+    if len(ids) < wanted:
+        # Typo tolerance: any shared trigram makes a candidate, rescored by overall trigram similarity
+        lowered = term.lower()
+        any_trigram = " OR ".join(sorted({_fts_phrase(lowered[i:i + 3]) for i in range(len(lowered) - 2)}))
+        seen = set(ids)
+        candidate_ids = [
+            row[0] for row in db.execute(
+                ranked_sql, {**params, "match": any_trigram, "limit": INVENTORY_SEARCH_FUZZY_CANDIDATES}
+            )
+            if row[0] not in seen
+        ]
+        scored = []
+        for entry in db.query(InventoryEntry).filter(InventoryEntry.id.in_(candidate_ids)):
+            score = max(search_similarity(term, entry.card_name or ""), search_similarity(term, entry.set_code or ""))
+            if score >= INVENTORY_SEARCH_MIN_SIMILARITY:
+                scored.append((-score, entry.id))
+        ids.extend(entry_id for _, entry_id in sorted(scored))
+
+    ids = ids[offset:wanted]
+    entries = {entry.id: entry for entry in db.query(InventoryEntry).filter(InventoryEntry.id.in_(ids))}
+    return [entries[entry_id] for entry_id in ids if entry_id in entries]
+
+
+# Dashboard summaries
+# Every write that changes a user's card count, portfolio value, unread count or scan count applies
+# the same delta to user_summaries in its own transaction, so the dashboard and tier checks read one
+# row. reconcile_user_summaries() recomputes from the source tables to catch and repair drift.
+summary_reconcile_tasks: list = []
+
+
+def change_user_summary(db: Session, user_id: str, cards: int = 0, value: float = 0.0, unread: int = 0):
+    """Add deltas to the user's summary row, in the caller's transaction."""
+    if not (cards or value or unread):
+        return
+    summaries = UserSummary.__table__
+    now = datetime.utcnow()
+    stmt = dialect_insert(summaries).values(
+        user_id=user_id,
+        card_count=cards,
+        total_value=value,
+        unread_count=unread,
+        updated_at=now
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={
+            "card_count": summaries.c.card_count + cards,
+            "total_value": summaries.c.total_value + value,
+            "unread_count": summaries.c.unread_count + unread,
+            "updated_at": now
+        }
+    )
+    db.execute(stmt)
+
+
+def record_scans(db: Session, user_id: str, count: int = 1):
+    """Count uploaded scans in today's bucket, in the caller's transaction."""
+    scan_days = UserScanDay.__table__
+    stmt = dialect_insert(scan_days).values(user_id=user_id, day=datetime.utcnow().date(), scan_count=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "day"],
+        set_={"scan_count": scan_days.c.scan_count + count}
+    )
+    db.execute(stmt)
+
+
+def add_notification(db: Session, user_id: str, type: str, title: str, message: str) -> "Notification":
+    notification = Notification(user_id=user_id, type=type, title=title, message=message)
+    db.add(notification)
+    change_user_summary(db, user_id, unread=1)
+    return notification
+
+
+def get_user_summary(db: Session, user_id: str) -> dict:
+    summary = db.get(UserSummary, user_id)
+    recent_scans = db.query(func.coalesce(func.sum(UserScanDay.scan_count), 0)).filter(
+        UserScanDay.user_id == user_id,
+        UserScanDay.day > datetime.utcnow().date() - timedelta(days=RECENT_SCAN_DAYS)
+    ).scalar()
+    return {
+        "card_count": summary.card_count if summary else 0,
+        "total_value": summary.total_value if summary else 0.0,
+        "unread_count": summary.unread_count if summary else 0,
+        "recent_scans": recent_scans
+    }
+
+
+def repair_user_summary(db: Session, user_id: str):
+    """
+    Overwrite the user's summary with aggregates computed inside the same statement. The comparison
+    in reconcile_user_summaries reads a snapshot that concurrent change_user_summary deltas may
+    already have moved past; recomputing at write time keeps those deltas instead of clobbering them.
+    """
+    summaries = UserSummary.__table__
+    cards = select(func.coalesce(func.sum(InventoryEntry.quantity), 0)).where(
+        InventoryEntry.user_id == user_id
+    ).scalar_subquery()
+    value = select(
+        func.coalesce(func.sum(func.coalesce(InventoryEntry.current_value, 0) * InventoryEntry.quantity), 0)
+    ).where(InventoryEntry.user_id == user_id).scalar_subquery()
+    unread = select(func.count(Notification.id)).where(
+        Notification.user_id == user_id, Notification.read == False  # noqa: E712
+    ).scalar_subquery()
+    now = datetime.utcnow()
+    stmt = dialect_insert(summaries).values(
+        user_id=user_id, card_count=cards, total_value=value, unread_count=unread, updated_at=now
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"card_count": cards, "total_value": value, "unread_count": unread, "updated_at": now}
+    )
+    db.execute(stmt)
+
+
+def repair_user_scan_days(db: Session, user_id: str, first_day: date):
+    """Rewrite the user's retained scan buckets from the scans table, counting at write time."""
+    scan_days = UserScanDay.__table__
+    since = datetime.combine(first_day, datetime.min.time())
+    scan_day = func.date(Scan.created_at)
+    db.execute(scan_days.delete().where(
+        scan_days.c.user_id == user_id,
+        scan_days.c.day >= first_day,
+        ~select(Scan.id).where(
+            Scan.user_id == user_id, Scan.created_at >= since, scan_day == scan_days.c.day
+        ).exists()
+    ))
+    counts = select(Scan.user_id, scan_day, func.count(Scan.id)).where(
+        Scan.user_id == user_id, Scan.created_at >= since
+    ).group_by(Scan.user_id, scan_day)
+    stmt = dialect_insert(scan_days).from_select(["user_id", "day", "scan_count"], counts)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "day"],
+        set_={"scan_count": stmt.excluded.scan_count}
+    )
+    db.execute(stmt)
+
+
+def reconcile_user_summaries(db: Session, repair: bool = True) -> dict:
+    """
+    Recompute every summary and scan bucket from the source tables and compare with the stored rows.
+    With repair, drifted users are rewritten from the source tables at write time (see
+    repair_user_summary), one user per transaction. Also prunes scan buckets older than
+    SCAN_DAY_RETENTION_DAYS.
+    """
+    actual = {}  # user_id -> [card_count, total_value, unread_count]
+    for user_id, cards, value in db.query(
+        InventoryEntry.user_id,
+        func.coalesce(func.sum(InventoryEntry.quantity), 0),
+        func.coalesce(func.sum(func.coalesce(InventoryEntry.current_value, 0) * InventoryEntry.quantity), 0)
+    ).group_by(InventoryEntry.user_id):
+        actual[user_id] = [cards, value, 0]
+    for user_id, unread in db.query(Notification.user_id, func.count(Notification.id)).filter(
+        Notification.read == False  # noqa: E712
+    ).group_by(Notification.user_id):
+        actual.setdefault(user_id, [0, 0.0, 0])[2] = unread
+
+    first_day = datetime.utcnow().date() - timedelta(days=SCAN_DAY_RETENTION_DAYS - 1)
+    actual_days = {}  # user_id -> {day: count}
+    for user_id, day, count in db.query(Scan.user_id, func.date(Scan.created_at), func.count(Scan.id)).filter(
+        Scan.created_at >= datetime.combine(first_day, datetime.min.time())
+    ).group_by(Scan.user_id, func.date(Scan.created_at)):
+        day = day if isinstance(day, date) else date.fromisoformat(day)
+        actual_days.setdefault(user_id, {})[day] = count
+
+    stored = {row.user_id: row for row in db.query(UserSummary)}
+    stored_days = {}
+    for row in db.query(UserScanDay).filter(UserScanDay.day >= first_day):
+        stored_days.setdefault(row.user_id, {})[row.day] = row.scan_count
+
+    drifted = []
+    for user_id in set(actual) | set(stored) | set(actual_days) | set(stored_days):
+        cards, value, unread = actual.get(user_id, [0, 0.0, 0])
+        row = stored.get(user_id)
+        summary_drift = (
+            (row.card_count if row else 0) != cards or
+            (row.unread_count if row else 0) != unread or
+            abs((row.total_value if row else 0.0) - value) > 0.005
+        )
+        days_drift = stored_days.get(user_id, {}) != actual_days.get(user_id, {})
+        if not (summary_drift or days_drift):
+            continue
+        drifted.append(user_id)
+        if not repair:
+            continue
+        if summary_drift:
+            repair_user_summary(db, user_id)
+        if days_drift:
+            repair_user_scan_days(db, user_id, first_day)
+        db.commit()
+
+    pruned = db.query(UserScanDay).filter(UserScanDay.day < first_day).delete(synchronize_session=False)
+    db.commit()
+    if drifted:
+        print(f"Summary drift for {len(drifted)} user(s){' (repaired)' if repair else ''}: {drifted[:10]}")
+    return {"users": len(set(actual) | set(stored)), "drifted": len(drifted), "repaired": repair, "pruned_days": pruned}
+
+
+def _reconcile_user_summaries() -> dict:
+    db = SessionLocal()
+    try:
+        return reconcile_user_summaries(db)
+    finally:
+        db.close()
+
+
+async def summary_reconcile_loop():
+    while True:
+        await asyncio.sleep(SUMMARY_RECONCILE_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(_reconcile_user_summaries)
+        except Exception as e:
+            print(f"Error reconciling user summaries: {e}")
+
+
+def ensure_user_summaries(db: Session):
+    """Databases from before summaries: build them once, before any delta is applied."""
+    if db.query(UserSummary).first() is None and db.query(User).first() is not None:
+        result = reconcile_user_summaries(db)
+        print(f"Built summaries for {result['users']} user(s)")
+
+
+@app.on_event("startup")
+async def start_summary_reconcile():
+    db = SessionLocal()
+    try:
+        ensure_user_summaries(db)
+    finally:
+        db.close()
+    if SUMMARY_RECONCILE_INTERVAL_SECONDS > 0:
+        summary_reconcile_tasks.append(asyncio.create_task(summary_reconcile_loop()))
+
+
+@app.on_event("shutdown")
+async def stop_summary_reconcile():
+    for task in summary_reconcile_tasks:
+        task.cancel()
+    await asyncio.gather(*summary_reconcile_tasks, return_exceptions=True)
+    summary_reconcile_tasks.clear()
+
+
+# Portfolio history
+# Snapshots are taken from user_summaries, so a tick costs one INSERT ... SELECT over the users whose
+# summary changed since the previous tick, never a pass over inventories. Raw points roll up into
+# hourly and daily closing values; each resolution has its own retention.
+portfolio_snapshot_tasks: list = []
+last_portfolio_snapshot_at: Optional[datetime] = None
+
+
+def record_portfolio_snapshots(db: Session, user_ids: Optional[list] = None, since: Optional[datetime] = None) -> int:
+    """
+    Write a raw point for each given user (or every user whose summary changed since `since`, or
+    everyone) from their current summary, in the caller's transaction. Returns the number written.
+    """
+    now = datetime.utcnow()
+    source = select(
+        UserSummary.user_id,
+        literal("raw"),
+        literal(now, DateTime),
+        UserSummary.total_value,
+        UserSummary.card_count
+    )
+    if user_ids is not None:
+        if not user_ids:
+            return 0
+        source = source.where(UserSummary.user_id.in_(user_ids))
+    elif since is not None:
+        source = source.where(UserSummary.updated_at >= since)
+    stmt = insert(PortfolioSnapshot).from_select(
+        ["user_id", "resolution", "bucket_start", "total_value", "card_count"], source
+    )
+    return db.execute(stmt).rowcount
+
+
+def record_holding_values(db: Session, values: list):
+    """Append price points for holdings, in the caller's transaction. values: [(entry_id, unit_value, quantity)]"""
+    now = datetime.utcnow()
+    if values:
+        db.execute(insert(HoldingValuePoint), [
+            {"entry_id": entry_id, "recorded_at": now, "unit_value": unit_value, "quantity": quantity}
+            for entry_id, unit_value, quantity in values
+        ])
+
+
+def _bucket_start(moment: datetime, resolution: str) -> datetime:
+    if resolution == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def rollup_portfolio_snapshots(db: Session, source: str, target: str) -> int:
+    """
+    Upsert target-resolution closing values from source points, starting at the newest target bucket
+    (re-closing it, since it may have been partial). Returns the number of buckets written.
+    """
+    snapshots = PortfolioSnapshot.__table__
+    watermark = db.query(func.max(PortfolioSnapshot.bucket_start)).filter(
+        PortfolioSnapshot.resolution == target
+    ).scalar()
+    query = db.query(PortfolioSnapshot).filter(PortfolioSnapshot.resolution == source)
+    if watermark is not None:
+        query = query.filter(PortfolioSnapshot.bucket_start >= watermark)
+
+    closes = {}  # (user_id, bucket) -> latest source point in the bucket
+    for point in query.order_by(PortfolioSnapshot.bucket_start):
+        closes[(point.user_id, _bucket_start(point.bucket_start, target))] = point
+    for items in _chunks(list(closes.items()), 500):
+        stmt = dialect_insert(snapshots).values([
+            {
+                "user_id": user_id,
+                "resolution": target,
+                "bucket_start": bucket,
+                "total_value": point.total_value,
+                "card_count": point.card_count
+            }
+            for (user_id, bucket), point in items
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "resolution", "bucket_start"],
+            set_={"total_value": stmt.excluded.total_value, "card_count": stmt.excluded.card_count}
+        )
+        db.execute(stmt)
+    return len(closes)
+
+
+def prune_portfolio_history(db: Session) -> int:
+    now = datetime.utcnow()
+    removed = 0
+    for resolution, keep in (
+        ("raw", timedelta(hours=PORTFOLIO_RAW_RETENTION_HOURS)),
+        ("hour", timedelta(days=PORTFOLIO_HOURLY_RETENTION_DAYS)),
+        ("day", timedelta(days=PORTFOLIO_DAILY_RETENTION_DAYS)),
+    ):
+        removed += db.query(PortfolioSnapshot).filter(
+            PortfolioSnapshot.resolution == resolution,
+            PortfolioSnapshot.bucket_start < now - keep
+        ).delete(synchronize_session=False)
+    removed += db.query(HoldingValuePoint).filter(
+        HoldingValuePoint.recorded_at < now - timedelta(days=PORTFOLIO_DAILY_RETENTION_DAYS)
+    ).delete(synchronize_session=False)
+    return removed
+
+
+def run_portfolio_snapshot_tick() -> dict:
+    """One scheduled pass: snapshot changed users, roll up raw -> hour -> day, apply retention."""
+    global last_portfolio_snapshot_at
+    db = SessionLocal()
+    try:
+        started = datetime.utcnow()
+        since = last_portfolio_snapshot_at
+        if since is None:
+            # First tick in this process: continue from the newest stored point (everyone on a fresh table)
+            since = db.query(func.max(PortfolioSnapshot.bucket_start)).filter(
+                PortfolioSnapshot.resolution == "raw"
+            ).scalar()
+        # Overlap a little so a summary committed just after the previous tick isn't missed
+        written = record_portfolio_snapshots(db, since=since - timedelta(seconds=60) if since else None)
+        hours = rollup_portfolio_snapshots(db, "raw", "hour")
+        days = rollup_portfolio_snapshots(db, "hour", "day")
+        pruned = prune_portfolio_history(db)
+        db.commit()
+        last_portfolio_snapshot_at = started
+        return {"snapshots": written, "hours": hours, "days": days, "pruned": pruned}
+    finally:
+        db.close()
+
+
+def portfolio_value_at(db: Session, user_id: str, moment: datetime) -> Optional[float]:
+    """Portfolio value at a past moment: the latest point at or before it, finest resolution first."""
+    for resolution in ("raw", "hour", "day"):
+        point = db.query(PortfolioSnapshot.total_value).filter(
+            PortfolioSnapshot.user_id == user_id,
+            PortfolioSnapshot.resolution == resolution,
+            PortfolioSnapshot.bucket_start <= moment
+        ).order_by(PortfolioSnapshot.bucket_start.desc()).first()
+        if point is not None:
+            return point.total_value
+    return None
+
+
+def portfolio_value_changes(db: Session, user_id: str, current_value: float) -> dict:
+    """Change over 24h/7d/30d; zero when there is no history that far back yet."""
+    now = datetime.utcnow()
+    changes = {}
+    for label in ("24h", "7d", "30d"):
+        past = portfolio_value_at(db, user_id, now - PORTFOLIO_HISTORY_RANGES[label][0])
+        amount = current_value - past if past is not None else 0.0
+        changes[label] = {
+            "amount": round(amount, 2),
+            "percent": round(amount / past * 100, 2) if past else 0.0
+        }
+    return changes
+
+
+async def portfolio_snapshot_loop():
+    while True:
+        try:
+            result = await asyncio.to_thread(run_portfolio_snapshot_tick)
+            if result["snapshots"] or result["pruned"]:
+                print(f"Portfolio snapshots: {result}")
+        except Exception as e:
+            print(f"Error recording portfolio snapshots: {e}")
+        await asyncio.sleep(PORTFOLIO_SNAPSHOT_INTERVAL_SECONDS)
+
+
+@app.on_event("startup")
+async def start_portfolio_snapshots():
+    if PORTFOLIO_SNAPSHOT_INTERVAL_SECONDS > 0:
+        portfolio_snapshot_tasks.append(asyncio.create_task(portfolio_snapshot_loop()))
+
+
+@app.on_event("shutdown")
+async def stop_portfolio_snapshots():
+    for task in portfolio_snapshot_tasks:
+        task.cancel()
+    await asyncio.gather(*portfolio_snapshot_tasks, return_exceptions=True)
+    portfolio_snapshot_tasks.clear()
+
+
+# Pricing
+# Feeds are streamed from CSV, JSON Lines or a JSON array and upserted in batches. Only keys whose
+# price actually changed get a new updated_at, and propagate_prices() then moves just those prices
+# onto holdings (and summaries, history) with set-based UPDATEs. Feeds are usually ingested from the
+# CLI, so each server process polls max(card_prices.updated_at) and drops its price_cache when it moves.
+price_cache = LRUTTLCache(PRICE_CACHE_MAX_ENTRIES, PRICE_CACHE_TTL_SECONDS)
+_PRICE_CACHE_MISS = object()
+price_cache_version: Optional[datetime] = None  # max(card_prices.updated_at) when price_cache was last valid
+price_refresh_tasks: list = []
+
+
+def _iter_json_array(f, chunk_size: int = 1 << 16):
+    """Yield the elements of a top-level JSON array without reading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer, pos, opened = "", 0, False
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer):
+            if not opened:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array of records")
+                opened = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+                yield record
+                continue
+            except json.JSONDecodeError:
+                pass  # Record continues in the next chunk
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError("Truncated JSON array")
+        buffer, pos = buffer[pos:] + chunk, 0
+
+
+def iter_feed_records(path: str):
+    """Stream raw records from a feed file: .csv, .jsonl/.ndjson, or .json (array or JSON Lines)."""
+    suffix = Path(path).suffix.lower()
+    with open(path, newline="", encoding="utf-8") as f:
+        if suffix == ".csv":
+            yield from csv.DictReader(f)
+            return
+        if suffix == ".json":
+            head = f.read(1)
+            while head and head.isspace():
+                head = f.read(1)
+            f.seek(0)
+            if head == "[":
+                yield from _iter_json_array(f)
+                return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def price_row(record: dict, source: Optional[str], now: datetime) -> Optional[dict]:
+    """
+    Validate one feed record into a card_prices row; None if it can't be used. Conditions are stored
+    under their canonical names ("NM" -> "Near Mint") so they match holdings; blank means any condition.
+    """
+    card_key = normalize_card_key(record.get("name") or record.get("card_name"))
+    try:
+        price = float(record.get("price") if record.get("price") not in (None, "") else record.get("market_price"))
+    except (TypeError, ValueError):
+        return None
+    if not card_key or not math.isfinite(price) or price < 0:
+        return None
+    condition = (record.get("condition") or "").strip()
+    if condition:
+        condition = normalize_condition(condition)
+        if condition is None:
+            return None  # A condition no holding can have would never price anything
+    return {
+        "card_key": card_key,
+        "set_code": normalize_set_code(record.get("set_code") or record.get("set")),
+        "condition": condition,
+        "price": price,
+        "currency": record.get("currency") or "USD",
+        "source": source,
+        "updated_at": now
+    }
+
+
+def ingest_price_feed(db: Session, path: str, source: Optional[str] = None) -> dict:
+    """Upsert a price feed in batches of PRICE_INGEST_BATCH_SIZE, then propagate changed prices."""
+    started = datetime.utcnow()
+    timer = time.perf_counter()
+    prices = CardPrice.__table__
+    stmt = dialect_insert(prices)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["card_key", "set_code", "condition"],
+        set_={
+            "price": stmt.excluded.price,
+            "currency": stmt.excluded.currency,
+            "source": stmt.excluded.source,
+            # Unchanged prices keep their timestamp, so propagation skips them
+            "updated_at": case(
+                (prices.c.price.is_distinct_from(stmt.excluded.price), stmt.excluded.updated_at),
+                else_=prices.c.updated_at
+            )
+        }
+    )
+
+    stats = {"rows": 0, "upserted": 0, "skipped": 0}
+    source = source or Path(path).name
+    batch = []
+    for record in iter_feed_records(path):
+        stats["rows"] += 1
+        row = price_row(record, source, started)
+        if row is None:
+            stats["skipped"] += 1
+            continue
+        batch.append(row)
+        if len(batch) >= PRICE_INGEST_BATCH_SIZE:
+            db.execute(stmt, batch)
+            stats["upserted"] += len(batch)
+            batch = []
+    if batch:
+        db.execute(stmt, batch)
+        stats["upserted"] += len(batch)
+    db.commit()
+    stats["ingest_seconds"] = round(time.perf_counter() - timer, 3)
+
+    refresh_price_cache(db)
+    stats["propagated"] = propagate_prices(db, since=started)
+    stats["total_seconds"] = round(time.perf_counter() - timer, 3)
+    return stats
+
+
+def propagate_prices(db: Session, since: datetime) -> dict:
+    """
+    Set current_value on every holding whose price changed at or after `since` (exact condition
+    first, then the any-condition price), then refresh the owners' summaries and value history.
+    """
+    timer = time.perf_counter()
+    now = datetime.utcnow()
+    entries = InventoryEntry.__table__
+    prices = CardPrice.__table__
+    same_card = (prices.c.card_key == entries.c.card_key) & (prices.c.set_code == entries.c.set_code)
+    new_value = func.coalesce(
+        select(prices.c.price).where(same_card, prices.c.condition == entries.c.condition).scalar_subquery(),
+        select(prices.c.price).where(same_card, prices.c.condition == "").scalar_subquery(),
+        entries.c.current_value
+    )
+    changed = select(prices.c.card_key).where(same_card, prices.c.updated_at >= since).exists()
+    rows = db.execute(
+        entries.update()
+        .where(changed, entries.c.current_value.is_distinct_from(new_value))
+        .values(current_value=new_value)
+        .returning(entries.c.id, entries.c.user_id, entries.c.current_value, entries.c.quantity)
+    ).all()
+
+    user_ids = sorted({row.user_id for row in rows})
+    summaries = UserSummary.__table__
+    total_value = select(
+        func.coalesce(func.sum(func.coalesce(entries.c.current_value, 0) * entries.c.quantity), 0)
+    ).where(entries.c.user_id == summaries.c.user_id).scalar_subquery()
+    for chunk in _chunks(user_ids, 500):
+        db.execute(summaries.update().where(summaries.c.user_id.in_(chunk)).values(total_value=total_value, updated_at=now))
+        record_portfolio_snapshots(db, user_ids=chunk)
+    for chunk in _chunks(rows, PRICE_INGEST_BATCH_SIZE):
+        record_holding_values(db, [(row.id, row.current_value, row.quantity) for row in chunk])
+        # Price moves a match's score, and whether it is still within the want's max_price
+        rescore_marketplace_matches(db, MarketplaceMatch.entry_id.in_([row.id for row in chunk]))
+    db.commit()
+    return {"holdings": len(rows), "users": len(user_ids), "seconds": round(time.perf_counter() - timer, 3)}
+
+
+def lookup_price(db: Session, card_key: str, set_code: str, condition: str) -> Optional[float]:
+    """Price for a card in a condition (falling back to its any-condition price), via price_cache."""
+    key = (card_key, set_code, condition)
+    cached = price_cache.get(key, _PRICE_CACHE_MISS)
+    if cached is not _PRICE_CACHE_MISS:
+        return cached
+    version = price_cache_version
+    found = dict(db.query(CardPrice.condition, CardPrice.price).filter(
+        CardPrice.card_key == card_key,
+        CardPrice.set_code == set_code,
+        CardPrice.condition.in_([condition, ""])
+    ).all())
+    price = found.get(condition, found.get(""))
+    # Misses are cached too. A read that raced an invalidation may predate the new prices, so skip it
+    if version == price_cache_version:
+        price_cache.set(key, price)
+    return price
+
+
+def refresh_price_cache(db: Session) -> bool:
+    """Clear price_cache if card_prices changed since the last check (in any process). True if cleared."""
+    global price_cache_version
+    latest = db.query(func.max(CardPrice.updated_at)).scalar()
+    if latest == price_cache_version:
+        return False
+    price_cache_version = latest
+    price_cache.clear()
+    return True
+
+
+def _refresh_price_cache() -> bool:
+    db = SessionLocal()
+    try:
+        return refresh_price_cache(db)
+    finally:
+        db.close()
+
+
+async def price_refresh_loop():
+    while True:
+        try:
+            await asyncio.to_thread(_refresh_price_cache)
+        except Exception as e:
+            print(f"Error checking for price updates: {e}")
+        await asyncio.sleep(PRICE_REFRESH_INTERVAL_SECONDS)
+
+
+@app.on_event("startup")
+async def start_price_refresh():
+    if PRICE_REFRESH_INTERVAL_SECONDS > 0:
+        price_refresh_tasks.append(asyncio.create_task(price_refresh_loop()))
+
+
+@app.on_event("shutdown")
+async def stop_price_refresh():
+    for task in price_refresh_tasks:
+        task.cancel()
+    await asyncio.gather(*price_refresh_tasks, return_exceptions=True)
+    price_refresh_tasks.clear()
+
+
+# Card catalog
+# catalog_cards is bulk-loaded from a catalog file (python main.py load-catalog). Each process keeps
+# an in-memory CatalogResolver over it, topped up with rows added since its last refresh, and maps
+# model output and wants to catalog IDs at write time, so matching joins on IDs instead of ILIKE.
+catalog_refresh_tasks: list = []
+
+
+def _word_starts(card_key: str) -> list[int]:
+    starts = [0]
+    for word in card_key.split(" ")[:-1]:
+        starts.append(starts[-1] + len(word) + 1)
+    return starts
+
+
+class CatalogResolver:
+    """
+    Exact lookups on the normalized name, then a trigram inverted index for near misses
+    (misread or misspelled names). A name resolves to a printing (catalog_id) when the set
+    (and number) pick one out, or when the card has a single printing.
+
+    Also serves autocomplete: a sorted array of entries (the name from each word start, then
+    a NUL and the card_key) searched with bisect, plus ranked completions for prefixes whose ranges
+    are too wide to rank per request: built up front for short prefixes, and on first use for longer
+    prefixes matching more than CATALOG_SUGGEST_SCAN_LIMIT entries. Both are kept current as cards are added.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.max_id = 0
+        self.printings = {}  # card_key -> [(catalog_id, set_code, number)]
+        self.names = {}  # card_key -> display name
+        self.postings = {}  # trigram -> [card_key]
+        self.gram_counts = {}  # card_key -> number of distinct trigrams
+        self.prefix_entries = []  # sorted f"{name from a word start}\0{card_key}"
+        self.ranked_completions = {}  # prefix -> sorted [rank], at most CATALOG_SUGGEST_MAX_LIMIT
+        self.ranked_max_length = CATALOG_SUGGEST_SHORT_PREFIX  # Longest prefix in ranked_completions
+        self.latency = LatencyTracker()
+        self.suggest_latency = LatencyTracker()
+        self.exact = 0
+        self.fuzzy = 0
+        self.unresolved = 0
+
+    def add_cards(self, rows):
+        """rows: iterable of (id, name, card_key, set_code, number), in id order."""
+        with self._lock:
+            new_keys, touched = set(), set()
+            for catalog_id, name, card_key, set_code, number in rows:
+                if card_key not in self.printings:
+                    self.printings[card_key] = []
+                    self.names[card_key] = name
+                    grams = _trigrams(card_key)
+                    self.gram_counts[card_key] = len(grams)
+                    for gram in grams:
+                        self.postings.setdefault(gram, []).append(card_key)
+                    new_keys.add(card_key)
+                self.printings[card_key].append((catalog_id, set_code or "", number or ""))
+                touched.add(card_key)
+                self.max_id = max(self.max_id, catalog_id)
+            if new_keys:
+                # Appending a sorted batch leaves two runs, which list.sort merges in linear time
+                self.prefix_entries.extend(sorted(
+                    f"{card_key[start:]}\0{card_key}" for card_key in new_keys for start in _word_starts(card_key)
+                ))
+                self.prefix_entries.sort()
+            for card_key in touched:
+                # A new printing ranks a card higher, so existing cards are re-ranked too
+                self._rank_prefixes(card_key, replace=card_key not in new_keys)
+
+    def _suggest_rank(self, card_key: str, start: int) -> tuple:
+        # Whole-name matches first, then cards with more printings, then shorter names
+        return (start > 0, -len(self.printings[card_key]), len(card_key), card_key)
+
+    def _rank_prefixes(self, card_key: str, replace: bool):
+        for start in _word_starts(card_key):
+            rank = self._suggest_rank(card_key, start)
+            for length in range(1, min(self.ranked_max_length, len(card_key) - start) + 1):
+                prefix = card_key[start:start + length]
+                if length <= CATALOG_SUGGEST_SHORT_PREFIX:
+                    completions = self.ranked_completions.setdefault(prefix, [])
+                else:
+                    completions = self.ranked_completions.get(prefix)
+                    if completions is None:
+                        continue  # Not wide, or not asked for yet; ranked from the entries on first use
+                if len(completions) >= CATALOG_SUGGEST_MAX_LIMIT and rank >= completions[-1]:
+                    continue
+                if replace or start > 0:
+                    # The card may already be listed (an older rank, or another word matched)
+                    listed = next((i for i, other in enumerate(completions) if other[-1] == card_key), None)
+                    if listed is not None:
+                        if completions[listed] <= rank:
+                            continue
+                        del completions[listed]
+                bisect.insort(completions, rank)
+                del completions[CATALOG_SUGGEST_MAX_LIMIT:]
+
+    def _closest_keys(self, card_key: str) -> list[tuple[float, str]]:
+        """Catalog keys scoring at least CATALOG_MATCH_MIN_SIMILARITY, best first."""
+        grams = _trigrams(card_key)
+        shared = {}
+        for gram in grams:
+            for candidate in self.postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        scored = []
+        for candidate, count in shared.items():
+            # Shared postings count the trigram intersection, so Jaccard needs no set operations
+            score = count / (len(grams) + self.gram_counts[candidate] - count)
+            if score >= CATALOG_MATCH_MIN_SIMILARITY:
+                scored.append((score, candidate))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return scored
+
+    def _fuzzy_match_ok(self, card_key: str, candidate: str, score: float, set_code: str, number: str) -> bool:
+        """
+        A near miss may only fix misread words: "charizard ex" is another card than "charizard", and
+        "pikachu v" than "pikachu vmax". The names must have the same words up to typos, and then
+        score CATALOG_FUZZY_MIN_SIMILARITY or have a printing with the given set and number.
+        """
+        words, candidate_words = card_key.split(" "), candidate.split(" ")
+        if len(words) != len(candidate_words):
+            return False
+        if any(word != other and trigram_similarity(word, other) < CATALOG_MATCH_MIN_SIMILARITY
+               for word, other in zip(words, candidate_words)):
+            return False
+        if score >= CATALOG_FUZZY_MIN_SIMILARITY:
+            return True
+        return bool(set_code and number) and any(
+            p[1] == set_code and p[2] == number for p in self.printings[candidate]
+        )
+
+    def resolve(self, name: Optional[str], set_code: Optional[str] = None, number: Optional[str] = None) -> Optional[dict]:
+        """Returns {catalog_id (or None if the printing is ambiguous), card_key, name, set_code, score} or None."""
+        started = time.perf_counter()
+        card_key = normalize_card_key(name)
+        set_code = normalize_set_code(set_code)
+        number = str(number or "").strip()
+        with self._lock:
+            score = 1.0
+            if card_key and card_key not in self.printings:
+                card_key, score = next((
+                    (candidate, candidate_score) for candidate_score, candidate in self._closest_keys(card_key)
+                    if self._fuzzy_match_ok(card_key, candidate, candidate_score, set_code, number)
+                ), (None, 0.0))
+            if not card_key:
+                self.unresolved += 1
+                self.latency.record(time.perf_counter() - started, ok=False)
+                return None
+            if score == 1.0:
+                self.exact += 1
+            else:
+                self.fuzzy += 1
+            printings = self.printings[card_key]
+            if set_code:
+                printings = [p for p in printings if p[1] == set_code]
+                if number:
+                    printings = [p for p in printings if p[2] == number] or printings
+            chosen = printings[0] if len(printings) == 1 or (set_code and printings) else None
+            match = {
+                "catalog_id": chosen[0] if chosen else None,
+                "card_key": card_key,
+                "name": self.names[card_key],
+                "set_code": chosen[1] if chosen else None,
+                "score": round(score, 3)
+            }
+        self.latency.record(time.perf_counter() - started, ok=True)
+        return match
+
+    def suggest(self, query: Optional[str], limit: int = 10) -> list[dict]:
+        """Ranked completions for a partial name; any word of the name can match."""
+        started = time.perf_counter()
+        prefix = normalize_card_key(query)
+        limit = max(1, min(limit, CATALOG_SUGGEST_MAX_LIMIT))
+        if not prefix:
+            return []
+        with self._lock:
+            ranked = self.ranked_completions.get(prefix)
+            if ranked is None:
+                lo = bisect.bisect_left(self.prefix_entries, prefix)
+                hi = bisect.bisect_left(self.prefix_entries, prefix + "\uffff", lo)
+                best = {}
+                for entry in self.prefix_entries[lo:hi]:
+                    suffix, card_key = entry.split("\0")
+                    rank = self._suggest_rank(card_key, len(card_key) - len(suffix))
+                    if card_key not in best or rank < best[card_key]:
+                        best[card_key] = rank
+                ranked = heapq.nsmallest(CATALOG_SUGGEST_MAX_LIMIT, best.values())
+                if hi - lo > CATALOG_SUGGEST_SCAN_LIMIT:
+                    # Too wide to rank per request; add_cards keeps this list current from now on
+                    self.ranked_completions[prefix] = ranked
+                    self.ranked_max_length = max(self.ranked_max_length, len(prefix))
+            ranked = ranked[:limit]
+            suggestions = []
+            for rank in ranked:
+                card_key = rank[-1]
+                printings = self.printings[card_key]
+                suggestions.append({
+                    "name": self.names[card_key],
+                    "card_key": card_key,
+                    "catalog_id": printings[0][0] if len(printings) == 1 else None,
+                    "printings": len(printings),
+                    "set_codes": sorted({p[1] for p in printings if p[1]})[:5]
+                })
+        self.suggest_latency.record(time.perf_counter() - started, ok=True)
+        return suggestions
+
+    def stats(self) -> dict:
+        latency = self.latency.stats()
+        suggest_latency = self.suggest_latency.stats()
+        return {
+            "cards": sum(len(p) for p in self.printings.values()),
+            "names": len(self.printings),
+            "exact": self.exact,
+            "fuzzy": self.fuzzy,
+            "unresolved": self.unresolved,
+            "lookups": latency["calls"],
+            "p50_ms": latency["p50_ms"],
+            "p95_ms": latency["p95_ms"],
+            "p99_ms": latency["p99_ms"],
+            "suggest": {
+                "prefix_entries": len(self.prefix_entries),
+                "ranked_prefixes": len(self.ranked_completions),
+                "calls": suggest_latency["calls"],
+                "p50_ms": suggest_latency["p50_ms"],
+                "p95_ms": suggest_latency["p95_ms"],
+                "p99_ms": suggest_latency["p99_ms"]
+            }
+        }
+
+
+catalog_resolver = CatalogResolver()
+
+
+def refresh_catalog_resolver(db: Session) -> int:
+    """Add catalog rows created since the resolver's last refresh. Returns how many were added."""
+    rows = []
+    while True:
+        batch = db.query(
+            CatalogCard.id, CatalogCard.name, CatalogCard.card_key, CatalogCard.set_code, CatalogCard.number
+        ).filter(CatalogCard.id > (rows[-1][0] if rows else catalog_resolver.max_id)).order_by(CatalogCard.id).limit(CATALOG_LOAD_BATCH_SIZE).all()
+        if not batch:
+            break
+        rows.extend(batch)
+    if rows:
+        # One call, so the autocomplete index is merged once rather than once per batch
+        catalog_resolver.add_cards(rows)
+    return len(rows)
+
+
+def load_catalog_file(db: Session, path: str) -> dict:
+    """Upsert a catalog file (name, set_code, number, domain, year) in batches."""
+    timer = time.perf_counter()
+    catalog = CatalogCard.__table__
+    stmt = dialect_insert(catalog)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["card_key", "set_code", "number"],
+        set_={"name": stmt.excluded.name, "domain": stmt.excluded.domain, "year": stmt.excluded.year}
+    )
+    stats = {"rows": 0, "loaded": 0, "skipped": 0}
+    batch = []
+    for record in iter_feed_records(path):
+        stats["rows"] += 1
+        name = (record.get("name") or record.get("card_name") or "").strip()
+        card_key = normalize_card_key(name)
+        if not card_key:
+            stats["skipped"] += 1
+            continue
+        try:
+            year = int(record["year"]) if record.get("year") not in (None, "") else None
+        except (TypeError, ValueError):
+            year = None
+        batch.append({
+            "name": name,
+            "card_key": card_key,
+            "set_code": normalize_set_code(record.get("set_code") or record.get("set")),
+            "number": str(record.get("number") or record.get("card_number") or "").strip(),
+            "domain": record.get("domain") or None,
+            "year": year
+        })
+        if len(batch) >= CATALOG_LOAD_BATCH_SIZE:
+            db.execute(stmt, batch)
+            stats["loaded"] += len(batch)
+            batch = []
+    if batch:
+        db.execute(stmt, batch)
+        stats["loaded"] += len(batch)
+    db.commit()
+    stats["seconds"] = round(time.perf_counter() - timer, 3)
+    return stats
+
+
+def backfill_catalog_ids(db: Session) -> dict:
+    """Resolve holdings and wants saved before (or without) a catalog match."""
+    stats = {"holdings": 0, "wants": 0}
+    last_id = ""
+    while True:
+        entries = db.query(InventoryEntry).filter(
+            InventoryEntry.catalog_id.is_(None), InventoryEntry.id > last_id
+        ).order_by(InventoryEntry.id).limit(CATALOG_LOAD_BATCH_SIZE).all()
+        if not entries:
+            break
+        resolved_ids = []
+        for entry in entries:
+            match = catalog_resolver.resolve(entry.card_name, entry.set_code)
+            # Only the ID is filled in; renaming could collide with another holding's key
+            if match and match["catalog_id"]:
+                entry.catalog_id = match["catalog_id"]
+                resolved_ids.append(entry.id)
+                stats["holdings"] += 1
+        last_id = entries[-1].id
+        db.flush()
+        sync_marketplace_matches(db, entry_ids=resolved_ids)
+        db.commit()
+    resolved_ids = []
+    for want in db.query(Want).filter(Want.catalog_id.is_(None)):
+        match = catalog_resolver.resolve(want.card_name, want.set_code)
+        if match and (match["catalog_id"] or want.card_key != match["card_key"]):
+            want.card_key = match["card_key"]
+            want.catalog_id = match["catalog_id"]
+            resolved_ids.append(want.id)
+            stats["wants"] += 1
+    db.flush()
+    for chunk in _chunks(resolved_ids, CATALOG_LOAD_BATCH_SIZE):
+        sync_marketplace_matches(db, want_ids=chunk)
+    db.commit()
+    return stats
+
+
+def _refresh_catalog_resolver() -> int:
+    db = SessionLocal()
+    try:
+        return refresh_catalog_resolver(db)
+    finally:
+        db.close()
+
+
+async def catalog_refresh_loop():
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_INTERVAL_SECONDS)
+        try:
+            added = await asyncio.to_thread(_refresh_catalog_resolver)
+            if added:
+                print(f"Catalog resolver picked up {added} new card(s)")
+        except Exception as e:
+            print(f"Error refreshing catalog resolver: {e}")
+
+
+@app.on_event("startup")
+async def start_catalog_resolver():
+    added = await asyncio.to_thread(_refresh_catalog_resolver)
+    if added:
+        print(f"Catalog resolver loaded {added} card(s)")
+    if CATALOG_REFRESH_INTERVAL_SECONDS > 0:
+        catalog_refresh_tasks.append(asyncio.create_task(catalog_refresh_loop()))
+
+
+@app.on_event("shutdown")
+async def stop_catalog_resolver():
+    for task in catalog_refresh_tasks:
+        task.cancel()
+    await asyncio.gather(*catalog_refresh_tasks, return_exceptions=True)
+    catalog_refresh_tasks.clear()
+
+
+# Marketplace match index
+# A want matches another user's holding by catalog_id when the want resolved to one printing,
+# otherwise by card_key (plus set_code if the want names one); wants the catalog couldn't resolve
+# fall back to the holding's name containing the wanted name. Only holdings of users with
+# marketplace_enabled match. Each change re-evaluates just the wants/holdings it touched, and
+# rescores their matches; a match's score depends only on its want and holding, so listings read
+# stored scores.
+def marketplace_match_selects(*filters, detail: bool = False) -> list:
+    """One SELECT per way of matching (each can use its own index), restricted by filters."""
+    columns = [
+        Want.id.label("want_id"), InventoryEntry.id.label("entry_id"),
+        Want.user_id.label("user_id"), InventoryEntry.user_id.label("owner_id")
+    ]
+    if detail:
+        columns += [
+            Want.card_name.label("wanted_name"), InventoryEntry.card_name.label("have_name"),
+            InventoryEntry.set_code.label("have_set_code"), User.username.label("owner_username")
+        ]
+    set_matches = or_(Want.set_code.is_(None), Want.set_code == "", InventoryEntry.set_code == Want.set_code)
+    ways = [
+        (InventoryEntry.catalog_id == Want.catalog_id, [Want.catalog_id.isnot(None)]),
+        (InventoryEntry.card_key == Want.card_key, [Want.catalog_id.is_(None), Want.card_key.isnot(None), set_matches]),
+        (
+            InventoryEntry.card_name.ilike(literal("%") + Want.card_name + literal("%")),
+            [Want.card_key.is_(None), set_matches]  # Unresolved wants never have a catalog_id
+        ),
+    ]
+    return [
+        select(*columns).select_from(Want).join(InventoryEntry, on).join(User, User.id == InventoryEntry.user_id).where(
+            User.marketplace_enabled == True,  # noqa: E712
+            InventoryEntry.user_id != Want.user_id,
+            *conditions,
+            *filters
+        )
+        for on, conditions in ways
+    ]
+
+
+def sync_marketplace_matches(
+    db: Session,
+    entry_ids: Optional[list] = None,
+    want_ids: Optional[list] = None,
+    owner_id: Optional[str] = None,
+    notify: bool = True
+) -> dict:
+    """
+    Bring the match index up to date for the given holdings, wants or owner, in the caller's
+    transaction. New matches notify the user who wants the card (up to
+    MARKETPLACE_MATCH_NOTIFY_LIMIT per user per call).
+    """
+    candidate_filters, stored_filters = [], []
+    if entry_ids is not None:
+        candidate_filters.append(InventoryEntry.id.in_(entry_ids))
+        stored_filters.append(MarketplaceMatch.entry_id.in_(entry_ids))
+    if want_ids is not None:
+        candidate_filters.append(Want.id.in_(want_ids))
+        stored_filters.append(MarketplaceMatch.want_id.in_(want_ids))
+    if owner_id is not None:
+        candidate_filters.append(InventoryEntry.user_id == owner_id)
+        stored_filters.append(MarketplaceMatch.owner_id == owner_id)
+    if not candidate_filters or entry_ids == [] or want_ids == []:
+        return {"added": 0, "removed": 0}
+
+    expected = {}
+    for stmt in marketplace_match_selects(*candidate_filters, detail=notify):
+        for row in db.execute(stmt):
+            expected[(row.want_id, row.entry_id)] = row
+    stored = set(db.query(MarketplaceMatch.want_id, MarketplaceMatch.entry_id).filter(*stored_filters).all())
+
+    stale = [pair for pair in stored if pair not in expected]
+    for chunk in _chunks(stale, 500):
+        db.query(MarketplaceMatch).filter(
+            tuple_(MarketplaceMatch.want_id, MarketplaceMatch.entry_id).in_(chunk)
+        ).delete(synchronize_session=False)
+
+    missing = [row for pair, row in expected.items() if pair not in stored]
+    if missing:
+        now = datetime.utcnow()
+        stmt = dialect_insert(MarketplaceMatch.__table__).on_conflict_do_nothing(index_elements=["want_id", "entry_id"])
+        db.execute(stmt, [{
+            "want_id": row.want_id, "entry_id": row.entry_id, "user_id": row.user_id,
+            "owner_id": row.owner_id, "created_at": now
+        } for row in missing])
+    if notify:
+        notified = {}
+        for row in missing:
+            notified[row.user_id] = notified.get(row.user_id, 0) + 1
+            if notified[row.user_id] > MARKETPLACE_MATCH_NOTIFY_LIMIT:
+                continue
+            add_notification(
+                db, row.user_id, "marketplace_match", "Marketplace match found",
+                f"You want '{row.wanted_name}' and {row.owner_username} has '{row.have_name}' ({row.have_set_code})."
+            )
+    # New matches, and existing ones whose holding or want the caller changed
+    rescore_marketplace_matches(db, *stored_filters)
+    return {"added": len(missing), "removed": len(stale)}
+
+
+def remove_marketplace_matches(db: Session, entry_ids: Optional[list] = None, want_ids: Optional[list] = None, owner_id: Optional[str] = None):
+    """Drop matches of deleted holdings or wants, or of an owner who left the marketplace (caller's transaction)."""
+    query = db.query(MarketplaceMatch)
+    if entry_ids is not None:
+        query = query.filter(MarketplaceMatch.entry_id.in_(entry_ids))
+    if want_ids is not None:
+        query = query.filter(MarketplaceMatch.want_id.in_(want_ids))
+    if owner_id is not None:
+        query = query.filter(MarketplaceMatch.owner_id == owner_id)
+    query.delete(synchronize_session=False)
+
+
+def rebuild_marketplace_matches(db: Session) -> dict:
+    """Recompute the whole index from wants and holdings (set-based; no notifications)."""
+    timer = time.perf_counter()
+    matches = MarketplaceMatch.__table__
+    db.execute(matches.delete())
+    now = datetime.utcnow()
+    for stmt in marketplace_match_selects():
+        db.execute(insert(matches).from_select(
+            ["want_id", "entry_id", "user_id", "owner_id", "created_at"],
+            stmt.add_columns(literal(now, DateTime))
+        ))
+    rescore_marketplace_matches(db)
+    db.commit()
+    return {"matches": db.query(func.count(MarketplaceMatch.id)).scalar(), "seconds": round(time.perf_counter() - timer, 2)}
+
+
+def check_marketplace_matches(db: Session) -> dict:
+    """Compare the index with a full recomputation: matches missing from it, and stale ones it still holds."""
+    first, *rest = marketplace_match_selects()
+    candidates = first.union(*rest).subquery()
+    expected = select(candidates.c.want_id, candidates.c.entry_id)
+    stored = select(MarketplaceMatch.want_id, MarketplaceMatch.entry_id)
+    missing = db.execute(select(func.count()).select_from(expected.except_(stored).subquery())).scalar()
+    stale = db.execute(select(func.count()).select_from(stored.except_(expected).subquery())).scalar()
+    return {"missing": missing, "stale": stale, "consistent": not (missing or stale)}
+
+
+def _name_similarity(a: str, b: str) -> float:
+    a_words, b_words = set(a.split()), set(b.split())
+    return len(a_words & b_words) / len(a_words | b_words) if a_words and b_words else 0.0
+
+
+def score_marketplace_candidates(candidates: dict, per_want: int = MARKETPLACE_MATCHES_PER_WANT) -> tuple:
+    """
+    Score every candidate (want, holding) pair at once and keep the best per_want for each want.
+    candidates holds equal-length arrays: want (int code per want), want_catalog_id / catalog_id
+    (0 if none), want_set_code / set_code, want_key / card_key, condition_rank, min_condition_rank
+    (-1 if none), value and max_price (NaN if none; holdings saved without a price have value 0, so
+    values <= 0 count as unpriced too).
+    Returns (indices of the kept candidates, scores 0-100 for every candidate).
+    """
+    weights = MARKETPLACE_SCORE_WEIGHTS
+    exact_card = (candidates["want_catalog_id"] > 0) & (candidates["want_catalog_id"] == candidates["catalog_id"])
+    set_match = (candidates["want_set_code"] != "") & (candidates["want_set_code"] == candidates["set_code"])
+
+    # Most candidates matched on the same card_key; only the distinct other name pairs are compared
+    name_similarity = np.ones(len(exact_card))
+    differs = np.flatnonzero(candidates["want_key"] != candidates["card_key"])
+    if len(differs):
+        pairs = np.char.add(np.char.add(candidates["want_key"][differs], "|"), candidates["card_key"][differs])  # Keys have no "|"
+        distinct, pair_index = np.unique(pairs, return_inverse=True)
+        name_similarity[differs] = np.array([_name_similarity(*pair.split("|")) for pair in distinct])[pair_index]
+
+    condition = np.clip(candidates["condition_rank"], 0, None) / (len(CARD_CONDITIONS) - 1)
+    value, max_price = candidates["value"], candidates["max_price"]
+    priced = value > 0  # False for NaN
+    has_budget = (max_price > 0) & priced
+    price = np.zeros(len(value))
+    np.divide(max_price - value, max_price, out=price, where=has_budget)
+
+    scores = 100 * (
+        weights["card"] * exact_card +
+        weights["set"] * set_match +
+        weights["name"] * name_similarity +
+        weights["condition"] * condition +
+        weights["price"] * np.clip(price, 0, 1)
+    ) / sum(weights.values())
+
+    # Wants' limits: holdings in worse condition or over budget (when priced) don't qualify
+    eligible = (candidates["condition_rank"] >= candidates["min_condition_rank"]) & ~(priced & (value > max_price))
+
+    # Best first within each want, then the top per_want of each group
+    order = np.lexsort((-scores, candidates["want"]))
+    order = order[eligible[order]]
+    wants = candidates["want"][order]
+    group_start = np.flatnonzero(np.r_[True, wants[1:] != wants[:-1]])
+    rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+    return order[rank < per_want], scores
+
+
+def rescore_marketplace_matches(db: Session, *filters) -> int:
+    """
+    Score the indexed matches restricted by filters (all of them without) and store each one's
+    score and eligibility, in the caller's transaction and in batches. Returns the number scored.
+    """
+    ids = [match_id for match_id, in db.query(MarketplaceMatch.id).filter(*filters)]
+    for chunk in _chunks(ids, MARKETPLACE_RESCORE_BATCH_SIZE):
+        rows = db.query(
+            MarketplaceMatch.id, MarketplaceMatch.want_id, Want.card_name.label("wanted_name"),
+            Want.card_key.label("want_key"), Want.set_code.label("want_set_code"), Want.catalog_id.label("want_catalog_id"),
+            Want.min_condition, Want.max_price, InventoryEntry.card_name, InventoryEntry.card_key,
+            InventoryEntry.set_code, InventoryEntry.catalog_id, InventoryEntry.condition, InventoryEntry.current_value
+        ).join(
+            Want, Want.id == MarketplaceMatch.want_id
+        ).join(
+            InventoryEntry, InventoryEntry.id == MarketplaceMatch.entry_id
+        ).filter(MarketplaceMatch.id.in_(chunk)).all()
+        if not rows:
+            continue
+        want_codes = {}
+        # Keeping every candidate per want leaves just the eligible ones
+        eligible, scores = score_marketplace_candidates({
+            "want": np.array([want_codes.setdefault(row.want_id, len(want_codes)) for row in rows]),
+            "want_catalog_id": np.array([row.want_catalog_id or 0 for row in rows]),
+            "catalog_id": np.array([row.catalog_id or 0 for row in rows]),
+            "want_set_code": np.array([row.want_set_code or "" for row in rows], dtype=str),
+            "set_code": np.array([row.set_code or "" for row in rows], dtype=str),
+            "want_key": np.array([row.want_key or normalize_card_key(row.wanted_name) for row in rows], dtype=str),
+            "card_key": np.array([row.card_key or normalize_card_key(row.card_name) for row in rows], dtype=str),
+            "condition_rank": np.array([CONDITION_RANKS.get(row.condition, -1) for row in rows]),
+            "min_condition_rank": np.array([CONDITION_RANKS.get(row.min_condition, -1) for row in rows]),
+            "value": np.array([np.nan if row.current_value is None else row.current_value for row in rows], dtype=float),
+            "max_price": np.array([np.nan if row.max_price is None else row.max_price for row in rows], dtype=float),
+        }, per_want=len(rows))
+        is_eligible = np.zeros(len(rows), dtype=bool)
+        is_eligible[eligible] = True
+        db.bulk_update_mappings(MarketplaceMatch, [
+            {"id": row.id, "score": float(score), "eligible": bool(ok)}
+            for row, score, ok in zip(rows, scores.tolist(), is_eligible.tolist())
+        ])
+    return len(ids)
+
+
+def marketplace_match_rows(db: Session, user_id: str, *filters):
+    """The user's eligible matches (restricted by filters) with their want, holding and owner, best first."""
+    return db.query(
+        MarketplaceMatch.id.label("match_id"), MarketplaceMatch.score, Want.id.label("want_id"),
+        Want.card_name.label("wanted_name"), Want.set_code.label("want_set_code"), InventoryEntry.id.label("entry_id"),
+        InventoryEntry.card_name, InventoryEntry.set_code, InventoryEntry.condition, InventoryEntry.quantity,
+        InventoryEntry.current_value, User.id.label("owner_id"), User.username.label("owner_username")
+    ).join(
+        Want, Want.id == MarketplaceMatch.want_id
+    ).join(
+        InventoryEntry, InventoryEntry.id == MarketplaceMatch.entry_id
+    ).join(
+        User, User.id == MarketplaceMatch.owner_id
+    ).filter(
+        MarketplaceMatch.user_id == user_id, MarketplaceMatch.eligible == True, *filters  # noqa: E712
+    ).order_by(MarketplaceMatch.score.desc(), MarketplaceMatch.id.desc())
+
+
+def outranked_in_want(per_want: int):
+    """
+    Filter for matches with at least per_want better eligible matches (score, then newer id) for
+    the same want. Each check reads at most per_want entries of ix_marketplace_matches_want_score.
+    """
+    better = aliased(MarketplaceMatch)
+    return select(better.id).where(
+        better.want_id == MarketplaceMatch.want_id,
+        better.eligible == True,  # noqa: E712
+        tuple_(better.score, better.id) > tuple_(MarketplaceMatch.score, MarketplaceMatch.id)
+    ).offset(per_want - 1).limit(1).exists()
+
+
+def marketplace_have(row) -> dict:
+    return {
+        "inventory_entry_id": row.entry_id, "card_name": row.card_name, "set_code": row.set_code,
+        "condition": row.condition, "quantity": row.quantity, "current_value": row.current_value
+    }
 
-class InventoryEntry(Base):
-    __tablename__ = "inventory_entries"
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String, ForeignKey("users.id"))
-    card_name = Column(String)
-    set_code = Column(String)
-    quantity = Column(Integer, default=1)
-    condition = Column(String)
-    condition_grade = Column(Float, nullable=True)
-    current_value = Column(Float, nullable=True)
-    scan_image_url = Column(String, nullable=True)
-    card_image_url = Column(String, nullable=True)  # Cropped card image
-    metadata_json = Column(Text, nullable=True)  # JSON string for additional card data
-    scanned_at = Column(DateTime, default=datetime.utcnow)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    user = relationship("User", back_populates="inventory")
 
+def _subset_sums(values: np.ndarray) -> tuple:
+    """Total, size and member bitmask of each of the 2^n subsets of values."""
+    sums, sizes, masks = np.zeros(1), np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    for i, value in enumerate(values):
+        sums = np.concatenate([sums, sums + value])
+        sizes = np.concatenate([sizes, sizes + 1])
+        masks = np.concatenate([masks, masks | (1 << i)])
+    return sums, sizes, masks
 
-# Marketplace Wants
-class Want(Base):
-    __tablename__ = "wants"
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String, ForeignKey("users.id"))
-    card_name = Column(String, index=True)
-    set_code = Column(String, index=True, nullable=True)
-    min_condition = Column(String, nullable=True)
-    max_price = Column(Float, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
 
-# Notifications
-class Notification(Base):
-    __tablename__ = "notifications"
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String, ForeignKey("users.id"))
-    type = Column(String)  # "marketplace_match" | "trend"
-    title = Column(String)
-    message = Column(Text)
-    read = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+def _subsets_by_size(values: np.ndarray) -> dict:
+    """size -> (subset totals ascending, their bitmasks)"""
+    sums, sizes, masks = _subset_sums(values)
+    by_size = {}
+    for size in range(1, len(values) + 1):
+        members = np.flatnonzero(sizes == size)
+        members = members[np.argsort(sums[members], kind="stable")]
+        by_size[size] = (sums[members], masks[members])
+    return by_size
 
-# Create tables
-Base.metadata.create_all(bind=engine)
 
-def _ensure_sqlite_columns():
+def solve_balanced_trade(give_values, receive_values, tolerance: float = MARKETPLACE_TRADE_BALANCE_TOLERANCE, deadline: Optional[float] = None) -> dict:
     """
-    MVP convenience: if you're using an existing sqlite db, add newly introduced columns.
-    This avoids forcing a full migration framework for a 1-day MVP.
+    Pick a non-empty subset of each side whose totals are within tolerance of each other
+    (|give - receive| / max(give, receive)), maximizing 2 x cards traded - 100 x imbalance
+    (docs/marketplace-algorithm.md).
+
+    Meet in the middle: each side's subset totals are enumerated once and bucketed by size; for a
+    pair of sizes, every receive total finds its closest give total by binary search instead of
+    pairing subsets. Larger trades are tried first, and the search stops once no smaller trade can
+    outscore the best found (a trade of n cards scores at most 2n), or at the deadline (perf_counter).
+    Returns {"trade": {give, receive (index lists), imbalance, score} or None, "complete": bool}.
     """
-    if not SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-        return
-    conn = engine.raw_connection()
+    give_values, receive_values = np.asarray(give_values, dtype=float), np.asarray(receive_values, dtype=float)
+    if not len(give_values) or not len(receive_values):
+        return {"trade": None, "complete": True}
+    give_subsets, receive_subsets = _subsets_by_size(give_values), _subsets_by_size(receive_values)
+
+    best, complete = None, True
+    for cards in range(len(give_values) + len(receive_values), 1, -1):
+        if best and 2 * cards <= best["score"]:
+            break
+        if deadline is not None and time.perf_counter() > deadline:
+            complete = False
+            break
+        for give_size in range(max(1, cards - len(receive_values)), min(len(give_values), cards - 1) + 1):
+            give_sums, give_masks = give_subsets[give_size]
+            receive_sums, receive_masks = receive_subsets[cards - give_size]
+            # The closest give total to each receive total is one of its two neighbours in sorted order
+            above = np.clip(np.searchsorted(give_sums, receive_sums), 0, len(give_sums) - 1)
+            below = np.clip(above - 1, 0, len(give_sums) - 1)
+            gaps = []
+            for neighbour in (below, above):
+                totals = give_sums[neighbour]
+                gaps.append(np.abs(totals - receive_sums) / np.maximum(totals, receive_sums))
+            closest = np.where(gaps[0] <= gaps[1], below, above)
+            imbalance = np.minimum(gaps[0], gaps[1])
+            i = int(np.argmin(imbalance))
+            score = 2 * cards - 100 * float(imbalance[i])
+            if imbalance[i] <= tolerance and (best is None or score > best["score"]):
+                give_mask, receive_mask = int(give_masks[closest[i]]), int(receive_masks[i])
+                best = {
+                    "give": [j for j in range(len(give_values)) if give_mask >> j & 1],
+                    "receive": [j for j in range(len(receive_values)) if receive_mask >> j & 1],
+                    "imbalance": float(imbalance[i]),
+                    "score": score
+                }
+    return {"trade": best, "complete": complete}
+
+
+def tradeable_items(db: Session, wanted_by: str, owner_id: str) -> list:
+    """
+    owner_id's holdings that wanted_by wants and would accept (see marketplace_match_rows): the best
+    holding per want, each holding once, with a value to balance against; at most
+    MARKETPLACE_TRADE_MAX_ITEMS, best matches first.
+    """
+    items, seen_wants, seen = [], set(), set()
+    for row in marketplace_match_rows(db, wanted_by, MarketplaceMatch.owner_id == owner_id):
+        if row.want_id in seen_wants:
+            continue
+        seen_wants.add(row.want_id)
+        if row.entry_id in seen or not row.current_value or row.current_value <= 0:
+            continue
+        seen.add(row.entry_id)
+        items.append({"want_id": row.want_id, "score": round(row.score, 1), **marketplace_have(row)})
+    return items[:MARKETPLACE_TRADE_MAX_ITEMS]
+
+
+def ensure_marketplace_matches(db: Session):
+    """Databases from before the match index: build it once. Indexes from before stored scores: score them."""
+    if db.query(MarketplaceMatch.id).first() is None and db.query(Want.id).first() is not None:
+        result = rebuild_marketplace_matches(db)
+        print(f"Built marketplace match index: {result['matches']} match(es)")
+    elif db.query(MarketplaceMatch.id).filter(MarketplaceMatch.eligible.is_(None)).first() is not None:
+        scored = rescore_marketplace_matches(db, MarketplaceMatch.eligible.is_(None))
+        db.commit()
+        print(f"Scored {scored} marketplace match(es)")
+
+
+@app.on_event("startup")
+async def start_marketplace_matches():
+    db = SessionLocal()
     try:
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(users)")
-        cols = {row[1] for row in cur.fetchall()}
-        if "notification_in_app" not in cols:
-            cur.execute("ALTER TABLE users ADD COLUMN notification_in_app BOOLEAN DEFAULT 1")
-        if "city" not in cols:
-            cur.execute("ALTER TABLE users ADD COLUMN city VARCHAR")
-        if "state_province" not in cols:
-            cur.execute("ALTER TABLE users ADD COLUMN state_province VARCHAR")
-        if "country" not in cols:
-            cur.execute("ALTER TABLE users ADD COLUMN country VARCHAR")
-        if "subscription_tier" not in cols:
-            cur.execute("ALTER TABLE users ADD COLUMN subscription_tier VARCHAR DEFAULT 'free'")
-        
-        # Check inventory_entries columns
-        cur.execute("PRAGMA table_info(inventory_entries)")
-        inv_cols = {row[1] for row in cur.fetchall()}
-        if "card_image_url" not in inv_cols:
-            cur.execute("ALTER TABLE inventory_entries ADD COLUMN card_image_url VARCHAR")
-        if "metadata_json" not in inv_cols:
-            cur.execute("ALTER TABLE inventory_entries ADD COLUMN metadata_json TEXT")
-        
-        conn.commit()
+        ensure_marketplace_matches(db)
     finally:
-        conn.close()
+        db.close()
 
-_ensure_sqlite_columns()
 
 # Mount static files for serving images
 uploads_dir = Path("uploads")
@@ -541,6 +3817,7 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
 async def upload_scan(
     image: UploadFile = File(...),
     scan_type: str = Form(...),
+    bypass_cache: bool = Form(False),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -550,129 +3827,32 @@ async def upload_scan(
     print(f"Image filename: {image.filename}")
     print(f"Image content type: {image.content_type}")
     
-    # Save uploaded file
-    upload_dir = Path("uploads")
-    upload_dir.mkdir(exist_ok=True)
-    
-    file_path = upload_dir / f"{uuid.uuid4()}_{image.filename}"
-    print(f"Saving image to: {file_path}")
-    
-    with open(file_path, "wb") as f:
-        content = await image.read()
-        f.write(content)
-    
-    print(f"Image saved successfully. File size: {len(content)} bytes")
+    # Stream the upload to disk (content-addressed, so identical images are stored once)
+    file_path, image_sha256, size, mime_type = await ingest_upload(image)
+    print(f"Image stored at: {file_path}. File size: {size} bytes")
     
-    # Create scan record
+    # Create scan record and queue it for the worker pool in one transaction
     scan = Scan(
         user_id=current_user.id,
-        image_url=str(file_path),
+        image_url=file_path,
         scan_type=scan_type,
-        status="processing"
+        status="pending"
     )
     db.add(scan)
+    db.flush()
+    change_blob_refs(db, [blob_key(scan.image_url)], 1)
+    record_scans(db, current_user.id)
+    enqueue_scan_job(
+        scan, image.filename, mime_type, db,
+        image_sha256=image_sha256,
+        bypass_cache=bypass_cache
+    )
     db.commit()
     db.refresh(scan)
-    
-    print(f"Scan record created with ID: {scan.id}")
-    
-    # Call ML service (async)
-    try:
-        print(f"Calling ML service at: {ML_SERVICE_URL}/predict")
-        
-        async with httpx.AsyncClient() as client:
-            with open(file_path, "rb") as f:
-                files = {"image": (image.filename, f, image.content_type)}
-                
-                print(f"Sending request to ML service...")
-                response = await client.post(
-                    f"{ML_SERVICE_URL}/predict",
-                    files=files,
-                    data={"scan_type": scan_type},
-                    timeout=60.0
-                )
-                
-                print(f"ML service response status: {response.status_code}")
-                print(f"ML service response headers: {response.headers}")
-                
-                if response.status_code == 200:
-                    results = response.json()
-                    print(f"ML service results: {results}")
-                    detected_cards = results.get("detected_cards", [])
-
-                    if scan_type == "multi":
-                        raw_response = results.get("raw_response")
-                        parsed_cards = parse_multi_cards_from_raw_response(raw_response)
-                        if parsed_cards:
-                            detected_cards = parsed_cards
-                            results["detected_cards"] = parsed_cards
-                            results["total_cards"] = len(parsed_cards)
-
-                    detected_cards = attach_cropped_images_to_detected_cards(
-                        detected_cards,
-                        scan.image_url
-                    )
-                    results["detected_cards"] = detected_cards
-                    results["total_cards"] = len(detected_cards)
-
-                    print(f"Detected cards count: {len(detected_cards)}")
-                    
-                    # Store results as JSON
-                    scan.results = json.dumps(results)
-                    scan.status = "completed"
-                    print(f"Scan marked as completed")
-                    
-                    # Automatically save all detected cards to inventory
-                    if detected_cards:
-                        print(f"=== Auto-saving {len(detected_cards)} detected cards to inventory ===")
-                        try:
-                            saved_count, inventory_entries = save_detected_cards_to_inventory(
-                                detected_cards, scan, current_user, db
-                            )
-                            print(f"Successfully saved {saved_count} card(s) to inventory")
-                            for entry in inventory_entries:
-                                print(f"  - {entry.card_name} ({entry.set_code})")
-                        except Exception as e:
-                            print(f"Error auto-saving cards to inventory: {e}")
-                            import traceback
-                            print(traceback.format_exc())
-                            # Don't fail the scan if auto-save fails
-                else:
-                    print(f"ML service returned non-200 status: {response.status_code}")
-                    print(f"Response body: {response.text}")
-                    scan.status = "failed"
-                    scan.results = f"ML service error: {response.status_code} - {response.text}"
-                    
-    except httpx.ConnectError as e:
-        print(f"!!! CONNECTION ERROR to ML service !!!")
-        print(f"Error: {e}")
-        print(f"ML_SERVICE_URL is set to: {ML_SERVICE_URL}")
-        print(f"Make sure ML service container is running and accessible")
-        scan.status = "failed"
-        scan.results = f"Connection error: {str(e)}"
-        
-    except httpx.TimeoutException as e:
-        print(f"!!! TIMEOUT ERROR from ML service !!!")
-        print(f"Error: {e}")
-        scan.status = "failed"
-        scan.results = f"Timeout error: {str(e)}"
-        
-    except Exception as e:
-        print(f"!!! UNEXPECTED ERROR !!!")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error message: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        scan.status = "failed"
-        scan.results = str(e)
-    
-    db.commit()
-    
-    print(f"=== SCAN UPLOAD FINISHED ===")
-    print(f"Final status: {scan.status}")
-    print(f"Scan ID: {scan.id}")
-    print()
-    
+    notify_scan_workers()
+
+    print(f"Scan record created with ID: {scan.id} (queued)")
+
     return {
         "success": True,
         "data": {
@@ -683,6 +3863,56 @@ async def upload_scan(
         }
     }
 
+@app.post("/api/v1/scans/bulk-upload")
+async def bulk_upload_scans(
+    images: List[UploadFile] = File(...),
+    scan_type: str = Form(...),
+    bypass_cache: bool = Form(False),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Queue many scans at once (collection onboarding). All Scan rows are created in one transaction."""
+    if len(images) > BULK_UPLOAD_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_UPLOAD_MAX_IMAGES} images per bulk upload")
+
+    # Ingest every file first so one bad image rejects the whole batch before anything is queued
+    stored = [await ingest_upload(image) for image in images]
+
+    scans = []
+    for image, (file_path, image_sha256, size, mime_type) in zip(images, stored):
+        scan = Scan(
+            user_id=current_user.id,
+            image_url=file_path,
+            scan_type=scan_type,
+            status="pending"
+        )
+        db.add(scan)
+        scans.append((scan, image, image_sha256, mime_type))
+    db.flush()
+    record_scans(db, current_user.id, len(scans))
+    for scan, image, image_sha256, mime_type in scans:
+        change_blob_refs(db, [blob_key(scan.image_url)], 1)
+        enqueue_scan_job(
+            scan, image.filename, mime_type, db,
+            image_sha256=image_sha256,
+            bypass_cache=bypass_cache
+        )
+    db.commit()
+    notify_scan_workers()
+
+    print(f"Bulk upload queued {len(scans)} scan(s) for {current_user.username}")
+
+    return {
+        "success": True,
+        "data": {
+            "scans": [
+                {"scan_id": scan.id, "status": scan.status, "image_url": scan.image_url, "filename": image.filename}
+                for scan, image, _, _ in scans
+            ],
+            "total": len(scans)
+        }
+    }
+
 @app.get("/api/v1/scans/{scan_id}")
 async def get_scan(scan_id: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     scan = db.query(Scan).filter(Scan.id == scan_id, Scan.user_id == current_user.id).first()
@@ -697,6 +3927,9 @@ async def get_scan(scan_id: str, current_user: User = Depends(get_current_user),
             detected_cards = results.get("detected_cards", [])
         except:
             pass
+    for card in detected_cards:
+        if card.get("crop_image_url"):
+            card["crop_image_url"] = stored_image_url(card["crop_image_url"])
     
     return {
         "success": True,
@@ -704,49 +3937,185 @@ async def get_scan(scan_id: str, current_user: User = Depends(get_current_user),
             "scan_id": scan.id,
             "status": scan.status,
             "scan_type": scan.scan_type,
-            "image_url": scan.image_url,
+            "image_url": stored_image_url(scan.image_url),
             "detected_cards": detected_cards,
             "processed_at": scan.created_at.isoformat() if scan.status == "completed" else None
         }
     }
 
 # Inventory Endpoints
+@app.get("/api/v1/images/{key}/{name}")
+async def get_image_rendition(key: str, name: str, request: Request):
+    """Serve a card rendition. URLs are content-addressed, so responses are cacheable forever."""
+    size, _, ext = name.partition(".")
+    if (len(key) != 32 or any(c not in "0123456789abcdef" for c in key)
+            or size not in THUMBNAIL_SIZES or ext not in RENDITION_FORMATS):
+        raise HTTPException(status_code=404, detail="Image not found")
+    blob = f"renditions/{key}/{name}"
+    local_path = blob_store.local_path(blob)
+    if local_path is not None:
+        found = local_path.exists()
+    else:
+        found = await asyncio.to_thread(blob_store.exists, blob)  # A network round trip for S3
+    if not found:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    etag = f'"{key}-{size}-{ext}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    if local_path is not None:
+        return FileResponse(local_path, media_type=RENDITION_FORMATS[ext][1], headers=headers)
+    content = await asyncio.to_thread(blob_store.get_bytes, blob)
+    return Response(content=content, media_type=RENDITION_FORMATS[ext][1], headers=headers)
+
+# Inventory pagination
+# Keyset cursors: each page continues strictly after the last row of the previous one with a
+# row-value comparison, (sort value, id) < (?, ?), which SQLite answers with a range search on the
+# (user_id, sort value, id) composite indexes, so deep pages cost the same as the first. (The
+# equivalent OR form only uses the index for user_id and filters every row before the cursor.)
+def encode_inventory_cursor(sort_key: str, value, entry_id: str) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps({"s": sort_key, "v": value, "id": entry_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_inventory_cursor(cursor: str, sort_key: str) -> tuple:
+    """Return (value, id) from a cursor token; raises a 400 for garbage or a token from another sort."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload["s"] != sort_key or not isinstance(payload["id"], str):
+            raise ValueError("cursor belongs to another sort")
+        value = payload["v"]
+        if sort_key == "date":
+            value = datetime.fromisoformat(value)
+        elif sort_key == "relevance":
+            value = int(value)  # Offset into the ranked results
+        elif sort_key == "score":
+            return float(value), int(payload["id"])  # Marketplace matches: (match score, match id)
+        elif value is not None:
+            value = float(value)
+        return value, payload["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def apply_inventory_keyset(query, sort_key: str, cursor: Optional[str]) -> tuple:
+    """
+    Order the query for sort_key ("date", "value_asc" or "value_desc") and continue after the cursor.
+    Returns (query, null_tail). Value sorts keep entries without a value last in both directions; after
+    a cursor with a value, query covers only the valued rows and null_tail (ordered by id) continues
+    into the rest once they run out. Otherwise null_tail is None.
+    """
+    if sort_key == "date":
+        query = query.order_by(InventoryEntry.scanned_at.desc(), InventoryEntry.id.desc())
+        if cursor:
+            scanned_at, entry_id = decode_inventory_cursor(cursor, sort_key)
+            query = query.filter(tuple_(InventoryEntry.scanned_at, InventoryEntry.id) < tuple_(scanned_at, entry_id))
+        return query, None
+
+    value_col = InventoryEntry.current_value
+    ascending = sort_key == "value_asc"
+    id_order = InventoryEntry.id.asc() if ascending else InventoryEntry.id.desc()
+    null_tail = query.filter(value_col.is_(None)).order_by(id_order)
+    if not cursor:
+        value_order = value_col.asc() if ascending else value_col.desc()
+        return query.order_by(value_order.nullslast(), id_order), None
+
+    value, entry_id = decode_inventory_cursor(cursor, sort_key)
+    if value is None:
+        id_after = InventoryEntry.id > entry_id if ascending else InventoryEntry.id < entry_id
+        return null_tail.filter(id_after), None
+    if ascending:
+        query = query.filter(tuple_(value_col, InventoryEntry.id) > tuple_(value, entry_id)).order_by(value_col.asc(), id_order)
+    else:
+        query = query.filter(tuple_(value_col, InventoryEntry.id) < tuple_(value, entry_id)).order_by(value_col.desc(), id_order)
+    return query, null_tail
+
+
+def inventory_cursor_for(entry: "InventoryEntry", sort_key: str) -> str:
+    value = entry.scanned_at if sort_key == "date" else entry.current_value
+    return encode_inventory_cursor(sort_key, value, entry.id)
+
+
+def count_inventory(query, user_id: str, search: Optional[str]) -> int:
+    """Row count for a user's inventory/search, cached for INVENTORY_COUNT_TTL_SECONDS (so approximate)."""
+    key = (user_id, search or "")
+    total = inventory_count_cache.get(key)
+    if total is None:
+        total = query.order_by(None).count()
+        inventory_count_cache.set(key, total)
+    return total
+
+
+def invalidate_inventory_count(user_id: str):
+    inventory_count_cache.delete((user_id, ""))
+
+
 @app.get("/api/v1/inventory")
 async def get_inventory(
-    page: int = 1,
     limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    page: Optional[int] = None,
     search: Optional[str] = None,
     sort_by: Optional[str] = None,
     sort_order: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    """
+    List the user's inventory a page at a time (at most INVENTORY_MAX_PAGE_SIZE items).
+    Pass pagination.next_cursor back as `cursor` for the next page. `page` (OFFSET paging) is
+    still accepted for older clients, but gets slower the deeper it goes.
+    With a search term, sort_by=relevance ranks prefix, substring and near (typo) matches.
+    """
+    limit_value = min(limit if limit and limit > 0 else INVENTORY_DEFAULT_PAGE_SIZE, INVENTORY_MAX_PAGE_SIZE)
     query = db.query(InventoryEntry).filter(InventoryEntry.user_id == current_user.id)
     
     if search:
-        query = query.filter(
-            (InventoryEntry.card_name.contains(search)) |
-            (InventoryEntry.set_code.contains(search))
-        )
+        query = inventory_search_filter(query, search)
+    filtered_query = query
     
-    if sort_by == "value":
-        if sort_order == "asc":
-            query = query.order_by(InventoryEntry.current_value.asc().nullslast())
-        else:
-            query = query.order_by(InventoryEntry.current_value.desc().nullslast())
+    # One extra row tells whether another page exists without counting
+    if sort_by == "relevance" and search:
+        # Ranked results aren't keyset-ordered; their cursor is an offset (ranked lists are read shallowly)
+        sort_key = "relevance"
+        offset = decode_inventory_cursor(cursor, sort_key)[0] if cursor else 0
+        rows = search_inventory_ranked(db, current_user.id, search, limit_value + 1, offset)
     else:
-        query = query.order_by(InventoryEntry.scanned_at.desc())
-
-    total = query.count()
-    if limit is None or limit <= 0:
-        items = query.all()
-        limit_value = total
-        total_pages = 1 if total else 0
-    else:
-        items = query.offset((page - 1) * limit).limit(limit).all()
-        limit_value = limit
-        total_pages = (total + limit - 1) // limit
+        if sort_by == "value":
+            sort_key = "value_asc" if sort_order == "asc" else "value_desc"
+        else:
+            sort_key = "date"
+        query, null_tail = apply_inventory_keyset(query, sort_key, cursor)
+        if page and page > 1 and not cursor:
+            query = query.offset((page - 1) * limit_value)
+        rows = query.limit(limit_value + 1).all()
+        if null_tail is not None and len(rows) <= limit_value:
+            rows += null_tail.limit(limit_value + 1 - len(rows)).all()
+    items = rows[:limit_value]
+    has_more = len(rows) > limit_value
+    total = count_inventory(filtered_query, current_user.id, search) if include_total or page else None
     
+    # Lazily backfill renditions for entries saved before thumbnails existed, a few per request
+    missing = [
+        item for item in items
+        if not item.thumbnail_key and (item.card_image_url or item.scan_image_url)
+    ][:THUMBNAIL_BACKFILL_PER_REQUEST]
+    if missing:
+        loop = asyncio.get_running_loop()
+        keys = await asyncio.gather(*[
+            loop.run_in_executor(crop_executor, create_renditions_from_file, item.card_image_url or item.scan_image_url)
+            for item in missing
+        ])
+        for item, key in zip(missing, keys):
+            item.thumbnail_key = key
+            change_blob_refs(db, [rendition_blob_key(key)], 1)
+        db.commit()
+
     # Parse metadata for each item
     items_data = []
     for item in items:
@@ -758,24 +4127,7 @@ async def get_inventory(
                 pass
         
         # Use cropped card image if available, otherwise fall back to scan image
-        image_url = item.card_image_url or item.scan_image_url or ""
-        # Convert relative path to URL path
-        if image_url and not image_url.startswith("http"):
-            try:
-                uploads_path = Path("uploads").resolve()
-                image_path = Path(image_url).resolve()
-                # Check if the image path is within uploads directory
-                if str(image_path).startswith(str(uploads_path)):
-                    rel_path = str(image_path.relative_to(uploads_path))
-                    # Convert Windows path separators to forward slashes
-                    rel_path = rel_path.replace("\\", "/")
-                    image_url = f"/uploads/{rel_path}"
-                else:
-                    # Just use the filename if path is not relative to uploads
-                    image_url = f"/uploads/{Path(image_url).name}" if Path(image_url).name else image_url
-            except Exception:
-                # Fallback: use filename
-                image_url = f"/uploads/{Path(image_url).name}" if Path(image_url).name else image_url
+        image_url = stored_image_url(item.card_image_url or item.scan_image_url or "")
         
         items_data.append({
             "id": item.id,
@@ -787,7 +4139,9 @@ async def get_inventory(
                     "name": item.set_code or "Unknown Set",
                     "code": item.set_code or ""
                 },
-                "image_url": image_url
+                "image_url": image_url,
+                "thumbnail_url": f"/api/v1/images/{item.thumbnail_key}/small.webp" if item.thumbnail_key else None,
+                "thumbnails": rendition_urls(item.thumbnail_key)
             },
             "quantity": item.quantity,
             "condition": item.condition,
@@ -801,16 +4155,24 @@ async def get_inventory(
             "metadata_json": item.metadata_json  # Include parsed metadata
         })
     
+    pagination = {
+        "limit": limit_value,
+        "next_cursor": (
+            encode_inventory_cursor(sort_key, offset + limit_value, "") if sort_key == "relevance"
+            else inventory_cursor_for(items[-1], sort_key)
+        ) if has_more else None,
+        "has_more": has_more,
+        "total": total  # Only with include_total (or page); cached briefly
+    }
+    if page:
+        pagination["page"] = page
+        pagination["total_pages"] = (total + limit_value - 1) // limit_value
+
     return {
         "success": True,
         "data": {
             "items": items_data,
-            "pagination": {
-                "page": page,
-                "limit": limit_value,
-                "total": total,
-                "total_pages": total_pages
-            }
+            "pagination": pagination
         }
     }
 
@@ -827,8 +4189,20 @@ async def delete_inventory_entry(
     if not entry:
         raise HTTPException(status_code=404, detail="Inventory entry not found")
 
+    # Images are deleted by the blob GC once nothing references them
+    copies = db.query(InventoryCopy).filter(InventoryCopy.entry_id == entry.id).all()
+    change_blob_refs(db, inventory_blob_keys(entry) + [key for c in copies for key in copy_blob_keys(c)], -1)
+    db.query(InventoryCopy).filter(InventoryCopy.entry_id == entry.id).delete(synchronize_session=False)
+    db.query(HoldingValuePoint).filter(HoldingValuePoint.entry_id == entry.id).delete(synchronize_session=False)
+    remove_marketplace_matches(db, entry_ids=[entry.id])
+    change_user_summary(
+        db, current_user.id,
+        cards=-(entry.quantity or 0),
+        value=-(entry.current_value or 0) * (entry.quantity or 0)
+    )
     db.delete(entry)
     db.commit()
+    invalidate_inventory_count(current_user.id)
     return {"success": True}
 
 @app.post("/api/v1/scans/{scan_id}/save")
@@ -848,7 +4222,7 @@ async def save_scan_to_inventory(
     
     # Check subscription limits
     tier_info = SUBSCRIPTION_TIERS.get(current_user.subscription_tier, SUBSCRIPTION_TIERS["free"])
-    current_card_count = db.query(InventoryEntry).filter(InventoryEntry.user_id == current_user.id).count()
+    current_card_count = count_user_cards(db, current_user.id)
     
     if current_card_count + len(card_ids) > tier_info["max_cards"]:
         raise HTTPException(
@@ -889,6 +4263,7 @@ async def list_wants(current_user: User = Depends(get_current_user), db: Session
             "id": w.id,
             "card_name": w.card_name,
             "set_code": w.set_code,
+            "catalog_id": w.catalog_id,
             "min_condition": w.min_condition,
             "max_price": w.max_price,
             "created_at": w.created_at.isoformat()
@@ -897,77 +4272,155 @@ async def list_wants(current_user: User = Depends(get_current_user), db: Session
 
 @app.post("/api/v1/marketplace/wants")
 async def create_want(want: WantCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    min_condition = normalize_condition(want.min_condition) if want.min_condition else None
+    if want.min_condition and not min_condition:
+        raise HTTPException(status_code=400, detail=f"Unknown condition; use one of: {', '.join(CARD_CONDITIONS)}")
+    if want.max_price is not None and want.max_price < 0:
+        raise HTTPException(status_code=400, detail="max_price can't be negative")
+    match = catalog_resolver.resolve(want.card_name, want.set_code)
     w = Want(
         user_id=current_user.id,
         card_name=want.card_name.strip(),
         set_code=want.set_code.strip().upper() if want.set_code else None,
-        min_condition=want.min_condition,
+        card_key=match["card_key"] if match else None,
+        catalog_id=match["catalog_id"] if match else None,
+        min_condition=min_condition,
         max_price=want.max_price
     )
     db.add(w)
+    db.flush()
+    sync_marketplace_matches(db, want_ids=[w.id])
     db.commit()
     db.refresh(w)
-    return {"success": True, "data": {"id": w.id}}
+    return {"success": True, "data": {"id": w.id, "catalog_id": w.catalog_id}}
 
 @app.delete("/api/v1/marketplace/wants/{want_id}")
 async def delete_want(want_id: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     w = db.query(Want).filter(Want.id == want_id, Want.user_id == current_user.id).first()
     if not w:
         raise HTTPException(status_code=404, detail="Want not found")
+    remove_marketplace_matches(db, want_ids=[w.id])
     db.delete(w)
     db.commit()
     return {"success": True}
 
 @app.get("/api/v1/marketplace/matches")
-async def get_matches(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """
-    For each want, find other users (marketplace_enabled = true) whose inventory contains matching cards.
-    Matching heuristic (MVP):
-    - exact card_name match (case-insensitive contains)
-    - optional set_code match if provided
-    """
-    wants = db.query(Want).filter(Want.user_id == current_user.id).all()
-    matches = []
-
-    for w in wants:
-        q = db.query(InventoryEntry, User).join(User, InventoryEntry.user_id == User.id)
-        q = q.filter(User.id != current_user.id)
-        q = q.filter(User.marketplace_enabled == True)  # noqa: E712
-        q = q.filter(InventoryEntry.card_name.ilike(f"%{w.card_name}%"))
-        if w.set_code:
-            q = q.filter(InventoryEntry.set_code == w.set_code)
-
-        # limit matches per want
-        rows = q.limit(10).all()
-        for inv, owner in rows:
-            matches.append({
-                "want_id": w.id,
-                "wanted": {"card_name": w.card_name, "set_code": w.set_code},
-                "owner": {"user_id": owner.id, "username": owner.username},
-                "have": {"inventory_entry_id": inv.id, "card_name": inv.card_name, "set_code": inv.set_code, "condition": inv.condition, "quantity": inv.quantity},
-            })
-
-    # Create simple notifications for new matches (MVP: always notify on fetch, but dedupe by message text per day)
-    today = datetime.utcnow().date().isoformat()
-    for m in matches[:20]:
-        title = "Marketplace match found"
-        msg = f"You want '{m['wanted']['card_name']}' and {m['owner']['username']} has '{m['have']['card_name']}' ({m['have']['set_code']})."
-        existing = db.query(Notification).filter(
-            Notification.user_id == current_user.id,
-            Notification.type == "marketplace_match",
-            Notification.title == title,
-            Notification.message == msg
-        ).first()
-        if not existing:
-            db.add(Notification(
-                user_id=current_user.id,
-                type="marketplace_match",
-                title=title,
-                message=msg,
-            ))
-    db.commit()
+async def get_matches(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    want_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Other users' holdings that match the user's wants, best first: the top
+    MARKETPLACE_MATCHES_PER_WANT per want by match score, leaving out holdings below the want's
+    min_condition or above its max_price. Matches and their scores come from the match index (see
+    sync_marketplace_matches and score_marketplace_candidates), paged on (score, id) in SQL.
+    Pass pagination.next_cursor back as `cursor` for the next page.
+    """
+    limit_value = min(limit if limit and limit > 0 else MARKETPLACE_MATCHES_DEFAULT_PAGE_SIZE, MARKETPLACE_MATCHES_MAX_PAGE_SIZE)
+    filters = [~outranked_in_want(MARKETPLACE_MATCHES_PER_WANT)]
+    if want_id:
+        filters.append(MarketplaceMatch.want_id == want_id)
+    if cursor:
+        # Across wants: best score first, newest match first among equals
+        after_score, after_id = decode_inventory_cursor(cursor, "score")
+        filters.append(tuple_(MarketplaceMatch.score, MarketplaceMatch.id) < tuple_(after_score, after_id))
+    rows = marketplace_match_rows(db, current_user.id, *filters).limit(limit_value + 1).all()
+
+    has_more = len(rows) > limit_value
+    page = rows[:limit_value]
+    items = [{
+        "want_id": row.want_id,
+        "wanted": {"card_name": row.wanted_name, "set_code": row.want_set_code},
+        "owner": {"user_id": row.owner_id, "username": row.owner_username},
+        "have": marketplace_have(row),
+        "score": round(row.score, 1),
+    } for row in page]
+    next_cursor = encode_inventory_cursor("score", page[-1].score, str(page[-1].match_id)) if has_more else None
+
+    return {
+        "success": True,
+        "data": {
+            "items": items,
+            "pagination": {
+                "limit": limit_value,
+                "next_cursor": next_cursor,
+                "has_more": has_more
+            }
+        }
+    }
+
+@app.get("/api/v1/marketplace/trades/suggest")
+async def suggest_trades(
+    with_user_id: Optional[str] = None,
+    tolerance: float = MARKETPLACE_TRADE_BALANCE_TOLERANCE,
+    limit: int = 20,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Value-balanced trades with another collector (with_user_id), or with the
+    MARKETPLACE_TRADE_PARTNERS users who share the most matches with the user both ways.
+    Each trade covers wants on both sides: the user gives holdings the partner wants and
+    receives holdings the user wants, with totals within `tolerance` (see solve_balanced_trade).
+    The whole request gets MARKETPLACE_TRADE_TIME_BUDGET_SECONDS; `complete` is false when the
+    budget cut a search short.
+    """
+    if not current_user.marketplace_enabled:
+        raise HTTPException(status_code=400, detail="Enable the marketplace in settings to trade")
+    tolerance = min(max(tolerance, 0.0), 1.0)
+    deadline = time.perf_counter() + MARKETPLACE_TRADE_TIME_BUDGET_SECONDS
+
+    if with_user_id:
+        partner = db.query(User).filter(User.id == with_user_id, User.marketplace_enabled == True).first()  # noqa: E712
+        if not partner or partner.id == current_user.id:
+            raise HTTPException(status_code=404, detail="User not found")
+        partner_ids = [partner.id]
+    else:
+        # Partners who have something the user wants and want something the user has
+        wants_from_user = {row.user_id for row in db.query(MarketplaceMatch.user_id).filter(
+            MarketplaceMatch.owner_id == current_user.id
+        ).distinct()}
+        partner_ids = [
+            owner_id for owner_id, _ in db.query(MarketplaceMatch.owner_id, func.count(MarketplaceMatch.id)).filter(
+                MarketplaceMatch.user_id == current_user.id
+            ).group_by(MarketplaceMatch.owner_id).order_by(func.count(MarketplaceMatch.id).desc()).all()
+            if owner_id in wants_from_user
+        ][:MARKETPLACE_TRADE_PARTNERS]
+
+    suggestions, complete = [], True
+    for partner_id in partner_ids:
+        if time.perf_counter() > deadline:
+            complete = False
+            break
+        give = tradeable_items(db, partner_id, current_user.id)
+        receive = tradeable_items(db, current_user.id, partner_id)
+        # CPU-bound (2^n subsets per side); keep it off the event loop
+        result = await asyncio.to_thread(
+            solve_balanced_trade,
+            [item["current_value"] for item in give], [item["current_value"] for item in receive], tolerance, deadline
+        )
+        complete = complete and result["complete"]
+        trade = result["trade"]
+        if not trade:
+            continue
+        partner = db.get(User, partner_id)
+        give_items = [give[i] for i in trade["give"]]
+        receive_items = [receive[i] for i in trade["receive"]]
+        suggestions.append({
+            "partner": {"user_id": partner.id, "username": partner.username},
+            "give": give_items,
+            "receive": receive_items,
+            "give_value": round(sum(item["current_value"] for item in give_items), 2),
+            "receive_value": round(sum(item["current_value"] for item in receive_items), 2),
+            "imbalance": round(trade["imbalance"], 4),
+            "score": round(trade["score"], 2)
+        })
 
-    return {"success": True, "data": matches}
+    suggestions.sort(key=lambda suggestion: -suggestion["score"])
+    return {"success": True, "data": {"trades": suggestions[:max(1, min(limit, 100))], "complete": complete}}
 
 # Notifications
 @app.get("/api/v1/notifications")
@@ -986,12 +4439,7 @@ async def list_notifications(current_user: User = Depends(get_current_user), db:
                 Notification.message == msg
             ).first()
             if not existing:
-                db.add(Notification(
-                    user_id=current_user.id,
-                    type="trend",
-                    title=title,
-                    message=msg
-                ))
+                add_notification(db, current_user.id, "trend", title, msg)
     db.commit()
 
     notes = db.query(Notification).filter(Notification.user_id == current_user.id).order_by(Notification.created_at.desc()).limit(100).all()
@@ -1009,7 +4457,7 @@ async def list_notifications(current_user: User = Depends(get_current_user), db:
 
 @app.get("/api/v1/notifications/unread-count")
 async def unread_count(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    c = db.query(Notification).filter(Notification.user_id == current_user.id, Notification.read == False).count()  # noqa: E712
+    c = get_user_summary(db, current_user.id)["unread_count"]
     return {"success": True, "data": {"count": c}}
 
 @app.post("/api/v1/notifications/{notification_id}/read")
@@ -1017,7 +4465,12 @@ async def mark_notification_read(notification_id: str, current_user: User = Depe
     n = db.query(Notification).filter(Notification.id == notification_id, Notification.user_id == current_user.id).first()
     if not n:
         raise HTTPException(status_code=404, detail="Notification not found")
-    n.read = True
+    # Conditional update so marking twice (or concurrently) only decrements the unread count once
+    marked = db.query(Notification).filter(
+        Notification.id == notification_id, Notification.read == False  # noqa: E712
+    ).update({Notification.read: True}, synchronize_session=False)
+    if marked:
+        change_user_summary(db, current_user.id, unread=-1)
     db.commit()
     return {"success": True}
 
@@ -1042,8 +4495,13 @@ async def get_settings(current_user: User = Depends(get_current_user)):
 async def update_settings(payload: SettingsUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     if payload.inventory_public is not None:
         current_user.inventory_public = payload.inventory_public
-    if payload.marketplace_enabled is not None:
+    if payload.marketplace_enabled is not None and payload.marketplace_enabled != bool(current_user.marketplace_enabled):
         current_user.marketplace_enabled = payload.marketplace_enabled
+        db.flush()
+        if payload.marketplace_enabled:
+            sync_marketplace_matches(db, owner_id=current_user.id)
+        else:
+            remove_marketplace_matches(db, owner_id=current_user.id)
     if payload.notification_in_app is not None:
         current_user.notification_in_app = payload.notification_in_app
     if payload.city is not None:
@@ -1060,25 +4518,23 @@ async def update_settings(payload: SettingsUpdate, current_user: User = Depends(
 async def get_dashboard(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get dashboard summary statistics"""
     
-    # Get inventory stats
-    inventory_items = db.query(InventoryEntry).filter(InventoryEntry.user_id == current_user.id).all()
-    total_cards = sum(item.quantity for item in inventory_items)
-    total_value = sum((item.current_value or 0) * item.quantity for item in inventory_items)
+    # Inventory, scan and notification counts are maintained incrementally in user_summaries
+    summary = get_user_summary(db, current_user.id)
+    total_cards = summary["card_count"]
+    total_value = summary["total_value"]
     
-    # Calculate value change (mock - in production, compare with previous snapshot)
-    value_change = total_value * 0.05  # Mock 5% increase
-    value_change_percent = 5.0 if total_value > 0 else 0.0
+    # Value change against the portfolio snapshots
+    value_changes = portfolio_value_changes(db, current_user.id, total_value)
+    value_change = value_changes["24h"]["amount"]
+    value_change_percent = value_changes["24h"]["percent"]
     
-    # Get recent scans (last 7 days)
-    recent_scans = db.query(Scan).filter(
-        Scan.user_id == current_user.id,
-        Scan.created_at >= datetime.utcnow() - timedelta(days=7)
-    ).count()
+    # Scans uploaded in the last RECENT_SCAN_DAYS days (UTC)
+    recent_scans = summary["recent_scans"]
     
     # Marketplace stats (wants + matches)
     active_listings = 0
     pending_trades = 0
-    unread_alerts = db.query(Notification).filter(Notification.user_id == current_user.id, Notification.read == False).count()  # noqa: E712
+    unread_alerts = summary["unread_count"]
     
     return {
         "success": True,
@@ -1087,6 +4543,7 @@ async def get_dashboard(current_user: User = Depends(get_current_user), db: Sess
             "total_value": round(total_value, 2),
             "value_change": round(value_change, 2),
             "value_change_percent": value_change_percent,
+            "value_changes": value_changes,
             "recent_scans": recent_scans,
             "active_listings": active_listings,
             "pending_trades": pending_trades,
@@ -1094,6 +4551,101 @@ async def get_dashboard(current_user: User = Depends(get_current_user), db: Sess
         }
     }
 
+@app.get("/api/v1/portfolio/history")
+async def get_portfolio_history(
+    range: str = "30d",
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Portfolio value series for charts: one range read at the resolution that suits the span."""
+    if range not in PORTFOLIO_HISTORY_RANGES:
+        raise HTTPException(status_code=400, detail=f"range must be one of {', '.join(PORTFOLIO_HISTORY_RANGES)}")
+    span, resolution = PORTFOLIO_HISTORY_RANGES[range]
+    now = datetime.utcnow()
+    start = now - span
+
+    points = db.query(PortfolioSnapshot).filter(
+        PortfolioSnapshot.user_id == current_user.id,
+        PortfolioSnapshot.resolution == resolution,
+        PortfolioSnapshot.bucket_start > start
+    ).order_by(PortfolioSnapshot.bucket_start).all()
+    series = [
+        {"t": p.bucket_start.isoformat(), "value": round(p.total_value or 0, 2), "cards": p.card_count}
+        for p in points
+    ]
+    # Anchor both ends: the value carried into the range, and the live summary
+    opening = portfolio_value_at(db, current_user.id, start)
+    if opening is not None:
+        series.insert(0, {"t": start.isoformat(), "value": round(opening, 2), "cards": None})
+    summary = get_user_summary(db, current_user.id)
+    series.append({"t": now.isoformat(), "value": round(summary["total_value"], 2), "cards": summary["card_count"]})
+
+    return {
+        "success": True,
+        "data": {
+            "range": range,
+            "resolution": resolution,
+            "points": series,
+            "changes": portfolio_value_changes(db, current_user.id, summary["total_value"])
+        }
+    }
+
+@app.get("/api/v1/inventory/{entry_id}/history")
+async def get_holding_history(
+    entry_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Price points recorded for one holding."""
+    entry = db.query(InventoryEntry).filter(
+        InventoryEntry.id == entry_id,
+        InventoryEntry.user_id == current_user.id
+    ).first()
+    if not entry:
+        raise HTTPException(status_code=404, detail="Inventory entry not found")
+    points = db.query(HoldingValuePoint).filter(
+        HoldingValuePoint.entry_id == entry_id
+    ).order_by(HoldingValuePoint.recorded_at).all()
+    return {
+        "success": True,
+        "data": [
+            {"t": p.recorded_at.isoformat(), "unit_value": p.unit_value, "quantity": p.quantity}
+            for p in points
+        ]
+    }
+
+@app.get("/api/v1/prices")
+async def get_price(
+    name: str,
+    set_code: Optional[str] = None,
+    condition: str = "Near Mint",
+    db: Session = Depends(get_db)
+):
+    """Current market price for a card, served from the price cache. A blank condition asks for the any-condition price."""
+    card_key = normalize_card_key(name)
+    set_code = normalize_set_code(set_code)
+    if condition.strip():
+        condition = normalize_condition(condition)
+        if condition is None:
+            raise HTTPException(status_code=400, detail=f"Unknown condition; use one of: {', '.join(CARD_CONDITIONS)}")
+    else:
+        condition = ""
+    price = lookup_price(db, card_key, set_code, condition)
+    return {
+        "success": True,
+        "data": {
+            "card_name": name,
+            "set_code": set_code,
+            "condition": condition,
+            "price": {"amount": price, "currency": "USD"} if price is not None else None
+        }
+    }
+
+@app.get("/api/v1/catalog/suggest")
+async def suggest_catalog_cards(q: str, limit: int = 10):
+    """Autocomplete card names from the in-memory catalog index."""
+    return {"success": True, "data": catalog_resolver.suggest(q, limit)}
+
 # Subscription
 @app.get("/api/v1/subscription")
 async def get_subscription(current_user: User = Depends(get_current_user)):
@@ -1156,6 +4708,91 @@ async def upgrade_subscription(
 async def health():
     return {"status": "healthy"}
 
+@app.get("/api/v1/system/stats")
+async def system_stats():
+    """Operational counters for monitoring"""
+    return {
+        "success": True,
+        "data": {
+            "scan_cache": scan_result_cache.stats(),
+            "cropping": crop_stats(),
+            "price_cache": price_cache.stats(),
+            "catalog_resolver": catalog_resolver.stats(),
+            "ml_client": {
+                "circuit_breaker": ml_circuit_breaker.stats(),
+                "latency": ml_call_latency.stats()
+            }
+        }
+    }
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CardVault backend")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="Run the API server (default)")
+    commands.add_parser("compact-holdings", help="Fold inventory rows saved before holdings into quantity-aggregated holdings")
+    reconcile_parser = commands.add_parser("reconcile-summaries", help="Recompute dashboard summaries and repair drift")
+    reconcile_parser.add_argument("--check", action="store_true", help="Only report drift, don't repair it")
+    prices_parser = commands.add_parser("ingest-prices", help="Load a price feed (.csv, .jsonl or .json) and reprice holdings")
+    prices_parser.add_argument("path")
+    prices_parser.add_argument("--source", help="Feed name stored with each price (default: file name)")
+    catalog_parser = commands.add_parser("load-catalog", help="Load a card catalog (.csv, .jsonl or .json) and resolve existing cards")
+    catalog_parser.add_argument("path")
+    commands.add_parser("rebuild-matches", help="Recompute the marketplace match index from wants and holdings")
+    commands.add_parser("check-matches", help="Report marketplace matches missing from (or stale in) the index")
+    commands.add_parser("rebuild-blob-refs", help="Recount blob references from scans (and their crops), holdings and copies")
+    args = parser.parse_args()
+
+    if args.command == "compact-holdings":
+        db = SessionLocal()
+        try:
+            ensure_user_summaries(db)
+            print(compact_inventory_holdings(db))
+        finally:
+            db.close()
+    elif args.command == "reconcile-summaries":
+        db = SessionLocal()
+        try:
+            print(reconcile_user_summaries(db, repair=not args.check))
+        finally:
+            db.close()
+    elif args.command == "ingest-prices":
+        db = SessionLocal()
+        try:
+            ensure_user_summaries(db)
+            print(ingest_price_feed(db, args.path, source=args.source))
+        finally:
+            db.close()
+    elif args.command == "load-catalog":
+        db = SessionLocal()
+        try:
+            print(load_catalog_file(db, args.path))
+            refresh_catalog_resolver(db)
+            print(backfill_catalog_ids(db))
+            print(catalog_resolver.stats())
+        finally:
+            db.close()
+    elif args.command == "rebuild-matches":
+        db = SessionLocal()
+        try:
+            print(rebuild_marketplace_matches(db))
+        finally:
+            db.close()
+    elif args.command == "check-matches":
+        db = SessionLocal()
+        try:
+            result = check_marketplace_matches(db)
+            print(result)
+        finally:
+            db.close()
+        raise SystemExit(0 if result["consistent"] else 1)
+    elif args.command == "rebuild-blob-refs":
+        db = SessionLocal()
+        try:
+            print(f"Counted references for {rebuild_blob_refs(db)} blob(s)")
+        finally:
+            db.close()
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -8,6 +8,8 @@ interface InventoryEntry {
     name: string;
     set: { id: string; name: string; code: string };
     image_url: string;
+    thumbnail_url?: string | null;
+    thumbnails?: Record<'small' | 'medium', { webp: string; jpg: string }> | null;
   };
   quantity: number;
   condition: string;
@@ -25,9 +27,48 @@ const resolveImageUrl = (apiUrl: string, imageUrl: string) => {
   return `${apiUrl}${imageUrl.startsWith('/') ? imageUrl : `/${imageUrl}`}`;
 };
 
+// Prefer the WebP rendition, fall back to JPEG, and to the full image for entries without renditions
+function CardImage({
+  entry,
+  size,
+  apiUrl,
+  className
+}: {
+  entry: InventoryEntry;
+  size: 'small' | 'medium';
+  apiUrl: string;
+  className: string;
+}) {
+  const rendition = entry.card.thumbnails?.[size];
+  if (!rendition) {
+    return (
+      <img
+        src={resolveImageUrl(apiUrl, entry.card.image_url)}
+        alt={entry.card.name}
+        loading="lazy"
+        className={className}
+      />
+    );
+  }
+  return (
+    <picture>
+      <source srcSet={resolveImageUrl(apiUrl, rendition.webp)} type="image/webp" />
+      <img
+        src={resolveImageUrl(apiUrl, rendition.jpg)}
+        alt={entry.card.name}
+        loading="lazy"
+        className={className}
+      />
+    </picture>
+  );
+}
+
 export default function InventoryPage() {
   const [entries, setEntries] = useState<InventoryEntry[]>([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [totalCount, setTotalCount] = useState<number | null>(null);
   const [viewMode, setViewMode] = useState<'grid' | 'list'>('grid');
   const [searchQuery, setSearchQuery] = useState('');
   const [filters, setFilters] = useState({
@@ -43,15 +84,21 @@ export default function InventoryPage() {
 
   const apiUrl = process.env.REACT_APP_API_URL || 'http://localhost:8000';
 
-  const fetchInventory = async () => {
-    setLoading(true);
+  // Without a cursor this loads the first page (and the total); with one it appends the next page
+  const fetchInventory = async (cursor?: string) => {
+    if (cursor) {
+      setLoadingMore(true);
+    } else {
+      setLoading(true);
+    }
     try {
       const params = new URLSearchParams({
         search: searchQuery,
-        sort_by: filters.sort_by,
+        sort_by: filters.sort_by === 'relevance' && !searchQuery ? 'date_added' : filters.sort_by,
         sort_order: filters.sort_order,
         ...(filters.set_id && { set_id: filters.set_id }),
         ...(filters.condition && { condition: filters.condition }),
+        ...(cursor ? { cursor } : { include_total: 'true' }),
       });
 
       const response = await fetch(`${apiUrl}/api/v1/inventory?${params}`, {
@@ -63,11 +110,15 @@ export default function InventoryPage() {
       if (!response.ok) throw new Error('Failed to fetch inventory');
 
       const data = await response.json();
-      setEntries(data.data.items || []);
+      const items = data.data.items || [];
+      setEntries((previous) => (cursor ? [...previous, ...items] : items));
+      setNextCursor(data.data.pagination?.next_cursor || null);
+      if (!cursor) setTotalCount(data.data.pagination?.total ?? null);
     } catch (error) {
       console.error('Error fetching inventory:', error);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -81,7 +132,8 @@ export default function InventoryPage() {
       });
 
       if (!response.ok) throw new Error('Failed to remove inventory entry');
-      await fetchInventory();
+      setEntries((previous) => previous.filter((entry) => entry.id !== entryId));
+      setTotalCount((previous) => (previous === null ? previous : previous - 1));
     } catch (error) {
       console.error('Error removing inventory entry:', error);
       alert('Unable to remove that card. Please try again.');
@@ -99,7 +151,7 @@ export default function InventoryPage() {
         <div className="mb-8">
           <h1 className="text-3xl font-bold text-gray-900 mb-2">My Inventory</h1>
           <p className="text-gray-600">
-            {entries.length} cards • Total Value: ${totalValue.toFixed(2)}
+            {totalCount ?? entries.length} cards • Total Value: ${totalValue.toFixed(2)}
           </p>
         </div>
 
@@ -136,6 +188,7 @@ export default function InventoryPage() {
                 onChange={(e) => setFilters({ ...filters, sort_by: e.target.value })}
                 className="px-4 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500"
               >
+                {searchQuery && <option value="relevance">Best Match</option>}
                 <option value="date_added">Date Added</option>
                 <option value="name">Name</option>
                 <option value="value">Value</option>
@@ -195,9 +248,10 @@ export default function InventoryPage() {
                   <tr key={entry.id} className="hover:bg-gray-50 cursor-pointer">
                     <td className="px-6 py-4 whitespace-nowrap">
                       <div className="flex items-center">
-                        <img
-                          src={resolveImageUrl(apiUrl, entry.card.image_url)}
-                          alt={entry.card.name}
+                        <CardImage
+                          entry={entry}
+                          size="small"
+                          apiUrl={apiUrl}
                           className="w-12 h-16 object-contain mr-3"
                         />
                         <span className="font-medium text-gray-900">{entry.card.name}</span>
@@ -229,6 +283,19 @@ export default function InventoryPage() {
             </table>
           </div>
         )}
+
+        {!loading && nextCursor && (
+          <div className="mt-8 flex justify-center">
+            <button
+              type="button"
+              onClick={() => fetchInventory(nextCursor)}
+              disabled={loadingMore}
+              className="px-4 py-2 bg-white border border-gray-300 rounded-lg text-gray-700 hover:bg-gray-50 disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -245,9 +312,10 @@ function CardGridItem({
 }) {
   return (
     <div className="bg-white rounded-lg shadow-md overflow-hidden hover:shadow-lg transition-shadow relative">
-      <img
-        src={resolveImageUrl(apiUrl, entry.card.image_url)}
-        alt={entry.card.name}
+      <CardImage
+        entry={entry}
+        size="medium"
+        apiUrl={apiUrl}
         className="w-full h-48 object-contain bg-gray-50"
       />
       <button
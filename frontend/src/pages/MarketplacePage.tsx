@@ -20,7 +20,19 @@ type Match = {
     set_code: string;
     condition: string;
     quantity: number;
+    current_value?: number | null;
   };
+  score: number;
+};
+
+const CONDITIONS = ['Near Mint', 'Lightly Played', 'Moderately Played', 'Heavily Played', 'Damaged'];
+
+type CardSuggestion = {
+  name: string;
+  card_key: string;
+  catalog_id: number | null;
+  printings: number;
+  set_codes: string[];
 };
 
 export default function MarketplacePage() {
@@ -33,6 +45,9 @@ export default function MarketplacePage() {
 
   const [cardName, setCardName] = useState('');
   const [setCode, setSetCode] = useState('');
+  const [minCondition, setMinCondition] = useState('');
+  const [maxPrice, setMaxPrice] = useState('');
+  const [suggestions, setSuggestions] = useState<CardSuggestion[]>([]);
 
   const placeholderInquiries = useMemo(() => {
     const sampleUsers = ['CardKing', 'HoloHunter', 'TopLoader', 'MintVault', 'SleevedUp'];
@@ -69,7 +84,7 @@ export default function MarketplacePage() {
       const wJson = await wRes.json();
       const mJson = await mRes.json();
       setWants(wJson.data || []);
-      setMatches(mJson.data || []);
+      setMatches(mJson.data?.items || []);
     } finally {
       setLoading(false);
     }
@@ -80,6 +95,25 @@ export default function MarketplacePage() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []);
 
+  useEffect(() => {
+    const query = cardName.trim();
+    if (!query) {
+      setSuggestions([]);
+      return;
+    }
+    const controller = new AbortController();
+    fetch(`${apiUrl}/api/v1/catalog/suggest?q=${encodeURIComponent(query)}&limit=8`, { signal: controller.signal })
+      .then((res) => res.json())
+      .then((json) => setSuggestions(json.data || []))
+      .catch(() => {});
+    return () => controller.abort();
+  }, [apiUrl, cardName]);
+
+  const setCodeOptions = useMemo(
+    () => suggestions.find((s) => s.name.toLowerCase() === cardName.trim().toLowerCase())?.set_codes || [],
+    [suggestions, cardName]
+  );
+
   async function addWant(e: React.FormEvent) {
     e.preventDefault();
     if (!cardName.trim()) return;
@@ -93,10 +127,14 @@ export default function MarketplacePage() {
       body: JSON.stringify({
         card_name: cardName.trim(),
         set_code: setCode.trim() ? setCode.trim().toUpperCase() : null,
+        min_condition: minCondition || null,
+        max_price: maxPrice ? Number(maxPrice) : null,
       }),
     });
     setCardName('');
     setSetCode('');
+    setMinCondition('');
+    setMaxPrice('');
     await fetchAll();
   }
 
@@ -130,7 +168,14 @@ export default function MarketplacePage() {
                 value={cardName}
                 onChange={(e) => setCardName(e.target.value)}
                 placeholder="e.g., Lightning Bolt"
+                list="card-name-suggestions"
+                autoComplete="off"
               />
+              <datalist id="card-name-suggestions">
+                {suggestions.map((s) => (
+                  <option key={s.card_key} value={s.name} />
+                ))}
+              </datalist>
             </div>
           </div>
           <div>
@@ -140,6 +185,38 @@ export default function MarketplacePage() {
               value={setCode}
               onChange={(e) => setSetCode(e.target.value)}
               placeholder="e.g., M21"
+              list="set-code-suggestions"
+              autoComplete="off"
+            />
+            <datalist id="set-code-suggestions">
+              {setCodeOptions.map((code) => (
+                <option key={code} value={code} />
+              ))}
+            </datalist>
+          </div>
+          <div>
+            <label className="block text-sm font-medium text-gray-700 mb-1">Minimum condition (optional)</label>
+            <select
+              className="w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-blue-500"
+              value={minCondition}
+              onChange={(e) => setMinCondition(e.target.value)}
+            >
+              <option value="">Any</option>
+              {CONDITIONS.map((condition) => (
+                <option key={condition} value={condition}>{condition}</option>
+              ))}
+            </select>
+          </div>
+          <div>
+            <label className="block text-sm font-medium text-gray-700 mb-1">Max price (optional)</label>
+            <input
+              type="number"
+              min="0"
+              step="0.01"
+              className="w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-blue-500"
+              value={maxPrice}
+              onChange={(e) => setMaxPrice(e.target.value)}
+              placeholder="e.g., 25"
             />
           </div>
           <div className="md:col-span-3">
@@ -168,6 +245,8 @@ export default function MarketplacePage() {
                     </p>
                     <p className="text-sm text-gray-600">
                       Matches: {groupedMatches[w.id]?.length || 0}
+                      {w.min_condition ? ` • ${w.min_condition} or better` : ''}
+                      {w.max_price != null ? ` • up to $${w.max_price.toFixed(2)}` : ''}
                     </p>
                   </div>
                   <button
@@ -190,6 +269,7 @@ export default function MarketplacePage() {
                             </p>
                             <p className="text-sm text-gray-600">
                               {m.have.condition} • Qty {m.have.quantity}
+                              {m.have.current_value ? ` • $${m.have.current_value.toFixed(2)}` : ''} • {Math.round(m.score)}% match
                             </p>
                           </div>
                           <button
@@ -348,7 +348,7 @@ export default function ScanPage() {
         )}
 
         {/* Processing Status - Show image with overlay */}
-        {scanResult && scanResult.status === 'processing' && imagePreview && (
+        {scanResult && (scanResult.status === 'pending' || scanResult.status === 'processing') && imagePreview && (
           <div className="bg-white rounded-lg shadow-md p-8 mb-6">
             <div className="relative">
               <img
@@ -1,16 +1,30 @@
 """
 CardVault ML Service
 Uses Google's Gemini AI for card detection and identification
+(or a deterministic fake backend for load testing, see ML_BACKEND)
 """
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from typing import Optional, List
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
+import io
+import random
+import time
 import uuid
 import json
 import os
+import threading
 from pathlib import Path
-from PIL import Image
+from PIL import Image, ImageOps
+import numpy as np
 from google import genai
-from google.genai.types import HttpOptions
+from google.genai.types import HttpOptions, Part
 import re
 
 app = FastAPI(title="CardVault ML Service")
@@ -25,14 +39,642 @@ app.add_middleware(
 
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")  # or "gemini-1.5-pro" for better accuracy
 
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is required. Set it in your environment or docker-compose.yml")
+# Inference backend: "gemini" (default) or "fake" for load tests without model spend
+ML_BACKEND = os.getenv("ML_BACKEND", "gemini")
+ML_FAKE_FIXTURES = os.getenv("ML_FAKE_FIXTURES", str(Path(__file__).parent / "fixtures" / "fake_cards.json"))
+ML_FAKE_LATENCY_MS = float(os.getenv("ML_FAKE_LATENCY_MS", "800"))
+ML_FAKE_LATENCY_JITTER_MS = float(os.getenv("ML_FAKE_LATENCY_JITTER_MS", "200"))
+ML_FAKE_FAILURE_RATE = float(os.getenv("ML_FAKE_FAILURE_RATE", "0"))
+ML_FAKE_SEED = os.getenv("ML_FAKE_SEED", "cardvault")
+
+# Inference concurrency and backpressure
+ML_MAX_INFLIGHT = int(os.getenv("ML_MAX_INFLIGHT", "4"))  # concurrent model calls
+ML_MAX_QUEUE = int(os.getenv("ML_MAX_QUEUE", "16"))  # requests allowed to wait for a slot
+ML_RETRY_AFTER_SECONDS = int(os.getenv("ML_RETRY_AFTER_SECONDS", "5"))
+ML_CPU_WORKERS = int(os.getenv("ML_CPU_WORKERS", "4"))  # threads for image decoding, hashing and parsing
+ML_MAX_UPLOAD_BYTES = int(os.getenv("ML_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+cpu_executor = ThreadPoolExecutor(max_workers=ML_CPU_WORKERS, thread_name_prefix="ml-cpu")
+
+
+async def run_cpu(func, *args):
+    """Run blocking image/parsing work on the CPU executor so the event loop stays responsive."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, func, *args)
+
+
+class InferenceLimiter:
+    """
+    Caps concurrent model calls and the number of requests waiting for one.
+    When both are full, requests are rejected immediately with 503 + Retry-After.
+    """
+
+    def __init__(self, max_inflight: int, max_queue: int):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_inflight)
+        self.inflight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.inflight >= self.max_inflight and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="ML service is at capacity, retry later",
+                headers={"Retry-After": str(ML_RETRY_AFTER_SECONDS)}
+            )
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self.completed += 1
+            self.semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+
+inference_limiter = InferenceLimiter(ML_MAX_INFLIGHT, ML_MAX_QUEUE)
+
+
+# Image preprocessing
+ML_MAX_DIM_SINGLE = int(os.getenv("ML_MAX_DIM_SINGLE", "1024"))
+ML_MAX_DIM_MULTI = int(os.getenv("ML_MAX_DIM_MULTI", "2048"))  # binder pages need more pixels per card
+ML_JPEG_QUALITY = int(os.getenv("ML_JPEG_QUALITY", "85"))
+EXIF_ORIENTATION_TAG = 0x0112
+
+preprocess_totals = {"images": 0, "original_bytes": 0, "sent_bytes": 0, "elapsed_ms": 0.0}
+preprocess_totals_lock = threading.Lock()  # preprocess_image runs on the CPU executor threads
+
+
+def preprocess_image(content: bytes, scan_type: str) -> dict:
+    """
+    Decode, orient and downscale an upload before inference.
+    JPEGs are decoded at reduced scale via draft mode, EXIF orientation is applied, the image is
+    bounded to the scan type's max dimension and re-encoded as JPEG.
+    Returns the upright PIL image, the encoded bytes to send, its perceptual hash and size stats.
+    """
+    started = time.perf_counter()
+    max_dim = ML_MAX_DIM_MULTI if scan_type == "multi" else ML_MAX_DIM_SINGLE
+    img = Image.open(io.BytesIO(content))
+    original_size = img.size
+    orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    if img.format == "JPEG":
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying >= max_dim on each side
+        img.draft("RGB", (max_dim, max_dim))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+
+    encoded = io.BytesIO()
+    img.save(encoded, "JPEG", quality=ML_JPEG_QUALITY, optimize=True)
+    encoded_bytes = encoded.getvalue()
+    image_hash = dhash(img)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    with preprocess_totals_lock:
+        preprocess_totals["images"] += 1
+        preprocess_totals["original_bytes"] += len(content)
+        preprocess_totals["sent_bytes"] += len(encoded_bytes)
+        preprocess_totals["elapsed_ms"] += elapsed_ms
+
+    return {
+        "image": img,
+        "bytes": encoded_bytes,
+        "hash": image_hash,
+        "orientation": orientation,
+        "stats": {
+            "original_bytes": len(content),
+            "sent_bytes": len(encoded_bytes),
+            "bytes_saved": len(content) - len(encoded_bytes),
+            "original_size": list(original_size),
+            "sent_size": list(img.size),
+            "orientation": orientation,
+            "elapsed_ms": round(elapsed_ms, 1)
+        }
+    }
+
+
+def _to_original_point(u: float, v: float, orientation: int) -> tuple:
+    """Map a normalized point on the upright image back onto the stored (unrotated) file."""
+    if orientation == 2:
+        return 1 - u, v
+    if orientation == 3:
+        return 1 - u, 1 - v
+    if orientation == 4:
+        return u, 1 - v
+    if orientation == 5:
+        return v, u
+    if orientation == 6:
+        return v, 1 - u
+    if orientation == 7:
+        return 1 - v, 1 - u
+    if orientation == 8:
+        return 1 - v, u
+    return u, v
+
+
+def map_box_to_original(box: dict, orientation: int) -> dict:
+    """
+    Boxes are normalized, so downscaling needs no correction; EXIF rotation does, because the
+    backend crops the file as stored.
+    """
+    if orientation in (None, 1) or not isinstance(box, dict):
+        return box
+    x, y = box.get("x", 0.0), box.get("y", 0.0)
+    x1, y1 = _to_original_point(x, y, orientation)
+    x2, y2 = _to_original_point(x + box.get("width", 0.0), y + box.get("height", 0.0), orientation)
+    return {
+        "x": min(x1, x2),
+        "y": min(y1, y2),
+        "width": abs(x2 - x1),
+        "height": abs(y2 - y1)
+    }
+
+
+def map_cards_to_original(detected_cards: list, orientation: int) -> list:
+    mapped = []
+    for card in detected_cards:
+        if card.get("bounding_box"):
+            card = dict(card)
+            card["bounding_box"] = map_box_to_original(card["bounding_box"], orientation)
+        mapped.append(card)
+    return mapped
+
+
+async def read_upload(image: UploadFile) -> bytes:
+    """
+    Read an upload in chunks into memory, rejecting it as soon as it passes ML_MAX_UPLOAD_BYTES
+    or if its first bytes are not a known image signature. Nothing is written to disk.
+    """
+    buffer = io.BytesIO()
+    while True:
+        chunk = await image.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        if buffer.tell() == 0 and not is_supported_image(chunk[:16]):
+            raise HTTPException(status_code=415, detail="Unsupported image format")
+        if buffer.tell() + len(chunk) > ML_MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Image too large")
+        buffer.write(chunk)
+    if buffer.tell() == 0:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    return buffer.getvalue()
+
+
+def is_supported_image(head: bytes) -> bool:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return True
+    return head.startswith((b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a"))
+
+
+# Classical card detector (NumPy/Pillow): edges -> connected components -> quadrilateral fit.
+# Runs on CPU in a few milliseconds alongside the model call and corrects or fills in its boxes.
+ML_DETECTOR_ENABLED = os.getenv("ML_DETECTOR_ENABLED", "true").lower() == "true"
+ML_DETECTOR_MAX_DIM = int(os.getenv("ML_DETECTOR_MAX_DIM", "384"))
+ML_DETECTOR_EDGE_PERCENTILE = float(os.getenv("ML_DETECTOR_EDGE_PERCENTILE", "85"))
+ML_DETECTOR_ASPECT_TOLERANCE = float(os.getenv("ML_DETECTOR_ASPECT_TOLERANCE", "0.12"))
+CARD_ASPECT_RATIO = 63 / 88  # short side / long side of a standard trading card
+MIN_CARD_AREA_FRACTION = 0.01
+MIN_QUAD_FILL = 0.85  # quad area / convex hull area
+
+
+def _connected_components(mask) -> list:
+    """
+    Label 8-connected foreground regions with a run-length union-find.
+    Works on horizontal runs rather than pixels, so it stays fast without SciPy.
+    Returns a list of (rows, starts, ends) arrays per component.
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    transitions = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(transitions == 1)
+    _, run_ends = np.nonzero(transitions == -1)  # exclusive; same row order as the starts
+    run_count = len(run_rows)
+    if run_count == 0:
+        return []
+
+    parent = list(range(run_count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    row_bounds = np.searchsorted(run_rows, np.arange(height + 1))
+    for row in range(1, height):
+        previous = range(row_bounds[row - 1], row_bounds[row])
+        current_start = row_bounds[row]
+        current_end = row_bounds[row + 1]
+        if not previous or current_start == current_end:
+            continue
+        j = previous.start
+        for i in range(current_start, current_end):
+            # Runs overlap 8-connectedly if they touch including diagonals
+            while j < previous.stop and run_ends[j] < run_starts[i]:
+                j += 1
+            k = j
+            while k < previous.stop and run_starts[k] <= run_ends[i]:
+                root_a, root_b = find(i), find(k)
+                if root_a != root_b:
+                    parent[root_a] = root_b
+                k += 1
+
+    labels = np.array([find(i) for i in range(run_count)])
+    order = np.argsort(labels, kind="stable")
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    return [
+        (run_rows[group], run_starts[group], run_ends[group] - 1)
+        for group in np.split(order, boundaries)
+    ]
+
+
+def _convex_hull(points: list) -> list:
+    """Andrew's monotone chain; points are (x, y) tuples."""
+    points = sorted(set(points))
+    if len(points) <= 2:
+        return points
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def _polygon_area(points: list) -> float:
+    area = 0.0
+    for i in range(len(points)):
+        x1, y1 = points[i]
+        x2, y2 = points[(i + 1) % len(points)]
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2
+
+
+def _fit_card_quad(rows, starts, ends) -> Optional[list]:
+    """
+    Fit a quadrilateral to a component from its hull's four extreme corners and keep it only if it is
+    quad-shaped and has a card's aspect ratio. Returns [top-left, top-right, bottom-right, bottom-left].
+    """
+    # The per-row leftmost and rightmost pixels contain the whole convex hull
+    hull = _convex_hull(list(zip(starts.tolist(), rows.tolist())) + list(zip(ends.tolist(), rows.tolist())))
+    if len(hull) < 4:
+        return None
+    hull_area = _polygon_area(hull)
+    if hull_area <= 0:
+        return None
+    sums = [x + y for x, y in hull]
+    diffs = [x - y for x, y in hull]
+    quad = [
+        hull[sums.index(min(sums))],
+        hull[diffs.index(max(diffs))],
+        hull[sums.index(max(sums))],
+        hull[diffs.index(min(diffs))]
+    ]
+    if _polygon_area(quad) / hull_area < MIN_QUAD_FILL:
+        return None
+
+    def length(a, b):
+        return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
+
+    width = (length(quad[0], quad[1]) + length(quad[3], quad[2])) / 2
+    height = (length(quad[0], quad[3]) + length(quad[1], quad[2])) / 2
+    if min(width, height) <= 0:
+        return None
+    aspect = min(width, height) / max(width, height)
+    if abs(aspect - CARD_ASPECT_RATIO) > ML_DETECTOR_ASPECT_TOLERANCE:
+        return None
+    return quad
+
+
+def box_iou(a: dict, b: dict) -> float:
+    left = max(a["x"], b["x"])
+    top = max(a["y"], b["y"])
+    right = min(a["x"] + a["width"], b["x"] + b["width"])
+    bottom = min(a["y"] + a["height"], b["y"] + b["height"])
+    intersection = max(0.0, right - left) * max(0.0, bottom - top)
+    union = a["width"] * a["height"] + b["width"] * b["height"] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def detect_card_boxes(img: Image.Image) -> list:
+    """
+    Find card-shaped quadrilaterals in an upright image.
+    Returns normalized {"x", "y", "width", "height"} boxes in reading order.
+    """
+    small = img.convert("L")
+    small.thumbnail((ML_DETECTOR_MAX_DIM, ML_DETECTOR_MAX_DIM), Image.BILINEAR)
+    gray = np.asarray(small, dtype=np.float32)
+    height, width = gray.shape
+    if height < 8 or width < 8:
+        return []
+
+    # Central-difference gradient magnitude, thresholded at a high percentile
+    magnitude = np.zeros_like(gray)
+    magnitude[1:-1, 1:-1] = (
+        np.abs(gray[1:-1, 2:] - gray[1:-1, :-2]) + np.abs(gray[2:, 1:-1] - gray[:-2, 1:-1])
+    )
+    threshold = max(np.percentile(magnitude, ML_DETECTOR_EDGE_PERCENTILE), 12.0)
+    edges = magnitude > threshold
+
+    # 3x3 dilation closes small gaps in card outlines
+    closed = edges.copy()
+    closed[1:, :] |= edges[:-1, :]
+    closed[:-1, :] |= edges[1:, :]
+    grown = closed.copy()
+    grown[:, 1:] |= closed[:, :-1]
+    grown[:, :-1] |= closed[:, 1:]
+
+    min_area = MIN_CARD_AREA_FRACTION * width * height
+    candidates = []
+    for rows, starts, ends in _connected_components(grown):
+        box_width = ends.max() - starts.min() + 1
+        box_height = rows.max() - rows.min() + 1
+        if box_width * box_height < min_area:
+            continue
+        quad = _fit_card_quad(rows, starts, ends)
+        if quad is None:
+            continue
+        xs = [p[0] for p in quad]
+        ys = [p[1] for p in quad]
+        candidates.append({
+            "x": min(xs) / width,
+            "y": min(ys) / height,
+            "width": (max(xs) - min(xs) + 1) / width,
+            "height": (max(ys) - min(ys) + 1) / height
+        })
+
+    # Drop boxes nested inside a larger card (artwork frames have card-like proportions too)
+    candidates.sort(key=lambda b: b["width"] * b["height"], reverse=True)
+    boxes = []
+    for box in candidates:
+        area = box["width"] * box["height"]
+        nested = False
+        for kept in boxes:
+            overlap_w = min(box["x"] + box["width"], kept["x"] + kept["width"]) - max(box["x"], kept["x"])
+            overlap_h = min(box["y"] + box["height"], kept["y"] + kept["height"]) - max(box["y"], kept["y"])
+            if overlap_w > 0 and overlap_h > 0 and overlap_w * overlap_h >= 0.8 * area:
+                nested = True
+                break
+        if not nested:
+            boxes.append(box)
+
+    # Reading order: bucket into rows by vertical centre, then left to right
+    if boxes:
+        row_height = min(b["height"] for b in boxes) / 2
+        boxes.sort(key=lambda b: (round((b["y"] + b["height"] / 2) / row_height), b["x"]))
+    return boxes
+
+
+def reconcile_boxes(detected_cards: list, detector_boxes: list) -> list:
+    """
+    Snap model boxes to the detector box they overlap (IoU >= 0.5), and give cards whose
+    box was a made-up fallback the remaining detector boxes in reading order.
+    """
+    if not detector_boxes:
+        return detected_cards
+    unused = list(range(len(detector_boxes)))
+    for card in detected_cards:
+        box = card.get("bounding_box")
+        if not box or card.get("bbox_source") == "fallback":
+            continue
+        best = max(unused, key=lambda i: box_iou(box, detector_boxes[i]), default=None)
+        if best is not None and box_iou(box, detector_boxes[best]) >= 0.5:
+            card["bounding_box"] = dict(detector_boxes[best])
+            card["bbox_source"] = "detector"
+            unused.remove(best)
+    for card in detected_cards:
+        if card.get("bbox_source") == "fallback" and unused:
+            card["bounding_box"] = dict(detector_boxes[unused.pop(0)])
+            card["bbox_source"] = "detector"
+    return detected_cards
+
+
+# Perceptual-hash index of previously identified cards
+PHASH_INDEX_PATH = os.getenv("PHASH_INDEX_PATH", "phash_index.jsonl")
+# Hamming distance out of 64 bits. Recompressed or rescaled copies of one photo land within 1-2 bits;
+# different cards sharing a frame and layout can come within 4-6, so anything looser reuses wrong identities.
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "2"))
+
+
+def dhash(img: Image.Image, hash_size: int = 8) -> int:
+    """
+    Difference hash: compare horizontally adjacent pixels of a tiny grayscale thumbnail.
+    Robust to rescaling and recompression; returns a hash_size * hash_size bit integer.
+    """
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance; each node stores (hash, entry index)."""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, hash_value: int, entry_index: int):
+        node = [hash_value, entry_index, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming_distance(hash_value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, hash_value: int, max_distance: int) -> list:
+        """Return [(distance, entry_index)] for every stored hash within max_distance."""
+        results = []
+        if self.root is None:
+            return results
+        stack = [self.root]
+        while stack:
+            node_hash, entry_index, children = stack.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= max_distance:
+                results.append((distance, entry_index))
+            # Triangle inequality: only subtrees in [d - max, d + max] can contain matches
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+class PerceptualIndex:
+    """
+    Near-duplicate lookup of identified images, persisted as an append-only JSON-lines file.
+    Entry kinds: "single" and "multi" are whole uploaded images, "card" is a crop from a multi scan.
+    """
+
+    def __init__(self, path: str, max_distance: int):
+        self.path = Path(path)
+        self.max_distance = max_distance
+        self.entries = []
+        self.trees = {}
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.distance_histogram = {}
+
+    def load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                    self._insert(int(record["hash"], 16), record["kind"], record["cards"])
+                except (ValueError, KeyError) as e:
+                    print(f"Skipping bad phash index line: {e}")
+        print(f"Loaded {len(self.entries)} perceptual hash entries from {self.path}")
+
+    def _insert(self, hash_value: int, kind: str, cards: list):
+        self.entries.append({"hash": hash_value, "kind": kind, "cards": cards})
+        self.trees.setdefault(kind, BKTree()).add(hash_value, len(self.entries) - 1)
+
+    def _kinds_for(self, scan_type: str) -> tuple:
+        # A single-card photo can match an earlier single scan or a crop from a binder page
+        return ("single", "card") if scan_type == "single" else ("multi",)
+
+    def lookup(self, hash_value: int, scan_type: str) -> Optional[dict]:
+        with self.lock:
+            self.lookups += 1
+            best = None
+            for kind in self._kinds_for(scan_type):
+                tree = self.trees.get(kind)
+                if tree is None:
+                    continue
+                for distance, entry_index in tree.search(hash_value, self.max_distance):
+                    if best is None or distance < best[0]:
+                        best = (distance, entry_index)
+            if best is None:
+                return None
+            self.hits += 1
+            self.distance_histogram[best[0]] = self.distance_histogram.get(best[0], 0) + 1
+            entry = self.entries[best[1]]
+            return {"distance": best[0], "kind": entry["kind"], "cards": entry["cards"]}
+
+    def add(self, hash_value: int, kind: str, cards: list):
+        with self.lock:
+            tree = self.trees.get(kind)
+            if tree is not None and tree.search(hash_value, 0):
+                return  # Already indexed
+            self._insert(hash_value, kind, cards)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"hash": f"{hash_value:016x}", "kind": kind, "cards": cards}) + "\n")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_distance": self.max_distance,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "hit_distance_histogram": dict(sorted(self.distance_histogram.items()))
+            }
+
+
+phash_index = PerceptualIndex(PHASH_INDEX_PATH, PHASH_MAX_DISTANCE)
+phash_index.load()
+
+IDENTITY_FIELDS = ("name", "set_code", "card_number", "year", "domain", "bounding_box", "condition")
+
+
+def identified_cards(detected_cards: list) -> list:
+    """Strip per-request fields; keep only cards the model actually identified."""
+    return [
+        {field: card[field] for field in IDENTITY_FIELDS if field in card}
+        for card in detected_cards
+        if card.get("name") and card.get("name") != "Unknown Card"
+    ]
+
+
+def cards_from_phash_match(match: dict, scan_type: str) -> list:
+    detected_cards = []
+    for card in match["cards"]:
+        card = dict(card)
+        card["id"] = str(uuid.uuid4())
+        card["confidence"] = 0.8
+        if scan_type == "single":
+            # Crops from binder pages carry page coordinates; the new photo shows just this card
+            card["bounding_box"] = {"x": 0.1, "y": 0.1, "width": 0.8, "height": 0.8}
+        detected_cards.append(card)
+    return detected_cards
+
+
+def index_identified_image(img: Image.Image, image_hash: int, scan_type: str, detected_cards: list):
+    """Remember the identified image, and for multi scans each cropped card, for later near-duplicate lookups."""
+    cards = identified_cards(detected_cards)
+    if not cards:
+        return
+    if scan_type == "single":
+        phash_index.add(image_hash, "single", cards)
+        return
+    if len(cards) == len(detected_cards):
+        phash_index.add(image_hash, "multi", cards)
+    width, height = img.size
+    for card in cards:
+        box = card.get("bounding_box") or {}
+        left = int(max(0.0, box.get("x", 0.0)) * width)
+        top = int(max(0.0, box.get("y", 0.0)) * height)
+        right = int(min(1.0, box.get("x", 0.0) + box.get("width", 0.0)) * width)
+        bottom = int(min(1.0, box.get("y", 0.0) + box.get("height", 0.0)) * height)
+        if right - left < 16 or bottom - top < 16:
+            continue
+        crop_hash = dhash(img.crop((left, top, right, bottom)))
+        phash_index.add(crop_hash, "card", [card])
 
-client = genai.Client(
-    http_options=HttpOptions(api_version="v1"),
-    api_key=GEMINI_API_KEY
-)
 
 def extract_value(field_obj, default=None):
     """
@@ -53,169 +695,219 @@ def extract_value(field_obj, default=None):
     else:
         return default
 
+# Model output parsing
+MAX_RESPONSE_CHARS = 1_000_000  # Anything longer is truncated before scanning
+FALLBACK_SCAN_CHARS = 20_000  # Plain-text name matching only looks at the start of the response
+MAX_JSON_CANDIDATES = 16  # Balanced spans tried before giving up on finding JSON
+JSON_OPENER = re.compile(r'[\[{]')
+JSON_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]', re.DOTALL)  # Strings are skipped whole
+ML_INCLUDE_RAW_RESPONSE = os.getenv("ML_INCLUDE_RAW_RESPONSE", "false").lower() == "true"
+DEFAULT_SINGLE_BOX = {"x": 0.1, "y": 0.1, "width": 0.8, "height": 0.8}
+
+
+class BoundingBox(BaseModel):
+    x: float
+    y: float
+    width: float
+    height: float
+
+
+class CardCondition(BaseModel):
+    centering: float = 0.0
+    corners: float = 0.0
+    surface: float = 0.0
+    estimated_grade: float = 0.0
+
+
+class DetectedCard(BaseModel):
+    """Compact card record returned by /predict; None fields are omitted from the payload."""
+    id: str
+    name: str = "Unknown Card"
+    set_code: str = ""
+    card_number: Optional[str] = None
+    year: Optional[int] = None
+    domain: Optional[str] = None
+    confidence: float = 0.8
+    bounding_box: BoundingBox
+    bbox_source: Optional[str] = None  # "model", "fallback" or "detector" (multi scans)
+    condition: Optional[CardCondition] = None
+
+
+def extract_json(text: str):
+    """
+    Parse the first balanced JSON array/object in the text, tolerating code fences and leading or
+    trailing prose. Brackets are matched in one pass over string/bracket tokens, so unlike a greedy
+    DOTALL regex it cannot backtrack quadratically on malformed output.
+    """
+    if not text:
+        return None
+    text = text[:MAX_RESPONSE_CHARS]
+    # Fast path: the whole response (minus a code fence) is the JSON document
+    body = text.strip()
+    if body.startswith("```") and body.endswith("```"):
+        body = body[body.find("\n") + 1:-3].strip()
+    if body[:1] in ("[", "{"):
+        try:
+            return json.loads(body)
+        except (ValueError, RecursionError):
+            pass
+
+    position = 0
+    for _ in range(MAX_JSON_CANDIDATES):
+        match = JSON_OPENER.search(text, position)
+        if not match:
+            return None
+        start = match.start()
+        depth = 0
+        end = None
+        for token in JSON_TOKEN.finditer(text, start):
+            char = token.group()
+            if char in "[{":
+                depth += 1
+            elif char in "]}":
+                depth -= 1
+                if depth == 0:
+                    end = token.end()
+                    break
+        if end is None:
+            return None  # Unbalanced to the end of the text; nothing later can close either
+        try:
+            return json.loads(text[start:end])
+        except (ValueError, RecursionError):
+            position = start + 1  # e.g. "[note]" prose before the payload; try the next opener
+    return None
+
+
+def _as_text(value) -> Optional[str]:
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    value = str(value).strip()
+    return value if value and value.lower() != "null" else None
+
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(str(value).strip()[:4]) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_float(value, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _as_box(value) -> Optional[dict]:
+    if isinstance(value, list) and len(value) >= 4:
+        try:
+            return {"x": float(value[0]), "y": float(value[1]), "width": float(value[2]), "height": float(value[3])}
+        except (TypeError, ValueError):
+            return None
+    if isinstance(value, dict) and {"x", "y", "width", "height"} <= value.keys():
+        return _as_box([value["x"], value["y"], value["width"], value["height"]])
+    return None
+
+
+def card_record(card_obj: dict, index: int, scan_type: str) -> DetectedCard:
+    """Validate one model card object into a typed record, coercing or dropping malformed fields."""
+    def section(key):
+        value = card_obj.get(key)
+        return value if isinstance(value, dict) else {}
+
+    card_identity = section("cardIdentity")
+    physical_condition = section("physicalCondition")
+    interpretation = section("interpretation")
+
+    if scan_type == "multi":
+        box = _as_box(extract_value(card_obj.get("boundingBox"), None))
+        bbox_source = "model" if box else "fallback"
+        if not box:
+            box = {"x": 0.1 + (index * 0.3), "y": 0.2, "width": 0.25, "height": 0.4}
+    else:
+        box, bbox_source = DEFAULT_SINGLE_BOX, None
+
+    return DetectedCard(
+        id=str(uuid.uuid4()),
+        name=_as_text(extract_value(card_identity.get("name"))) or "Unknown Card",
+        set_code=_as_text(extract_value(card_identity.get("set"))) or "",
+        card_number=_as_text(extract_value(card_identity.get("cardNumber"))),
+        year=_as_int(extract_value(card_identity.get("year"))),
+        domain=_as_text(extract_value(card_identity.get("domain"))) or "other",
+        bounding_box=BoundingBox(**box),
+        bbox_source=bbox_source,
+        condition=CardCondition(
+            centering=_as_float(extract_value(physical_condition.get("centering"))),
+            corners=_as_float(extract_value(physical_condition.get("corners"))),
+            surface=_as_float(extract_value(physical_condition.get("surface"))),
+            estimated_grade=_as_float(extract_value(interpretation.get("estimatedGrade")))
+        )
+    )
+
+
 def parse_card_response(gemini_response: str, scan_type: str) -> list:
     """
-    Parse Gemini AI response to extract card information.
-    Handles both structured format (with cardIdentity, physicalCondition, etc.) and simple format.
+    Parse model output into compact card dicts.
+    Handles the structured format (cardIdentity, physicalCondition, etc.), wrapped in code fences or
+    surrounded by prose, and falls back to "Card Name (SET)" patterns in plain text.
     """
-    detected_cards = []
-    
+    records = []
+
     try:
-        # Try to extract JSON from the response
-        # Look for JSON array or object pattern
-        json_match = re.search(r'(\[.*\]|\{.*\})', gemini_response, re.DOTALL)
-        if json_match:
-            parsed_data = json.loads(json_match.group())
-            
-            # Both formats return an array, so check if it's a list first
-            if isinstance(parsed_data, list) and len(parsed_data) > 0:
-                container = parsed_data[0]
-                
-                if scan_type == "single":
-                    # Single card format: array with one object containing cardIdentity, physicalCondition, etc.
-                    card_identity = container.get("cardIdentity", {})
-                    physical_condition = container.get("physicalCondition", {})
-                    interpretation = container.get("interpretation", {})
-                    
-                    name = extract_value(card_identity.get("name", {}), "Unknown Card")
-                    set_code = extract_value(card_identity.get("set", {}), "")
-                    card_number = extract_value(card_identity.get("cardNumber", {}), "")
-                    year = extract_value(card_identity.get("year", {}), None)
-                    domain = extract_value(card_identity.get("domain", {}), "other")
-                    
-                    centering = extract_value(physical_condition.get("centering", {}), 0.0)
-                    corners = extract_value(physical_condition.get("corners", {}), 0.0)
-                    surface = extract_value(physical_condition.get("surface", {}), 0.0)
-                    estimated_grade = extract_value(interpretation.get("estimatedGrade", {}), 0.0)
-                    
-                    detected_cards.append({
-                        "id": str(uuid.uuid4()),
-                        "name": name if name else "Unknown Card",
-                        "set_code": set_code if set_code else "",
-                        "card_number": card_number,
-                        "year": year,
-                        "domain": domain,
-                        "confidence": 0.8,  # Default confidence
-                        "bounding_box": {"x": 0.1, "y": 0.1, "width": 0.8, "height": 0.8},
-                        "condition": {
-                            "centering": centering,
-                            "corners": corners,
-                            "surface": surface,
-                            "estimated_grade": estimated_grade
-                        }
-                    })
-                    
-                else:  # scan_type == "multi"
-                    # Multi-card format: array with object containing "cards" array
-                    cards_array = container.get("cards", [])
-                    
-                    for i, card_obj in enumerate(cards_array):
-                        card_identity = card_obj.get("cardIdentity", {})
-                        bounding_box_data = card_obj.get("boundingBox", {})
-                        physical_condition = card_obj.get("physicalCondition", {})
-                        interpretation = card_obj.get("interpretation", {})
-                        
-                        name = extract_value(card_identity.get("name", {}), "Unknown Card")
-                        set_code = extract_value(card_identity.get("set", {}), "")
-                        card_number = extract_value(card_identity.get("cardNumber", {}), "")
-                        year = extract_value(card_identity.get("year", {}), None)
-                        domain = extract_value(card_identity.get("domain", {}), "other")
-                        
-                        # Extract bounding box
-                        bbox_value = extract_value(bounding_box_data, [0.1 + (i * 0.3), 0.2, 0.25, 0.4])
-                        if isinstance(bbox_value, list) and len(bbox_value) >= 4:
-                            bbox = {"x": bbox_value[0], "y": bbox_value[1], "width": bbox_value[2], "height": bbox_value[3]}
-                        else:
-                            bbox = {"x": 0.1 + (i * 0.3), "y": 0.2, "width": 0.25, "height": 0.4}
-                        
-                        centering = extract_value(physical_condition.get("centering", {}), 0.0)
-                        corners = extract_value(physical_condition.get("corners", {}), 0.0)
-                        surface = extract_value(physical_condition.get("surface", {}), 0.0)
-                        estimated_grade = extract_value(interpretation.get("estimatedGrade", {}), 0.0)
-                        
-                        detected_cards.append({
-                            "id": str(uuid.uuid4()),
-                            "name": name if name else "Unknown Card",
-                            "set_code": set_code if set_code else "",
-                            "card_number": card_number,
-                            "year": year,
-                            "domain": domain,
-                            "confidence": 0.8,
-                            "bounding_box": bbox,
-                            "condition": {
-                                "centering": centering,
-                                "corners": corners,
-                                "surface": surface,
-                                "estimated_grade": estimated_grade
-                            }
-                        })
+        parsed_data = extract_json(gemini_response)
+        if isinstance(parsed_data, dict):
+            parsed_data = [parsed_data]
+
+        if isinstance(parsed_data, list) and parsed_data:
+            container = parsed_data[0] if isinstance(parsed_data[0], dict) else {}
+            if scan_type == "single":
+                # Single card format: array with one object containing cardIdentity, physicalCondition, etc.
+                records.append(card_record(container, 0, scan_type))
             else:
-                # Fallback: try to extract card names from text
-                # Look for patterns like "Card Name (SET_CODE)"
-                card_pattern = r'([A-Za-z0-9\s,\'\-\.]+)\s*\(([A-Z0-9]+)\)'
-                matches = re.findall(card_pattern, gemini_response)
-                for i, (name, set_code) in enumerate(matches[:5]):  # Limit to 5 cards
-                    detected_cards.append({
-                        "id": str(uuid.uuid4()),
-                        "name": name.strip(),
-                        "set_code": set_code.strip(),
-                        "confidence": 0.85 - (i * 0.05),
-                        "bounding_box": {
-                            "x": 0.1 + (i * 0.3) if scan_type == "multi" else 0.1,
-                            "y": 0.2,
-                            "width": 0.25 if scan_type == "multi" else 0.8,
-                            "height": 0.4 if scan_type == "multi" else 0.8
-                        },
-                    })
-        else:
-            # No JSON found, create placeholder
-            pass
-            
+                # Multi-card format: array with object containing "cards" array
+                cards_array = container.get("cards")
+                for i, card_obj in enumerate(cards_array if isinstance(cards_array, list) else []):
+                    if isinstance(card_obj, dict):
+                        records.append(card_record(card_obj, i, scan_type))
+        elif gemini_response and parsed_data is None:
+            # Fallback: try to extract card names from text
+            # Look for patterns like "Card Name (SET_CODE)"
+            card_pattern = r'([A-Za-z0-9\s,\'\-\.]{1,80})\s*\(([A-Z0-9]{1,10})\)'
+            matches = re.findall(card_pattern, gemini_response[:FALLBACK_SCAN_CHARS])
+            for i, (name, set_code) in enumerate(matches[:5]):  # Limit to 5 cards
+                records.append(DetectedCard(
+                    id=str(uuid.uuid4()),
+                    name=name.strip(),
+                    set_code=set_code.strip(),
+                    confidence=0.85 - (i * 0.05),
+                    bounding_box=BoundingBox(
+                        x=0.1 + (i * 0.3) if scan_type == "multi" else 0.1,
+                        y=0.2,
+                        width=0.25 if scan_type == "multi" else 0.8,
+                        height=0.4 if scan_type == "multi" else 0.8
+                    ),
+                    bbox_source="fallback" if scan_type == "multi" else None
+                ))
+
     except Exception as e:
-        print(f"Error parsing Gemini response: {e}")
-        print(f"Response was: {gemini_response}")
+        print(f"Error parsing model response: {e}")
         import traceback
         print(traceback.format_exc())
-    
+
     # If no cards detected, return at least one placeholder
-    if not detected_cards:
-        detected_cards.append({
-            "id": str(uuid.uuid4()),
-            "name": "Unknown Card",
-            "set_code": "",
-            "confidence": 0.5,
-            "bounding_box": {"x": 0.1, "y": 0.1, "width": 0.8, "height": 0.8},
-        })
-    print(f"=== DETECTED CARDS ===")
-    print(detected_cards)
-    return detected_cards
+    if not records:
+        records.append(DetectedCard(
+            id=str(uuid.uuid4()),
+            confidence=0.5,
+            bounding_box=BoundingBox(**DEFAULT_SINGLE_BOX)
+        ))
+    print(f"=== DETECTED CARDS === {len(records)}")
+    return [record.model_dump(exclude_none=True) for record in records]
 
-@app.post("/predict")
-async def predict(
-    image: UploadFile = File(...),
-    scan_type: str = Form("single")
-):
-    """
-    Use Google Gemini AI to detect and identify trading cards in the image
-    """
-    
-    # Save uploaded image
-    upload_dir = Path("uploads")
-    upload_dir.mkdir(exist_ok=True)
-    
-    file_path = upload_dir / f"{uuid.uuid4()}_{image.filename}"
-    with open(file_path, "wb") as f:
-        content = await image.read()
-        f.write(content)
-    
-    try:
-        # Load image with PIL
-        img = Image.open(file_path)
-        
-        # Create prompt based on scan type
-        if scan_type == "single":
-            prompt = """Analyze this image of a trading card. Identify the card and extract the following information in JSON format:
-[
+
+# Prompts
+SINGLE_CARD_FORMAT = """[
   {
   "imageMeta": {
     "filename": { "value": "STRING", "confidence": 1.0, "source": "detected" },
@@ -246,11 +938,14 @@ async def predict(
     "processingTimestamp": { "value": "ISO8601_STRING", "confidence": 1.0, "source": "system" }
   }
 }
-]
+]"""
+
+SINGLE_CARD_PROMPT = """Analyze this image of a trading card. Identify the card and extract the following information in JSON format:
+""" + SINGLE_CARD_FORMAT + """
 
 If you cannot identify the card, return an empty array []. Only return valid JSON, no additional text."""
-        else:
-            prompt = """Analyze this image containing multiple trading cards. Identify all visible cards and extract the following information in JSON format:
+
+MULTI_CARD_PROMPT = """Analyze this image containing multiple trading cards. Identify all visible cards and extract the following information in JSON format:
 [
   {
   "imageMeta": {
@@ -288,39 +983,399 @@ If you cannot identify the card, return an empty array []. Only return valid JSO
 
 For each card, provide approximate bounding box coordinates (0.0 to 1.0) indicating where the card appears in the image.
 If you cannot identify any cards, return an empty array []. Only return valid JSON, no additional text."""
-        
-        # Call Gemini API using the new client API
-        resp = client.models.generate_content(
-            model="gemini-2.0-flash",  # or "gemini-1.5-pro" for better accuracy
-            contents=[img, prompt]
+
+PACKED_SINGLE_CARD_PROMPT = """You are given {count} images, each showing one trading card.
+For EACH image, in the order given, produce the JSON object described below. Return a JSON array with
+exactly {count} elements, one per image in order. Use null for an image you cannot identify.
+Only return valid JSON, no additional text.
+
+Per-image object format (the single element of this array):
+"""
+
+# Batch prediction
+ML_BATCH_MAX_IMAGES = int(os.getenv("ML_BATCH_MAX_IMAGES", "50"))
+ML_BATCH_PARALLELISM = int(os.getenv("ML_BATCH_PARALLELISM", "4"))
+ML_BATCH_PACK_SIZE = int(os.getenv("ML_BATCH_PACK_SIZE", "1"))  # >1 packs single-card images into one model call
+
+
+class InferenceBackend(ABC):
+    """
+    Turns preprocessed JPEG bytes plus a prompt into model text in the Gemini JSON format,
+    so parse_card_response works unchanged whichever backend produced it.
+    """
+    name = "base"
+    model_version = "unknown"
+    supports_packing = False  # can answer for several images in one call
+
+    @abstractmethod
+    async def generate(self, images: list, prompt: str, scan_type: str) -> str:
+        ...
+
+
+class GeminiBackend(InferenceBackend):
+    name = "gemini"
+    supports_packing = True
+
+    def __init__(self, api_key: Optional[str], model: str):
+        self.api_key = api_key
+        self.model_version = model
+        self._client = None
+
+    def client(self):
+        # Created on first use so the service (and its tests) can import without credentials
+        if self._client is None:
+            if not self.api_key:
+                raise ValueError("GEMINI_API_KEY environment variable is required. Set it in your environment or docker-compose.yml")
+            self._client = genai.Client(
+                http_options=HttpOptions(api_version="v1"),
+                api_key=self.api_key
+            )
+        return self._client
+
+    async def generate(self, images: list, prompt: str, scan_type: str) -> str:
+        contents = [Part.from_bytes(data=image_bytes, mime_type="image/jpeg") for image_bytes in images]
+        resp = await self.client().aio.models.generate_content(
+            model=self.model_version,
+            contents=contents + [prompt]
         )
-        
-        # Parse response
-        gemini_text = resp.text if hasattr(resp, 'text') else str(resp)
-        detected_cards = parse_card_response(gemini_text, scan_type)
+        return resp.text if hasattr(resp, 'text') else str(resp)
 
-        print(gemini_text)
-        
-        return {
-            "success": True,
-            "detected_cards": detected_cards,
-            "total_cards": len(detected_cards),
-            "raw_response": gemini_text  # For debugging
+
+class FakeBackend(InferenceBackend):
+    """
+    Deterministic stand-in for load tests and CI. The card set, latency and injected failures are
+    all derived from a hash of the image bytes, so the same image always gets the same answer.
+    Fixtures are a JSON list of card sets; each card has name, set, cardNumber, year, domain and
+    optionally boundingBox [x, y, width, height].
+    """
+    name = "fake"
+    model_version = "fake-1"
+    supports_packing = True
+
+    def __init__(self, fixtures_path: str, latency_ms: float, jitter_ms: float, failure_rate: float, seed: str):
+        with open(fixtures_path, "r", encoding="utf-8") as f:
+            self.card_sets = json.load(f)
+        if not self.card_sets:
+            raise ValueError(f"No card sets in {fixtures_path}")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.seed = seed
+
+    def _rng(self, images: list) -> random.Random:
+        digest = hashlib.sha256(self.seed.encode("utf-8"))
+        for image_bytes in images:
+            digest.update(image_bytes)
+        return random.Random(digest.hexdigest())
+
+    @staticmethod
+    def _card_object(card: dict, index: int, count: int, with_box: bool) -> dict:
+        def field(value):
+            return {"value": value, "confidence": 0.9, "source": "detected"}
+
+        card_obj = {
+            "cardIdentity": {
+                "name": field(card.get("name")),
+                "set": field(card.get("set")),
+                "cardNumber": field(card.get("cardNumber")),
+                "year": field(card.get("year")),
+                "domain": field(card.get("domain", "other"))
+            },
+            "physicalCondition": {
+                "centering": field(card.get("centering", 8.5)),
+                "corners": field(card.get("corners", 8.5)),
+                "surface": field(card.get("surface", 8.5))
+            },
+            "interpretation": {"estimatedGrade": field(card.get("estimatedGrade", 8.5))}
         }
-        
+        if with_box:
+            box = card.get("boundingBox")
+            if not box:
+                # Lay cards out on a 3-column binder grid
+                columns = 3
+                rows = max(1, (count + columns - 1) // columns)
+                box = [
+                    (index % columns) / columns + 0.02,
+                    (index // columns) / rows + 0.02,
+                    1 / columns - 0.04,
+                    1 / rows - 0.04
+                ]
+            card_obj["boundingBox"] = field(box)
+        return card_obj
+
+    async def generate(self, images: list, prompt: str, scan_type: str) -> str:
+        rng = self._rng(images)
+        latency = max(0.0, rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(latency)
+        if rng.random() < self.failure_rate:
+            raise RuntimeError("Fake backend injected failure")
+
+        if scan_type == "multi":
+            cards = self.card_sets[rng.randrange(len(self.card_sets))]
+            return json.dumps([{
+                "cards": [self._card_object(card, i, len(cards), True) for i, card in enumerate(cards)]
+            }])
+
+        # One object per image; a packed call gets an array with one element per image
+        answers = []
+        for image_bytes in images:
+            image_rng = self._rng([image_bytes])
+            card_set = self.card_sets[image_rng.randrange(len(self.card_sets))]
+            answers.append(self._card_object(card_set[0], 0, 1, False))
+        return json.dumps(answers)
+
+
+def create_inference_backend() -> InferenceBackend:
+    if ML_BACKEND == "fake":
+        return FakeBackend(
+            ML_FAKE_FIXTURES,
+            ML_FAKE_LATENCY_MS,
+            ML_FAKE_LATENCY_JITTER_MS,
+            ML_FAKE_FAILURE_RATE,
+            ML_FAKE_SEED
+        )
+    if ML_BACKEND != "gemini":
+        raise ValueError(f"Unknown ML_BACKEND: {ML_BACKEND}")
+    if not GEMINI_API_KEY:
+        print("WARNING: GEMINI_API_KEY is not set; /predict will fail until it is")
+    return GeminiBackend(GEMINI_API_KEY, GEMINI_MODEL)
+
+
+inference_backend = create_inference_backend()
+
+
+async def generate_text(images: list, prompt: str, scan_type: str) -> str:
+    """Run the configured inference backend, behind the in-flight limit."""
+    async with inference_limiter.slot():
+        return await inference_backend.generate(images, prompt, scan_type)
+
+
+async def prepare_prediction(content: bytes, scan_type: str, use_index: bool = True) -> tuple:
+    """
+    Preprocess an upload and consult the perceptual-hash index (unless use_index is False).
+    Returns (prepared, result) where result is a finished response on a near-duplicate hit, else None.
+    """
+    # Decode, orient and downscale once; everything below works on the upright image
+    prepared = await run_cpu(preprocess_image, content, scan_type)
+    if not use_index:
+        return prepared, None
+
+    # Near-duplicate of an image we already identified? Skip the model call.
+    match = phash_index.lookup(prepared["hash"], scan_type)
+    if not match:
+        return prepared, None
+    detected_cards = map_cards_to_original(cards_from_phash_match(match, scan_type), prepared["orientation"])
+    print(f"Perceptual hash hit (distance {match['distance']}, {match['kind']})")
+    return prepared, {
+        "success": True,
+        "detected_cards": detected_cards,
+        "total_cards": len(detected_cards),
+        "phash_match": {"distance": match["distance"], "kind": match["kind"]},
+        "preprocessing": prepared["stats"],
+        "model_version": inference_backend.model_version
+    }
+
+
+async def finish_prediction(prepared: dict, gemini_text: str, scan_type: str, detector_boxes: Optional[list] = None,
+                            include_raw: bool = False) -> dict:
+    detected_cards = await run_cpu(parse_card_response, gemini_text, scan_type)
+    if detector_boxes:
+        detected_cards = reconcile_boxes(detected_cards, detector_boxes)
+
+    try:
+        await run_cpu(index_identified_image, prepared["image"], prepared["hash"], scan_type, detected_cards)
     except Exception as e:
-        print(f"Error processing image with Gemini: {e}")
-        # Fallback: return empty result
-        return {
-            "success": False,
-            "detected_cards": [],
-            "total_cards": 0,
-            "error": str(e)
-        }
+        print(f"Error updating perceptual hash index: {e}")
+
+    # Model boxes refer to the upright image; the backend crops the stored file
+    detected_cards = map_cards_to_original(detected_cards, prepared["orientation"])
+
+    result = {
+        "success": True,
+        "detected_cards": detected_cards,
+        "total_cards": len(detected_cards),
+        "preprocessing": prepared["stats"],
+        "model_version": inference_backend.model_version
+    }
+    if include_raw:
+        result["raw_response"] = gemini_text  # For debugging only; can be far larger than the cards
+    return result
+
+
+async def run_model(prepared: dict, scan_type: str, include_raw: bool = False) -> dict:
+    """Call the model for one image; multi scans run the local card detector in parallel."""
+    detect_future = None
+    if scan_type == "multi" and ML_DETECTOR_ENABLED:
+        detect_future = asyncio.ensure_future(run_cpu(detect_card_boxes, prepared["image"]))
+
+    prompt = SINGLE_CARD_PROMPT if scan_type == "single" else MULTI_CARD_PROMPT
+    gemini_text = await generate_text([prepared["bytes"]], prompt, scan_type)
+    if include_raw:
+        print(gemini_text)
+
+    detector_boxes = None
+    if detect_future is not None:
+        try:
+            detector_boxes = await detect_future
+        except Exception as e:
+            print(f"Card detector failed: {e}")
+    return await finish_prediction(prepared, gemini_text, scan_type, detector_boxes, include_raw)
+
+
+def failed_prediction(error: Exception) -> dict:
+    print(f"Error processing image with Gemini: {error}")
+    # Fallback: return empty result
+    result = {
+        "success": False,
+        "detected_cards": [],
+        "total_cards": 0,
+        "error": str(error.detail) if isinstance(error, HTTPException) else str(error)
+    }
+    if isinstance(error, HTTPException) and error.status_code == 503:
+        result["retry_after_seconds"] = ML_RETRY_AFTER_SECONDS
+    return result
+
+
+def split_packed_response(gemini_text: str, count: int) -> Optional[list]:
+    """Split a packed response into one single-card response text per image, or None if it doesn't line up."""
+    parsed = extract_json(gemini_text)
+    if not isinstance(parsed, list) or len(parsed) != count:
+        return None
+    # Each element is a card object, or null for an image the model couldn't identify
+    if not all(item is None or isinstance(item, dict) and item for item in parsed):
+        return None
+    return [json.dumps([item]) if item is not None else "[]" for item in parsed]
+
+
+async def predict_pack(pack: list, scan_type: str, include_raw: bool = False) -> list:
+    """
+    Run the model for a group of prepared images and return one result per image.
+    Several single-card images go into one call; if the packed answer can't be split, fall back to one call each.
+    """
+    if len(pack) > 1:
+        try:
+            prompt = PACKED_SINGLE_CARD_PROMPT.format(count=len(pack)) + SINGLE_CARD_FORMAT
+            gemini_text = await generate_text([prepared["bytes"] for prepared in pack], prompt, scan_type)
+            texts = split_packed_response(gemini_text, len(pack))
+            if texts is not None:
+                return [await finish_prediction(prepared, text, scan_type, include_raw=include_raw)
+                        for prepared, text in zip(pack, texts)]
+            print(f"Packed response for {len(pack)} images did not line up; retrying individually")
+        except Exception as e:
+            print(f"Packed model call failed ({e}); retrying individually")
+
+    results = []
+    for prepared in pack:
+        try:
+            results.append(await run_model(prepared, scan_type, include_raw))
+        except Exception as e:
+            results.append(failed_prediction(e))
+    return results
+
+
+@app.post("/predict")
+async def predict(
+    image: UploadFile = File(...),
+    scan_type: str = Form("single"),
+    debug: bool = Form(False),
+    bypass_cache: bool = Form(False)
+):
+    """
+    Use Google Gemini AI to detect and identify trading cards in the image.
+    Pass debug=true (or set ML_INCLUDE_RAW_RESPONSE) to also get the model's raw text back,
+    and bypass_cache=true to skip the perceptual-hash index and always call the model.
+    """
+    
+    # Read the upload into memory; images are never persisted by the ML service
+    content = await read_upload(image)
+    
+    try:
+        prepared, result = await prepare_prediction(content, scan_type, use_index=not bypass_cache)
+        if result:
+            return result
+
+        return await run_model(prepared, scan_type, debug or ML_INCLUDE_RAW_RESPONSE)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        return failed_prediction(e)
+
+@app.post("/predict/batch")
+async def predict_batch(
+    images: List[UploadFile] = File(...),
+    scan_type: str = Form("single"),
+    debug: bool = Form(False)
+):
+    """
+    Identify cards in many images. Results stream back as NDJSON, one line per image
+    ({"index": i, "filename": ..., ...same fields as /predict}) in completion order.
+    """
+    if len(images) > ML_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"At most {ML_BATCH_MAX_IMAGES} images per batch")
+
+    # Validate and read everything before streaming so bad uploads fail the request up front
+    contents = [await read_upload(image) for image in images]
+    filenames = [image.filename for image in images]
+    pack_size = ML_BATCH_PACK_SIZE if scan_type == "single" and inference_backend.supports_packing else 1
+    parallelism = asyncio.Semaphore(ML_BATCH_PARALLELISM)
+
+    def line(index: int, result: dict) -> str:
+        return json.dumps({"index": index, "filename": filenames[index], **result}) + "\n"
+
+    async def prepare_one(index: int):
+        async with parallelism:
+            try:
+                prepared, result = await prepare_prediction(contents[index], scan_type)
+            except Exception as e:
+                prepared, result = None, failed_prediction(e)
+            contents[index] = None  # Release the original bytes early
+            return index, prepared, result
+
+    async def run_pack(pack: list):
+        async with parallelism:
+            results = await predict_pack([prepared for _, prepared in pack], scan_type, debug or ML_INCLUDE_RAW_RESPONSE)
+            return [(index, result) for (index, _), result in zip(pack, results)]
+
+    async def stream():
+        needs_model = []
+        for future in asyncio.as_completed([prepare_one(i) for i in range(len(contents))]):
+            index, prepared, result = await future
+            if result is not None:
+                yield line(index, result)
+            else:
+                needs_model.append((index, prepared))
+
+        needs_model.sort(key=lambda item: item[0])
+        packs = [needs_model[i:i + pack_size] for i in range(0, len(needs_model), pack_size)]
+        for future in asyncio.as_completed([run_pack(pack) for pack in packs]):
+            for index, result in await future:
+                yield line(index, result)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "service": "ml-service"}
+    return {
+        "status": "healthy",
+        "service": "ml-service",
+        "backend": inference_backend.name,
+        "model_version": inference_backend.model_version
+    }
+
+@app.get("/stats")
+async def stats():
+    with preprocess_totals_lock:
+        totals = dict(preprocess_totals)
+    return {
+        "phash_index": phash_index.stats(),
+        "inference": inference_limiter.stats(),
+        "preprocessing": {
+            **totals,
+            "bytes_saved": totals["original_bytes"] - totals["sent_bytes"],
+            "elapsed_ms": round(totals["elapsed_ms"], 1)
+        }
+    }
 
 if __name__ == "__main__":
     import uvicorn
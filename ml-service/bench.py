@@ -0,0 +1,194 @@
+"""
+ML service benchmarks
+
+    python bench.py detector --images 50
+    python bench.py parser --cards 200
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+# The benchmarks exercise pure functions only; no model backend is needed
+os.environ.setdefault("ML_BACKEND", "fake")
+os.environ.setdefault("PHASH_INDEX_PATH", os.devnull)
+
+from PIL import Image, ImageDraw, ImageFilter
+
+import app
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def synthetic_binder_page(rng: random.Random, width: int = 1600, height: int = 1200) -> tuple:
+    """
+    Render a photographed binder page: textured background, a 3x3 grid with some pockets empty,
+    each card with a border, artwork frame and text, jittered and slightly rotated, JPEG-compressed.
+    Returns (image, ground-truth normalized boxes).
+    """
+    base = tuple(rng.randint(40, 120) for _ in range(3))
+    page = Image.new("RGB", (width, height), base)
+    noise = Image.effect_noise((width, height), 18).convert("RGB")
+    page = Image.blend(page, noise, 0.15)
+
+    card_h = int(height / 3 * 0.82)
+    card_w = int(card_h * app.CARD_ASPECT_RATIO)
+    boxes = []
+    for row in range(3):
+        for col in range(3):
+            if rng.random() < 0.2:
+                continue
+            card = Image.new("RGB", (card_w, card_h), tuple(rng.randint(170, 245) for _ in range(3)))
+            draw = ImageDraw.Draw(card)
+            margin = card_w // 12
+            draw.rectangle(
+                (margin, margin * 2, card_w - margin, card_h // 2),
+                fill=tuple(rng.randint(0, 255) for _ in range(3))
+            )
+            for line in range(4):
+                y = card_h // 2 + margin * (line + 2)
+                draw.line((margin, y, card_w - margin * rng.randint(2, 5), y), fill=(30, 30, 30), width=3)
+            angle = rng.uniform(-4, 4)
+            rotated = card.rotate(angle, expand=True, resample=Image.BICUBIC)
+            mask = Image.new("L", card.size, 255).rotate(angle, expand=True)
+            cell_x = int(width / 3 * col + (width / 3 - rotated.width) / 2) + rng.randint(-15, 15)
+            cell_y = int(height / 3 * row + (height / 3 - rotated.height) / 2) + rng.randint(-15, 15)
+            page.paste(rotated, (cell_x, cell_y), mask)
+            boxes.append({
+                "x": cell_x / width,
+                "y": cell_y / height,
+                "width": rotated.width / width,
+                "height": rotated.height / height
+            })
+
+    page = page.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    page.save(buffer, "JPEG", quality=80)
+    return Image.open(io.BytesIO(buffer.getvalue())).convert("RGB"), boxes
+
+
+def bench_detector(args):
+    rng = random.Random(args.seed)
+    fixtures = [synthetic_binder_page(rng) for _ in range(args.images)]
+
+    latencies = []
+    true_positives = false_positives = false_negatives = 0
+    ious = []
+    for img, truth in fixtures:
+        started = time.perf_counter()
+        found = app.detect_card_boxes(img)
+        latencies.append(time.perf_counter() - started)
+
+        unmatched = list(range(len(truth)))
+        for box in found:
+            best = max(unmatched, key=lambda i: app.box_iou(box, truth[i]), default=None)
+            if best is not None and app.box_iou(box, truth[best]) >= 0.5:
+                ious.append(app.box_iou(box, truth[best]))
+                unmatched.remove(best)
+                true_positives += 1
+            else:
+                false_positives += 1
+        false_negatives += len(unmatched)
+
+    precision = true_positives / max(1, true_positives + false_positives)
+    recall = true_positives / max(1, true_positives + false_negatives)
+    print(f"{args.images} synthetic binder pages, {true_positives + false_negatives} cards (seed {args.seed})")
+    print(f"precision={precision:.3f} recall={recall:.3f} mean IoU={statistics.mean(ious) if ious else 0:.3f}")
+    print(
+        f"latency: mean={statistics.mean(latencies) * 1000:.1f}ms "
+        f"p50={percentile(latencies, 0.5) * 1000:.1f}ms p95={percentile(latencies, 0.95) * 1000:.1f}ms"
+    )
+
+
+def legacy_extract_json(text: str):
+    """The greedy DOTALL regex the parser used before extract_json."""
+    json_match = re.search(r'(\[.*\]|\{.*\})', text, re.DOTALL)
+    if not json_match:
+        return None
+    try:
+        return json.loads(json_match.group())
+    except ValueError:
+        return None
+
+
+def multi_response(rng: random.Random, cards: int) -> str:
+    return json.dumps([{"cards": [
+        {
+            "cardIdentity": {
+                "name": {"value": f"Card {i}", "confidence": 0.9},
+                "set": {"value": rng.choice(["BS", "JU", "FO", "NEO"]), "confidence": 0.8},
+                "cardNumber": {"value": str(rng.randint(1, 150)), "confidence": 0.7}
+            },
+            "boundingBox": {"value": [rng.random() * 0.7, rng.random() * 0.7, 0.2, 0.3], "confidence": 0.8}
+        }
+        for i in range(cards)
+    ]}])
+
+
+def bench_parser(args):
+    rng = random.Random(args.seed)
+    well_formed = multi_response(rng, args.cards)
+    cases = {
+        f"{args.cards} cards": well_formed,
+        "fenced + trailing prose": f"Sure! [{args.cards} cards]\n```json\n{well_formed}\n```\nLet me know [if] you need more.",
+        f"unclosed '[' x{args.malformed}": "[" * args.malformed,
+        f"unclosed '{{' x{args.malformed}": "Result: " + '{"cards": [' * (args.malformed // 10),
+    }
+
+    print(f"{'case':<28}{'chars':>8}{'legacy ms':>11}{'new ms':>9}{'parse ms':>10}{'legacy ok':>11}{'cards':>7}")
+    for label, text in cases.items():
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            legacy = legacy_extract_json(text)
+        legacy_ms = (time.perf_counter() - started) * 1000 / args.repeat
+
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            app.extract_json(text)
+        new_ms = (time.perf_counter() - started) * 1000 / args.repeat
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(args.repeat):
+                cards = app.parse_card_response(text, "multi")
+        parse_ms = (time.perf_counter() - started) * 1000 / args.repeat
+
+        print(
+            f"{label:<28}{len(text):>8}{legacy_ms:>11.2f}{new_ms:>9.2f}{parse_ms:>10.2f}"
+            f"{str(legacy is not None):>11}{len(cards):>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ML service benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    detector_parser = subparsers.add_parser("detector", help="card detector accuracy and latency")
+    detector_parser.add_argument("--images", type=int, default=50)
+    detector_parser.add_argument("--seed", type=int, default=7)
+    detector_parser.set_defaults(handler=bench_detector)
+
+    parser_parser = subparsers.add_parser("parser", help="model output parsing, legacy regex vs single pass")
+    parser_parser.add_argument("--cards", type=int, default=200)
+    parser_parser.add_argument("--malformed", type=int, default=20000, help="length of the unbalanced inputs")
+    parser_parser.add_argument("--repeat", type=int, default=5)
+    parser_parser.add_argument("--seed", type=int, default=7)
+    parser_parser.set_defaults(handler=bench_parser)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())